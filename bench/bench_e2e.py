@@ -0,0 +1,44 @@
+"""
+End-to-end load test of the bot against local stand-in services, see test/e2e.py.
+Run from the repository root, summaries are rendered with fonts/arial.ttf
+    PYTHONPATH=.:test python bench/bench_e2e.py [--losses 100000] [--new 500] [--latency 0.05] [--rate-limit-every 50]
+TWEETS_PER_WINDOW, MEDIA_CONCURRENCY and the other settings are read from the environment as usual
+"""
+import asyncio
+import json
+import logging
+from argparse import ArgumentParser
+
+from oryxbot import executor_util
+from oryxbot.client_util import CLIENTS
+
+from e2e import pointed_at, run, seed
+from fake_services import FakeServices
+
+
+async def _main(args) -> dict:
+    async with FakeServices(args.latency, args.rate_limit_every, args.reset_after) as services:
+        seed(services, args.losses, args.new)
+        try:
+            with pointed_at(services):
+                return await run(services, not args.no_summaries)
+        finally:
+            await CLIENTS.close()
+            executor_util.shutdown()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--losses", help="Losses per page", type=int, default=100_000)
+    parser.add_argument("--new", help="Losses added since the previous run per page", type=int, default=500)
+    parser.add_argument("--latency", help="Seconds every Twitter request takes", type=float, default=0.05)
+    parser.add_argument("--rate-limit-every", help="Answer every Nth tweet with 429, 0 never", type=int, default=0)
+    parser.add_argument("--reset-after", help="Seconds until a 429 rate limit resets", type=float, default=1.0)
+    parser.add_argument("--no-summaries", help="Only publish the new losses", action="store_true")
+    parser.add_argument("--verbose", help="Log what the bot logs", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s:%(levelname)s:%(name)s:%(message)s')
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    print(json.dumps(asyncio.run(_main(args)), indent=1))
@@ -0,0 +1,77 @@
+"""
+Timing comparison of parser.parse_losses against the original per-link implementation
+
+    PYTHONPATH=. python bench/bench_parser.py [path/to/page.html] [--repeat N]
+"""
+import logging
+import re
+import os
+import timeit
+from argparse import ArgumentParser
+from typing import Iterator
+
+from lxml.html import HtmlElement, etree, html_parser
+
+from oryxbot.parser import Loss, Status, parse_losses
+
+
+def _extract_tails(root: HtmlElement) -> str:
+    if root is None:
+        return ''
+    res = root.tail or ''
+    for child in root.getchildren():
+        res += _extract_tails(child)
+    return res
+
+
+def parse_losses_per_link(body: bytes) -> Iterator[Loss]:
+    """
+    Original implementation: walks up to the <li> and re-extracts the type for every link
+    """
+    doc: HtmlElement = etree.fromstring(body, html_parser)
+    links = doc.findall(".//a")
+    link: HtmlElement
+    for link in links:
+        if not link.text or not link.text.startswith('(') or not link.text.endswith(')'):
+            continue
+
+        parent: HtmlElement = link
+        while parent is not None and parent.tag != 'li':
+            parent: HtmlElement = parent.getparent()
+
+        txt = _extract_tails(parent).strip()
+        match = re.match(r'\d+\W+(.+)$', txt)
+        if not match:
+            continue
+
+        for item in re.findall(r'\d+', link.text):
+            try:
+                status = next(filter(lambda x: x[1].value in link.text, enumerate(Status)))[1]
+                yield Loss(
+                    type=match.group(1).strip(':'),
+                    status=status.value,
+                    number=int(item),
+                    link='http' + link.attrib['href'].strip().split('http')[-1]
+                )
+            except Exception:
+                logging.exception(f"Failed to parse {link.text}")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("path", nargs="?", help="Oryx page to parse",
+                        default=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'test', 'last.html'))
+    parser.add_argument("--repeat", help="Number of runs per implementation", type=int, default=5)
+    args = parser.parse_args()
+
+    body = open(args.path, 'rb').read()
+    expected = list(parse_losses_per_link(body))
+    actual = list(parse_losses(body))
+    assert actual == expected, "parse_losses output differs from the per-link implementation"
+
+    print(f"{len(body)} bytes, {len(actual)} losses")
+    timings = {}
+    for name, fn in [("per-link", parse_losses_per_link), ("single-pass", parse_losses)]:
+        timings[name] = min(timeit.repeat(lambda: list(fn(body)), number=1, repeat=args.repeat))
+        print(f"{name:>12}: {timings[name] * 1000:.1f} ms")
+    print(f"     speedup: {timings['per-link'] / timings['single-pass']:.1f}x")
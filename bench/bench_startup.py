@@ -0,0 +1,79 @@
+"""
+Cold start import time of the entry point, measured with python -X importtime in fresh interpreters
+    python bench/bench_startup.py [--module oryxbot.main] [--repeat N] [--top N] [--budget MS]
+"""
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from argparse import ArgumentParser
+from collections import defaultdict
+from typing import Dict, List
+
+IMPORT_TIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+# libraries only needed to publish or to save pages, the cold path must not load them
+DEFERRED = ('tweepy', 'tweety', 'PIL', 'waybackpy', 'aiobotocore', 'botocore')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module: str) -> Dict[str, int]:
+    """
+    :param module: module to import in a fresh interpreter
+    :return: cumulative import time in microseconds per imported module
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                         env=env, capture_output=True, text=True, check=True).stderr
+    result = dict()
+    for line in out.splitlines():
+        match = IMPORT_TIME_RE.match(line)
+        if match:
+            result[match.group(4)] = int(match.group(2))
+    return result
+
+
+def loaded_modules(module: str) -> List[str]:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    out = subprocess.run([sys.executable, '-c', f'import sys, {module}; print("\\n".join(sys.modules))'],
+                         env=env, capture_output=True, text=True, check=True).stdout
+    return out.split()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--module", help="Entry point to import", default="oryxbot.main")
+    parser.add_argument("--repeat", help="Number of fresh interpreters", type=int, default=5)
+    parser.add_argument("--top", help="Number of the slowest third party modules to show", type=int, default=10)
+    parser.add_argument("--budget", help="Fail if the median import time exceeds this many ms", type=float)
+    parser.add_argument("--json", help="Write median times per module to this file")
+    args = parser.parse_args()
+
+    runs = defaultdict(list)
+    for _ in range(args.repeat):
+        for name, us in import_times(args.module).items():
+            runs[name].append(us)
+    medians = {name: statistics.median(times) for name, times in runs.items()}
+
+    print(f"{'module':<40} {'ms':>8}")
+    for name in sorted((name for name in medians if name.split('.')[0] == 'oryxbot'), key=medians.get,
+                       reverse=True):
+        print(f"{name:<40} {medians[name] / 1000:>8.1f}")
+    print()
+    top_level = {name: us for name, us in medians.items() if '.' not in name and name != 'oryxbot'}
+    for name in sorted(top_level, key=top_level.get, reverse=True)[:args.top]:
+        print(f"{name:<40} {top_level[name] / 1000:>8.1f}")
+
+    total = medians[args.module] / 1000
+    print(f"\n{args.module} total: {total:.1f} ms")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({name: us / 1000 for name, us in medians.items()}, f, indent=1, sort_keys=True)
+
+    deferred = sorted({name.split('.')[0] for name in loaded_modules(args.module)} & set(DEFERRED))
+    if deferred:
+        print(f"Deferred libraries loaded at startup: {deferred}")
+    if deferred or (args.budget and total > args.budget):
+        sys.exit(1)
@@ -0,0 +1,144 @@
+"""
+Scaling benchmarks of the pipeline stages on synthetic Oryx pages, see test/oryx_page.py.
+Results are stored as JSON baselines, compare reports the ratio of two of them per stage and size
+    PYTHONPATH=.:test python bench/bench_suite.py run [--sizes 10000 100000 500000] [--repeat N] [--out results.json]
+    PYTHONPATH=.:test python bench/bench_suite.py compare BASELINE RESULTS [--tolerance 0.1]
+"""
+import gc
+import json
+import os
+import platform
+import sys
+import timeit
+from argparse import ArgumentParser
+from datetime import datetime
+from functools import partial
+from typing import Callable, Dict
+
+from PIL import ImageFont
+
+from oryxbot.aggregation import count_losses, nest_counts
+from oryxbot.loss_table import LossTable
+from oryxbot.parser import ItemFeed, parse_losses
+from oryxbot.snapshot import PageSnapshot, loss_row, snapshot_delta
+from oryxbot.twitter_util import summary_items
+from oryxbot.txt2image import TextRenderer
+
+from oryx_page import generate_page
+
+SIZES = [10_000, 100_000, 500_000]
+# share of losses added between the previous and the current page
+GROWTH = 0.01
+FONT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fonts', 'arial.ttf')
+
+
+def _items(body: bytes, known=()) -> list:
+    feed = ItemFeed(known)
+    return feed.feed(body) + feed.close()
+
+
+def _snapshot(body: bytes) -> PageSnapshot:
+    return PageSnapshot({fingerprint: list(map(loss_row, losses)) for fingerprint, losses in _items(body)})
+
+
+def _snapshot_diff(previous: PageSnapshot, body: bytes):
+    """
+    What a run does with a changed page: parses items which are not known yet, updates the snapshot
+    and computes the delta appended to the log
+    """
+    snapshot, added = previous.update(_items(body, previous.items))
+    snapshot_delta({'russian': previous}, {'russian': snapshot})
+    return added
+
+
+def _table_difference(current: list, old: list):
+    table, previous = LossTable(), LossTable()
+    table.append_rows('russian', current)
+    previous.append_rows('russian', old)
+    return table.difference(previous)
+
+
+def _renderer() -> TextRenderer:
+    font = ImageFont.truetype(FONT, size=18) if os.path.exists(FONT) else ImageFont.load_default()
+    return TextRenderer(font, (240, 230, 10), (50, 50, 50))
+
+
+def stages(size: int) -> Dict[str, Callable]:
+    body = generate_page(size)
+    previous_body = generate_page(int(size * (1 - GROWTH)))
+    losses = [('russian', loss) for loss in parse_losses(body)]
+    rows = [loss_row(loss) for _, loss in losses]
+    old = list(map(loss_row, parse_losses(previous_body)))
+    previous = _snapshot(previous_body)
+    counts = count_losses(losses)
+    items = summary_items(counts, datetime(2023, 6, 5), datetime(2023, 7, 1))
+
+    return {
+        'parse': lambda: list(parse_losses(body)),
+        'snapshot_diff': partial(_snapshot_diff, previous, body),
+        'table_difference': partial(_table_difference, rows, old),
+        'aggregate': lambda: nest_counts(count_losses(losses)),
+        # a fresh renderer every time, the metric cache would hide the cost of a cold render
+        'render': lambda: _renderer().render_png(items, header=2),
+    }
+
+
+def run(sizes, repeat: int, only=None) -> dict:
+    results = dict()
+    for size in sizes:
+        for name, fn in stages(size).items():
+            if only and name not in only:
+                continue
+            gc.collect()
+            seconds = min(timeit.repeat(fn, number=1, repeat=repeat))
+            results.setdefault(name, dict())[str(size)] = seconds
+            print(f"{name:>17} {size:>8}: {seconds * 1000:10.1f} ms", flush=True)
+    return {'meta': {'python': platform.python_version(), 'machine': platform.machine(),
+                     'processor': platform.processor(), 'font': os.path.exists(FONT),
+                     'created': datetime.utcnow().isoformat(timespec='seconds'), 'repeat': repeat},
+            'results': results}
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> bool:
+    """
+    Prints current / baseline time per stage and size
+    :return: whether every stage is within tolerance of the baseline
+    """
+    ok = True
+    print(f"{'stage':>17} {'size':>8} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, sizes in current['results'].items():
+        for size, seconds in sizes.items():
+            base = baseline['results'].get(name, {}).get(size)
+            if base is None:
+                print(f"{name:>17} {size:>8} {'-':>10} {seconds * 1000:10.1f}")
+                continue
+            ratio = seconds / base
+            slower = ratio > 1 + tolerance
+            ok &= not slower
+            print(f"{name:>17} {size:>8} {base * 1000:10.1f} {seconds * 1000:10.1f} {ratio:6.2f}x"
+                  f"{' slower' if slower else ''}")
+    return ok
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--sizes", help="Numbers of losses per page", type=int, nargs="+", default=SIZES)
+    run_parser.add_argument("--repeat", help="Number of runs per stage, the fastest is kept", type=int, default=3)
+    run_parser.add_argument("--stage", help="Only run these stages", nargs="+")
+    run_parser.add_argument("--out", help="Write results to this file")
+    compare_parser = commands.add_parser("compare", help="Compare results with a baseline")
+    compare_parser.add_argument("baseline", help="Baseline results")
+    compare_parser.add_argument("results", help="Results to compare")
+    compare_parser.add_argument("--tolerance", help="Allowed slowdown, 0.1 is 10%%", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        data = run(args.sizes, args.repeat, args.stage)
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(data, f, indent=1)
+    else:
+        with open(args.baseline) as f, open(args.results) as g:
+            sys.exit(0 if compare(json.load(f), json.load(g), args.tolerance) else 1)
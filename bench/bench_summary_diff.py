@@ -0,0 +1,75 @@
+"""
+Timing comparison of the summary diff against the original implementation, which parsed Wayback captures
+into Loss objects and diffed them as a set of rows. Compares a capture of the page against the current rows,
+first the diff alone and then together with parsing the capture and counting the new losses
+    PYTHONPATH=.:test python bench/bench_summary_diff.py [path/to/page.html] [--sizes 100000 300000] [--repeat N]
+"""
+import os
+import timeit
+from argparse import ArgumentParser
+from typing import List, Tuple
+
+from oryxbot.aggregation import count_losses
+from oryxbot.executor_util import parse_body
+from oryxbot.loss_table import LossTable
+from oryxbot.parser import Loss, LossFeed, Row, RowFeed, parse_losses
+from oryxbot.snapshot import loss_row
+
+from oryx_page import generate_page
+
+# share of losses added since the capture in synthetic pages
+GROWTH = 0.01
+
+
+def diff_losses(current: List[Row], old: List[Loss]) -> List[Tuple[str, Loss]]:
+    """
+    Original implementation: rows of the capture are built from parsed Loss objects
+    """
+    old = set(map(loss_row, old))
+    return [('russian', Loss(*row)) for row in current if row not in old]
+
+
+def diff_table(current: List[Row], old: List[Row]) -> LossTable:
+    table, previous = LossTable(), LossTable()
+    table.append_rows('russian', current)
+    previous.append_rows('russian', old)
+    return table.difference(previous)
+
+
+def summary_losses(current: List[Row], body: bytes) -> dict:
+    return count_losses(diff_losses(current, parse_body(LossFeed, body)))
+
+
+def summary_table(current: List[Row], body: bytes) -> dict:
+    return diff_table(current, parse_body(RowFeed, body)).counts()
+
+
+def compare(name: str, body: bytes, previous_body: bytes, repeat: int):
+    current = list(map(loss_row, parse_losses(body)))
+    old_losses, old_rows = parse_body(LossFeed, previous_body), parse_body(RowFeed, previous_body)
+    assert summary_table(current, previous_body) == summary_losses(current, previous_body), \
+        "summary differs from the original implementation"
+
+    print(f"{name}: {len(current)} losses, {len(current) - len(old_rows)} new")
+    for stage, original, table in [
+        ("diff", lambda: diff_losses(current, old_losses), lambda: diff_table(current, old_rows)),
+        ("parse+diff+counts", lambda: summary_losses(current, previous_body),
+         lambda: summary_table(current, previous_body)),
+    ]:
+        before = min(timeit.repeat(original, number=1, repeat=repeat))
+        after = min(timeit.repeat(table, number=1, repeat=repeat))
+        print(f"{stage:>18}: {before * 1000:8.1f} ms -> {after * 1000:8.1f} ms, {before / after:.1f}x")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("path", nargs="?", help="Oryx page compared against an identical capture",
+                        default=os.path.join(os.path.dirname(os.path.dirname(__file__)), 'test', 'last.html'))
+    parser.add_argument("--sizes", help="Losses of synthetic pages", type=int, nargs='*', default=[100_000, 300_000])
+    parser.add_argument("--repeat", help="Number of runs per implementation", type=int, default=5)
+    args = parser.parse_args()
+
+    page = open(args.path, 'rb').read()
+    compare(os.path.basename(args.path), page, page, args.repeat)
+    for size in args.sizes:
+        compare(f"synthetic {size}", generate_page(size), generate_page(int(size * (1 - GROWTH))), args.repeat)
@@ -0,0 +1,76 @@
+from collections import Counter, defaultdict
+from datetime import date
+from typing import Dict, Iterable, Optional, Tuple
+
+from oryxbot.parser import Loss
+
+Counts = Dict[Tuple[str, str, str], int]
+
+
+def count_losses(losses: Iterable[Tuple[str, Loss]]) -> Counts:
+    """
+    Number of losses per (country, type, status) in a single pass, in order of first appearance
+    :param losses: (country, loss) to count
+    """
+    return dict(Counter((country, loss.type, loss.status) for country, loss in losses))
+
+
+def merge_counts(counts: Iterable[Counts]) -> Counts:
+    result = Counter()
+    for item in counts:
+        result.update(item)
+    return dict(result)
+
+
+def nest_counts(counts: Counts) -> Dict[str, Dict[str, Dict[str, int]]]:
+    """
+    :return: country -> type -> status -> count
+    """
+    result = defaultdict(dict)
+    for (country, type_, status), count in counts.items():
+        result[country].setdefault(type_, dict())[status] = count
+    return result
+
+
+class Rollups:
+    """
+    Counts of new losses found per day. Rollups cover every day since the first one recorded,
+    days without new losses are simply absent
+    """
+
+    def __init__(self, first: Optional[date] = None, days: Optional[Dict[date, Counts]] = None):
+        self.first = first
+        self.days: Dict[date, Counts] = days or dict()
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'Rollups':
+        if not data:
+            return cls()
+        return cls(date.fromisoformat(data['first']),
+                   {date.fromisoformat(day): {(country, type_, status): count
+                                              for country, type_, status, count in rows}
+                    for day, rows in data['days'].items()})
+
+    def to_json(self) -> dict:
+        return {'first': self.first.isoformat(),
+                'days': {day.isoformat(): [[*key, count] for key, count in counts.items()]
+                         for day, counts in sorted(self.days.items())}}
+
+    def add(self, day: date, counts: Counts) -> bool:
+        """
+        :return: whether rollups changed
+        """
+        changed = bool(counts)
+        if self.first is None or day < self.first:
+            self.first = day
+            changed = True
+        if counts:
+            self.days[day] = merge_counts([self.days.get(day, {}), counts])
+        return changed
+
+    def covers(self, from_date: date) -> bool:
+        # the first day is partial, losses found before rollups were recorded are missing from it
+        return self.first is not None and self.first < from_date
+
+    def since(self, from_date: date) -> Counts:
+        return merge_counts(counts for day, counts in self.days.items() if day >= from_date)
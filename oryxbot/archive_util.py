@@ -1,30 +1,176 @@
 from __future__ import annotations
 
+import asyncio
 import logging
-from datetime import date, datetime
+import re
+from datetime import date, datetime, time, timedelta
+from itertools import chain
+from typing import Dict, List, Tuple
 
 from aiohttp import ClientSession
 from dateutil.parser import parse as parse_dt
-from waybackpy import Url
+
+from oryxbot.cache_util import SnapshotCache, snapshot_cache
+from oryxbot.executor_util import parse_body, parse_chunks, run_cpu
+from oryxbot.metrics import count, span
+from oryxbot.parser import Row, RowFeed
 
 WAYBACK_URL = "https://archive.org/wayback/available"
+CDX_URL = "https://web.archive.org/cdx/search/cdx"
+# id_ replays the archived bytes as they were captured, without the Wayback toolbar and rewritten links
+REPLAY_URL = "https://web.archive.org/web/{timestamp}id_/{url}"
+REPLAY_RE = re.compile(r'/web/(\d+)/(.+)$')
+CDX_WINDOW = timedelta(days=7)
+CHUNK_SIZE = 64 * 1024
+
+
+def _raw_url(snapshot_url: str) -> str:
+    match = REPLAY_RE.search(snapshot_url)
+    return REPLAY_URL.format(timestamp=match.group(1), url=match.group(2)) if match else snapshot_url
 
 
-async def url_snapshot(session: ClientSession, url: str, dt: date | None):
+async def _snapshot_url(session: ClientSession, url: str, dt: date | None) -> Tuple[str, datetime]:
     if dt is None:
-        async with session.get(url) as r:
-            return await r.read(), datetime.utcnow()
+        return url, datetime.utcnow()
+
+    with span('wayback_lookup'):
+        async with session.get(WAYBACK_URL, params={"url": url, "timestamp": dt.strftime("%Y%m%d")}) as r:
+            data = await r.json()
+    closest = data.get('archived_snapshots', {}).get('closest', {})
+    if closest['status'] != "200":
+        raise Exception(f"Unable to retrieve snapshot: {data}")
+    return _raw_url(closest['url']), parse_dt(closest['timestamp'])
+
+
+def _windows(dates: List[date]) -> List[List[date]]:
+    """
+    Groups dates whose CDX windows overlap, dates far apart get a query of their own
+    """
+    groups = list()
+    for dt in sorted(set(dates)):
+        if groups and dt - groups[-1][-1] <= 2 * CDX_WINDOW:
+            groups[-1].append(dt)
+        else:
+            groups.append([dt])
+    return groups
+
+
+async def _captures(session: ClientSession, url: str, dates: List[date]) -> List[Tuple[datetime, str, str]]:
+    params = {"url": url, "output": "json", "fl": "timestamp,original", "filter": "statuscode:200",
+              "collapse": "timestamp:10",
+              "from": (min(dates) - CDX_WINDOW).strftime("%Y%m%d"), "to": (max(dates) + CDX_WINDOW).strftime("%Y%m%d")}
+    with span('wayback_cdx'):
+        async with session.get(CDX_URL, params=params) as r:
+            rows = (await r.json(content_type=None) or [])[1:]
+    return [(datetime.strptime(timestamp, "%Y%m%d%H%M%S"), timestamp, original) for timestamp, original in rows]
+
+
+async def resolve_snapshots(session: ClientSession, url: str, dates: List[date]) -> Dict[date, Tuple[str, datetime]]:
+    """
+    Resolves the closest snapshot of every date with a CDX query per group of nearby dates,
+    dates without captures around them fall back to the availability API
+    :param session: http session
+    :param url: page url
+    :param dates: snapshot dates
+    :return: raw snapshot url and its time per date
+    """
+    captures = list(chain.from_iterable(
+        await asyncio.gather(*[_captures(session, url, group) for group in _windows(dates)])))
+
+    result = dict()
+    for dt in dates:
+        target = datetime.combine(dt, time())
+        closest = min(captures, key=lambda x: abs(x[0] - target), default=None)
+        if closest is None or abs(closest[0] - target) > CDX_WINDOW:
+            result[dt] = await _snapshot_url(session, url, dt)
+        else:
+            result[dt] = REPLAY_URL.format(timestamp=closest[1], url=closest[2]), closest[0]
+    return result
+
 
-    async with session.get(WAYBACK_URL, params={"url": url, "timestamp": dt.strftime("%Y%m%d")}) as r:
-        data = await r.json()
-        closest = data.get('archived_snapshots', {}).get('closest', {})
-        if closest['status'] != "200":
-            raise Exception(f"Unable to retrieve snapshot: {data}")
-    async with session.get(closest['url']) as r:
-        return await r.read(), parse_dt(closest['timestamp'])
+async def snapshot_body(session: ClientSession, snapshot_url: str, cache: SnapshotCache | None) -> bytes:
+    body = cache.get_body(snapshot_url) if cache else None
+    if body is None:
+        with span('wayback_fetch'):
+            async with session.get(snapshot_url) as r:
+                body = await r.read()
+        count('wayback_bytes', len(body))
+        if cache:
+            cache.put_body(snapshot_url, body)
+    return body
+
+
+async def url_snapshot(session: ClientSession, url: str, dt: date | None, cache: SnapshotCache | None = None):
+    snapshot_url, timestamp = await _snapshot_url(session, url, dt)
+    return await snapshot_body(session, snapshot_url, (cache or snapshot_cache()) if dt else None), timestamp
+
+
+async def _snapshot_rows(session: ClientSession, snapshot_url: str, cache: SnapshotCache | None) -> List[Row]:
+    if not cache:
+        with span('wayback_fetch'):
+            async with session.get(snapshot_url) as r:
+                return await parse_chunks(RowFeed, r.content.iter_chunked(CHUNK_SIZE),
+                                          lambda chunk: count('wayback_bytes', len(chunk)))
+
+    rows = cache.get_rows(snapshot_url)
+    if rows is not None:
+        count('snapshot_cache_hits')
+        return rows
+
+    body = cache.get_body(snapshot_url)
+    if body is None:
+        chunks = list()
+        with span('wayback_fetch'):
+            async with session.get(snapshot_url) as r:
+                rows = await parse_chunks(RowFeed, r.content.iter_chunked(CHUNK_SIZE), chunks.append)
+        body = b''.join(chunks)
+        count('wayback_bytes', len(body))
+        cache.put_body(snapshot_url, body)
+    else:
+        count('snapshot_cache_hits')
+        rows = await run_cpu(parse_body, RowFeed, body)
+
+    cache.put_rows(snapshot_url, rows)
+    return rows
+
+
+async def url_rows(session: ClientSession, url: str, dt: date | None,
+                   cache: SnapshotCache | None = None) -> Tuple[List[Row], datetime]:
+    """
+    Same as url_snapshot, but parses the page into rows of losses while it is being downloaded instead of
+    buffering it. Archived snapshots are served from the cache, parsed rows first and then the raw body
+    :param session: http session
+    :param url: page url
+    :param dt: snapshot date, None for the live page
+    :param cache: snapshot cache, configured by SNAPSHOT_CACHE_DIR if None
+    :return: rows and the snapshot time
+    """
+    snapshot_url, timestamp = await _snapshot_url(session, url, dt)
+    return await _snapshot_rows(session, snapshot_url, (cache or snapshot_cache()) if dt else None), timestamp
+
+
+async def url_history_rows(session: ClientSession, url: str, dates: List[date],
+                           cache: SnapshotCache | None = None) -> List[Tuple[List[Row], datetime]]:
+    """
+    Rows of losses of the page at every date, snapshots are resolved with one CDX query
+    and each distinct snapshot is downloaded once
+    :param session: http session
+    :param url: page url
+    :param dates: snapshot dates
+    :param cache: snapshot cache, configured by SNAPSHOT_CACHE_DIR if None
+    :return: rows and the snapshot time per date
+    """
+    cache = cache or snapshot_cache()
+    resolved = await resolve_snapshots(session, url, dates)
+    snapshot_urls = list(dict.fromkeys(snapshot_url for snapshot_url, _ in resolved.values()))
+    rows = dict(zip(snapshot_urls, await asyncio.gather(*[_snapshot_rows(session, snapshot_url, cache)
+                                                           for snapshot_url in snapshot_urls])))
+    return [(rows[resolved[dt][0]], resolved[dt][1]) for dt in dates]
 
 
 def save_url(url: str):
+    from waybackpy import Url
+
     new = Url(
         url=url,
         user_agent="Mozilla/5.0 (Windows NT 5.1; rv:40.0) Gecko/20100101 Firefox/40.0"
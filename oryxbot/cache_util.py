@@ -0,0 +1,79 @@
+import hashlib
+import logging
+import os
+from typing import List, Optional
+
+from oryxbot.parser import Row
+from oryxbot.snapshot import PageSnapshot, decode_snapshots, encode_snapshots
+
+SNAPSHOT_CACHE_DIR = os.getenv('SNAPSHOT_CACHE_DIR')
+SNAPSHOT_CACHE_MAX_BYTES = int(os.getenv('SNAPSHOT_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+SNAPSHOT_CACHE_PARSED = os.getenv('SNAPSHOT_CACHE_PARSED', '1') == '1'
+
+
+class SnapshotCache:
+    """
+    On-disk cache of immutable Wayback snapshots, entries are addressed by the hash of the snapshot url
+    which already contains its timestamp. Bodies are stored as is, the optional parsed layer keeps
+    losses in the compact snapshot format. Least recently used entries are evicted once the cache
+    grows over max_bytes
+    """
+
+    def __init__(self, path: str, max_bytes: int = SNAPSHOT_CACHE_MAX_BYTES, parsed: bool = SNAPSHOT_CACHE_PARSED):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.parsed = parsed
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key: str, kind: str) -> str:
+        return os.path.join(self.path, f"{hashlib.sha256(key.encode()).hexdigest()}.{kind}")
+
+    def _read(self, key: str, kind: str) -> Optional[bytes]:
+        path = self._file(key, kind)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return data
+
+    def _write(self, key: str, kind: str, data: bytes):
+        path = self._file(key, kind)
+        with open(f"{path}.tmp", 'wb') as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+        self._evict()
+
+    def _evict(self):
+        entries = [entry for entry in os.scandir(self.path) if entry.is_file() and not entry.name.endswith('.tmp')]
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in sorted(entries, key=lambda x: x.stat().st_mtime):
+            if total <= self.max_bytes:
+                break
+            total -= entry.stat().st_size
+            os.remove(entry.path)
+            logging.info(f"Evicted {entry.name} from snapshot cache")
+
+    def get_body(self, key: str) -> Optional[bytes]:
+        return self._read(key, 'html')
+
+    def put_body(self, key: str, body: bytes):
+        self._write(key, 'html', body)
+
+    def get_rows(self, key: str) -> Optional[List[Row]]:
+        data = self._read(key, 'losses') if self.parsed else None
+        if data is None:
+            return None
+        return list(decode_snapshots(data)['losses'].rows())
+
+    def put_rows(self, key: str, rows: List[Row]):
+        if self.parsed:
+            self._write(key, 'losses', encode_snapshots({'losses': PageSnapshot({'': rows})}))
+
+
+def snapshot_cache() -> Optional[SnapshotCache]:
+    """
+    Cache configured with SNAPSHOT_CACHE_DIR, None if caching is disabled
+    """
+    return SnapshotCache(SNAPSHOT_CACHE_DIR) if SNAPSHOT_CACHE_DIR else None
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from typing import TYPE_CHECKING, Optional
+
+from aiohttp import ClientSession, TCPConnector
+
+if TYPE_CHECKING:
+    from requests import Session
+    from tweepy import API, Client
+    from tweety.bot import Twitter
+
+HTTP_LIMIT = int(os.getenv('HTTP_LIMIT', '32'))
+HTTP_LIMIT_PER_HOST = int(os.getenv('HTTP_LIMIT_PER_HOST', '8'))
+DNS_CACHE_TTL = int(os.getenv('DNS_CACHE_TTL', '600'))
+API_POOL_SIZE = int(os.getenv('API_POOL_SIZE', '8'))
+
+
+def _pooled(session: Session) -> Session:
+    from requests.adapters import HTTPAdapter
+
+    adapter = HTTPAdapter(pool_connections=API_POOL_SIZE, pool_maxsize=API_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class ClientRegistry:
+    """
+    Process wide API clients, each one is created on first use and keeps its connections alive afterwards.
+    Twitter libraries are only imported then, runs without anything to publish don't load them.
+    aiohttp sessions share a single connector with connection limits and DNS cache
+    """
+
+    def __init__(self):
+        self._connector: Optional[TCPConnector] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._media_api: Optional[API] = None
+        self._tweet_client: Optional[Client] = None
+        self._reader: Optional[Twitter] = None
+
+    def session(self, **kwargs) -> ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._connector is None or self._connector.closed or self._loop is not loop:
+            self._connector = TCPConnector(limit=HTTP_LIMIT, limit_per_host=HTTP_LIMIT_PER_HOST,
+                                           ttl_dns_cache=DNS_CACHE_TTL)
+            self._loop = loop
+        return ClientSession(connector=self._connector, connector_owner=False, **kwargs)
+
+    def media_api(self) -> API:
+        """
+        v1.1 API, used for media uploads
+        """
+        if self._media_api is None:
+            from tweepy import API, OAuthHandler
+
+            auth = OAuthHandler(consumer_key=os.environ['CONSUMER_KEY'],
+                                consumer_secret=os.environ['CONSUMER_SECRET'])
+            auth.set_access_token(key=os.environ['ACCESS_TOKEN'], secret=os.environ['ACCESS_TOKEN_SECRET'])
+            self._media_api = API(auth)
+            _pooled(self._media_api.session)
+        return self._media_api
+
+    def tweet_client(self) -> Client:
+        """
+        v2 API, used to post tweets
+        """
+        if self._tweet_client is None:
+            from tweepy import Client
+
+            self._tweet_client = Client(
+                consumer_key=os.environ['CONSUMER_KEY'],
+                consumer_secret=os.environ['CONSUMER_SECRET'],
+                access_token=os.environ['ACCESS_TOKEN'],
+                access_token_secret=os.environ['ACCESS_TOKEN_SECRET'],
+            )
+            _pooled(self._tweet_client.session)
+        return self._tweet_client
+
+    def reader(self) -> Twitter:
+        """
+        Tweet detail reader, creating one fetches a guest token
+        """
+        if self._reader is None:
+            from tweety.bot import Twitter
+
+            self._reader = Twitter()
+        return self._reader
+
+    async def close(self):
+        if self._connector is not None and not self._connector.closed:
+            await self._connector.close()
+        self._connector = None
+
+
+CLIENTS = ClientRegistry()
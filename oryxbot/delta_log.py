@@ -0,0 +1,92 @@
+import asyncio
+import os
+from bisect import bisect_right
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+from oryxbot.snapshot import PageSnapshot, SnapshotDelta, apply_delta, decode_delta, decode_snapshots, \
+    encode_delta, encode_snapshots
+
+CHECKPOINT_EVERY = int(os.getenv('S3_LOG_CHECKPOINT_EVERY', '50'))
+
+
+async def _empty() -> bytes:
+    return b''
+
+
+class DeltaLog:
+    """
+    Append-only log of snapshot deltas on top of s3_client get/put with periodic checkpoints of the full state.
+
+    <prefix>head.json lists every entry as [seq, timestamp] for deltas and checkpoints,
+    <prefix><seq>.delta holds the items changed by a run and <prefix><seq>.checkpoint the state after it.
+    The head is written last so a failed append is never visible to readers
+    """
+
+    def __init__(self, get: Callable[..., Awaitable], put: Callable[..., Awaitable], prefix: str,
+                 checkpoint_every: int = CHECKPOINT_EVERY):
+        self._get = get
+        self._put = put
+        self._prefix = prefix
+        self._checkpoint_every = checkpoint_every
+        self._head: Optional[dict] = None
+
+    def _key(self, seq: int, kind: str) -> str:
+        return f"{self._prefix}{seq:010d}.{kind}"
+
+    async def head(self) -> dict:
+        if self._head is None:
+            self._head = {'seq': 0, 'deltas': [], 'checkpoints': []}
+            self._head.update(await self._get(f"{self._prefix}head.json"))
+        return self._head
+
+    async def next_seq(self) -> int:
+        """
+        Sequence number of the next appended delta
+        """
+        return (await self.head())['seq'] + 1
+
+    async def exists(self) -> bool:
+        return (await self.head())['seq'] > 0
+
+    async def state_at(self, at: Optional[datetime] = None) -> Dict[str, PageSnapshot]:
+        """
+        Rebuilds the state from the closest checkpoint and the deltas appended after it
+        :param at: point in time, the latest state if None
+        :return: snapshot per country
+        """
+        head = await self.head()
+        stamp = (at or datetime.max).isoformat()
+
+        checkpoints = [entry for entry in head['checkpoints'] if entry[1] <= stamp]
+        start = checkpoints[-1][0] if checkpoints else 0
+        deltas = head['deltas'][bisect_right([seq for seq, _ in head['deltas']], start):]
+        deltas = [seq for seq, timestamp in deltas if timestamp <= stamp]
+
+        bodies = await asyncio.gather(*[self._get(self._key(seq, 'delta'), raw=True) for seq in deltas],
+                                      self._get(self._key(start, 'checkpoint'), raw=True) if start else _empty())
+        state = decode_snapshots(bodies[-1])
+        for body in bodies[:-1]:
+            state = apply_delta(state, decode_delta(body))
+        return state
+
+    async def append(self, delta: SnapshotDelta, state: Dict[str, PageSnapshot], at: datetime):
+        """
+        Appends the delta, the full state is stored as a checkpoint every checkpoint_every entries
+        :param delta: items changed since the previous entry
+        :param state: state after applying the delta
+        :param at: time of the change
+        """
+        head = await self.head()
+        seq = head['seq'] + 1
+        stamp = at.isoformat()
+
+        await self._put(self._key(seq, 'delta'), encode_delta(delta))
+        last_checkpoint = head['checkpoints'][-1][0] if head['checkpoints'] else 0
+        if not last_checkpoint or seq - last_checkpoint >= self._checkpoint_every:
+            await self._put(self._key(seq, 'checkpoint'), encode_snapshots(state))
+            head['checkpoints'].append([seq, stamp])
+
+        head['seq'] = seq
+        head['deltas'].append([seq, stamp])
+        await self._put(f"{self._prefix}head.json", head)
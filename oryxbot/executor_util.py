@@ -0,0 +1,85 @@
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, AsyncIterable, Callable, Optional, Tuple
+
+from oryxbot.metrics import count
+from oryxbot.parser import LossFeed
+
+# thread: lxml releases the GIL while parsing, process: parsing in separate interpreters, none: on the event loop
+PARSE_EXECUTOR = os.getenv('PARSE_EXECUTOR', 'thread')
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', str(os.cpu_count() or 1)))
+
+_executor: Optional[Executor] = None
+
+
+def parse_executor() -> Optional[Executor]:
+    """
+    Process wide pool configured with PARSE_EXECUTOR and PARSE_WORKERS, None when parsing runs on the event loop
+    """
+    global _executor
+    if _executor is None and PARSE_EXECUTOR != 'none':
+        pool = ProcessPoolExecutor if PARSE_EXECUTOR == 'process' else ThreadPoolExecutor
+        _executor = pool(max_workers=PARSE_WORKERS)
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+
+def _timed(func: Callable, *args) -> Tuple[Any, float]:
+    # CPU time of the worker thread, queueing in the pool doesn't count
+    start = time.thread_time()
+    result = func(*args)
+    return result, time.thread_time() - start
+
+
+async def run_cpu(func: Callable, *args):
+    """
+    Runs CPU bound func in the parse executor. With processes func and args have to be picklable
+    """
+    executor = parse_executor()
+    if executor is None:
+        result, seconds = _timed(func, *args)
+    else:
+        result, seconds = await asyncio.get_running_loop().run_in_executor(executor, _timed, func, *args)
+    count('cpu_seconds', seconds)
+    return result
+
+
+def parse_body(factory: Callable[[], LossFeed], body: bytes) -> list:
+    feed = factory()
+    return feed.feed(body) + feed.close()
+
+
+async def parse_chunks(factory: Callable[[], LossFeed], chunks: AsyncIterable[bytes],
+                       on_chunk: Optional[Callable[[bytes], None]] = None) -> list:
+    """
+    Parses a page off the event loop while it is being downloaded. Parsers can't move between processes,
+    so with the process executor the body is buffered and parsed at once when the download completes
+    :param factory: creates the feed, has to be picklable with the process executor
+    :param chunks: page content, e.g. ClientResponse.content.iter_chunked()
+    :param on_chunk: called with every chunk on the event loop
+    :return: what the feed produced, in document order
+    """
+    if isinstance(parse_executor(), ProcessPoolExecutor):
+        body = bytearray()
+        async for chunk in chunks:
+            if on_chunk:
+                on_chunk(chunk)
+            body.extend(chunk)
+        return await run_cpu(parse_body, factory, bytes(body))
+
+    feed = factory()
+    result = list()
+    async for chunk in chunks:
+        if on_chunk:
+            on_chunk(chunk)
+        result.extend(await run_cpu(feed.feed, chunk))
+    result.extend(await run_cpu(feed.close))
+    return result
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import os
+from bisect import bisect_right
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from oryxbot.archive_util import resolve_snapshots, snapshot_body
+from oryxbot.cache_util import snapshot_cache
+from oryxbot.client_util import CLIENTS
+from oryxbot.loss_table import LossTable
+from oryxbot.parser import ItemFeed
+from oryxbot.snapshot import PageSnapshot, decode_snapshots, encode_snapshots, loss_row
+
+HISTORY_DIR = os.getenv('HISTORY_DIR', 'history')
+BACKFILL_CONCURRENCY = int(os.getenv('BACKFILL_CONCURRENCY', '4'))
+
+TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
+
+
+class HistoryStore:
+    """
+    Local day by day history of the pages. Every distinct capture is stored once per country
+    in the compact snapshot format as <country>/<timestamp>.oryx, index.json maps days to captures
+    """
+
+    def __init__(self, path: str = HISTORY_DIR):
+        self.path = path
+        self._index: Optional[Dict[str, Dict[str, str]]] = None
+        self._load = lru_cache(maxsize=8)(self._read)
+
+    def _file(self, country: str, timestamp: str) -> str:
+        return os.path.join(self.path, country, f"{timestamp}.oryx")
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", 'wb') as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+
+    def _read(self, country: str, timestamp: str) -> PageSnapshot:
+        with open(self._file(country, timestamp), 'rb') as f:
+            return decode_snapshots(f.read())[country]
+
+    @property
+    def index(self) -> Dict[str, Dict[str, str]]:
+        if self._index is None:
+            try:
+                with open(os.path.join(self.path, 'index.json')) as f:
+                    self._index = json.load(f)
+            except FileNotFoundError:
+                self._index = dict()
+        return self._index
+
+    def days(self) -> List[date]:
+        return sorted(map(date.fromisoformat, self.index))
+
+    def has_capture(self, country: str, timestamp: str) -> bool:
+        return os.path.exists(self._file(country, timestamp))
+
+    def put_capture(self, country: str, timestamp: str, body: bytes):
+        """
+        :param body: snapshot of the country encoded with encode_snapshots
+        """
+        self._write(self._file(country, timestamp), body)
+
+    def put_days(self, days: Dict[date, Dict[str, str]]):
+        """
+        Maps days to stored captures
+        :param days: timestamp of the capture per country for every day
+        """
+        self.index.update((day.isoformat(), captures) for day, captures in days.items())
+        self._write(os.path.join(self.path, 'index.json'), json.dumps(self.index, sort_keys=True).encode())
+
+    def stored_day(self, day: date) -> date:
+        """
+        The closest stored day at or before day, pages of a day missing from the history
+        are the same as of the last capture before it
+        """
+        days = self.days()
+        position = bisect_right(days, day)
+        if not position:
+            stored = f"stored days are {days[0]} to {days[-1]}" if days else f"nothing is stored in {self.path}"
+            raise ValueError(f"No history on or before {day}, {stored}")
+        return days[position - 1]
+
+    def get(self, day: date) -> Dict[str, PageSnapshot]:
+        captures = self.index[self.stored_day(day).isoformat()]
+        return {country: self._load(country, timestamp) for country, timestamp in captures.items()}
+
+    def table(self, day: date) -> LossTable:
+        table = LossTable()
+        for country, snapshot in self.get(day).items():
+            table.append_rows(country, snapshot.rows())
+        return table
+
+    def diff(self, from_day: date, to_day: date) -> LossTable:
+        """
+        Losses present on to_day which were not there on from_day, no network access needed
+        """
+        return self.table(to_day).difference(self.table(from_day))
+
+
+def encode_page(country: str, body: bytes) -> bytes:
+    """
+    Parses a page and encodes it as a snapshot, runs in worker processes
+    :param country: country of the page
+    :param body: page content
+    :return: snapshot encoded with encode_snapshots
+    """
+    feed = ItemFeed()
+    items = feed.feed(body) + feed.close()
+    return encode_snapshots({country: PageSnapshot({fingerprint: list(map(loss_row, losses))
+                                                    for fingerprint, losses in items})})
+
+
+async def backfill(urls: Dict[str, str], from_day: date, to_day: date, store: HistoryStore,
+                   concurrency: int = BACKFILL_CONCURRENCY, executor: Optional[Executor] = None):
+    """
+    Stores the closest Wayback capture of every page for every day in the range. Captures are downloaded
+    by at most concurrency requests at a time and parsed in a process pool, days already in the store
+    and captures shared by several days are only processed once
+    :param urls: page url -> country
+    :param from_day: first day
+    :param to_day: last day, inclusive
+    :param store: history store
+    :param concurrency: maximum number of concurrent downloads
+    :param executor: pool to parse pages in, a process pool if None
+    """
+    days = [from_day + timedelta(days=idx) for idx in range((to_day - from_day).days + 1)]
+    days = [day for day in days if day.isoformat() not in store.index]
+    if not days:
+        return
+
+    cache = snapshot_cache()
+    pool = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    own_executor = executor is None
+    executor = executor or ProcessPoolExecutor()
+
+    async with CLIENTS.session(raise_for_status=True) as session:
+        resolved = await asyncio.gather(*[resolve_snapshots(session, url, days) for url in urls])
+
+        captures = dict()
+        for snapshots, country in zip(resolved, urls.values()):
+            for snapshot_url, dt in snapshots.values():
+                timestamp = dt.strftime(TIMESTAMP_FORMAT)
+                if not store.has_capture(country, timestamp):
+                    captures[(country, timestamp)] = snapshot_url
+
+        # captures are stored as soon as they are parsed, an interrupted backfill doesn't fetch them again
+        async def _capture(country: str, timestamp: str, snapshot_url: str):
+            try:
+                async with pool:
+                    body = await snapshot_body(session, snapshot_url, cache)
+                store.put_capture(country, timestamp, await loop.run_in_executor(executor, encode_page, country, body))
+                logging.info(f"Stored {country} capture {timestamp}")
+            except Exception:
+                logging.exception(f"Unable to backfill {snapshot_url=}")
+
+        try:
+            await asyncio.gather(*[_capture(country, timestamp, snapshot_url)
+                                   for (country, timestamp), snapshot_url in captures.items()])
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+    stored = dict()
+    for day in days:
+        day_captures = {country: snapshots[day][1].strftime(TIMESTAMP_FORMAT)
+                        for snapshots, country in zip(resolved, urls.values())}
+        if all(store.has_capture(country, timestamp) for country, timestamp in day_captures.items()):
+            stored[day] = day_captures
+    store.put_days(stored)
+    logging.info(f"Backfilled {len(stored)} of {len(days)} days")
@@ -1,19 +1,81 @@
+import asyncio
 import logging
 import os
+import time
 from io import BytesIO
-from tempfile import NamedTemporaryFile
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
 from PIL import Image
 from aiohttp import ClientSession
 from lxml.html import HtmlElement, etree, html_parser
-from tweepy import API, OAuthHandler
-from tweety.bot import Twitter
+
+from oryxbot.client_util import CLIENTS
+from oryxbot.metrics import count, span
 
 TWITTER_HOST = "twitter.com"
 TWEET_PARAMS = {"tweet.fields": "lang",
                 "media.fields": "url",
                 "expansions": "attachments.media_keys,author_id",
                 "user.fields": "username"}
+# uploaded media can be attached to tweets for 24 hours
+MEDIA_TTL = float(os.getenv('MEDIA_TTL', str(23 * 3600)))
+
+IMAGE_CHUNK_SIZE = 64 * 1024
+MAX_DOWNLOAD_BYTES = int(os.getenv('MAX_DOWNLOAD_BYTES', str(20 * 1024 * 1024)))
+UPLOAD_MAX_BYTES = 5 * 1024 * 1024
+UPLOAD_MAX_DIMENSION = 4096
+UPLOAD_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+
+def _is_html(content_type: str, head: bytes) -> bool:
+    return content_type == 'text/html' or head.lstrip()[:14].upper() == b"<!DOCTYPE HTML"
+
+
+async def _read_capped(chunks: AsyncIterator[bytes], head: bytes, limit: int) -> Optional[bytes]:
+    body = bytearray(head)
+    try:
+        async for chunk in chunks:
+            body.extend(chunk)
+            if len(body) > limit:
+                return None
+        return bytes(body)
+    finally:
+        count('image_bytes', len(body))
+
+
+def _draft_size(size: Tuple[int, int], limit: int) -> Tuple[int, int]:
+    """
+    Smallest size to decode a JPEG at. Images larger than limit x limit are fitted into it keeping the aspect ratio,
+    and as JPEGs decode at power of two scales, may come out at up to half of that
+    """
+    if max(size) <= limit:
+        return size
+    scale = limit / max(size) / 2
+    return max(1, int(size[0] * scale)), max(1, int(size[1] * scale))
+
+
+def _prepare_image(body: bytes) -> Tuple[bytes, str]:
+    """
+    Images Twitter accepts as they are are uploaded untouched, the rest is downscaled and recompressed to JPEG
+    in memory. Large JPEGs are decoded at a reduced scale straight away, runs in a worker thread
+    :param body: downloaded image
+    :return: image to upload and its file extension
+    """
+    img = Image.open(BytesIO(body))
+    if img.format in UPLOAD_FORMATS and len(body) <= UPLOAD_MAX_BYTES and max(img.size) <= UPLOAD_MAX_DIMENSION:
+        return body, UPLOAD_FORMATS[img.format]
+
+    if img.format == 'JPEG':
+        img.draft('RGB', _draft_size(img.size, UPLOAD_MAX_DIMENSION))
+    img = img.convert('RGB')
+    img.thumbnail((UPLOAD_MAX_DIMENSION, UPLOAD_MAX_DIMENSION))
+
+    for quality in (85, 70, 50):
+        buffer = BytesIO()
+        img.save(buffer, format='JPEG', quality=quality, optimize=True)
+        if buffer.tell() <= UPLOAD_MAX_BYTES:
+            break
+    return buffer.getvalue(), 'jpg'
 
 
 async def resolve(session: ClientSession, url: str):
@@ -25,13 +87,24 @@ async def resolve(session: ClientSession, url: str):
                 while parts and parts[0] != 'status':
                     parts.pop(0)
 
-                reader = Twitter()
-                data = reader.tweet_detail(parts[1])
+                with span('tweet_lookup'):
+                    data = await asyncio.to_thread(CLIENTS.reader().tweet_detail, parts[1])
                 logging.info(f"Tweet data: {data}")
                 return [m['media_key'] for m in data.media]
 
-            body = await response.read()
-            if body.startswith(b"<!DOCTYPE HTML>"):
+            if response.content_length and response.content_length > MAX_DOWNLOAD_BYTES:
+                logging.warning(f"Skipping {url=} of {response.content_length} bytes")
+                return result
+
+            chunks = response.content.iter_chunked(IMAGE_CHUNK_SIZE)
+            head = await anext(chunks, b'')
+            with span('image_download'):
+                body = await _read_capped(chunks, head, MAX_DOWNLOAD_BYTES)
+            if body is None:
+                logging.warning(f"Skipping {url=} larger than {MAX_DOWNLOAD_BYTES} bytes")
+                return result
+
+            if _is_html(response.content_type, head):
                 doc: HtmlElement = etree.fromstring(body, html_parser)
                 links = doc.findall(".//img[@id='main-image']")
                 link: HtmlElement
@@ -39,17 +112,53 @@ async def resolve(session: ClientSession, url: str):
                     result.extend(await resolve(session, link.attrib['src']))
                 return result
 
-            auth = OAuthHandler(consumer_key=os.environ['CONSUMER_KEY'],
-                                consumer_secret=os.environ['CONSUMER_SECRET'])
-            auth.set_access_token(key=os.environ['ACCESS_TOKEN'], secret=os.environ['ACCESS_TOKEN_SECRET'])
-            api = API(auth)
-
-            with NamedTemporaryFile(suffix='.png') as temp_file:
-                img = Image.open(BytesIO(body))
-                img.save(temp_file.name)
-                ret = api.media_upload(filename=temp_file.name)
-            result.append(ret.media_id_string)
+        with span('image_prepare'):
+            image, extension = await asyncio.to_thread(_prepare_image, body)
+        with span('media_upload'):
+            ret = await asyncio.to_thread(CLIENTS.media_api().media_upload,
+                                          filename=f"image.{extension}", file=BytesIO(image))
+        count('media_uploaded')
+        result.append(ret.media_id_string)
     except Exception:
+        count('media_errors')
         logging.exception(f"Unable to process {url=}")
     logging.info(f"Resolved {url=} to {result}")
     return result
+
+
+class MediaCache:
+    """
+    Media ids resolved per link, kept while they can still be attached to a tweet.
+    Concurrent requests for the same link share a single download and upload
+    """
+
+    def __init__(self, ttl: float = MEDIA_TTL):
+        self.ttl = ttl
+        self._entries: Dict[str, Tuple[float, List[str]]] = dict()
+        self._pending: Dict[str, asyncio.Task] = dict()
+
+    async def _resolve(self, session: ClientSession, url: str) -> List[str]:
+        try:
+            result = await resolve(session, url)
+            if result:
+                self._entries[url] = (time.monotonic() + self.ttl, result)
+            return result
+        finally:
+            del self._pending[url]
+
+    async def resolve(self, session: ClientSession, url: str) -> List[str]:
+        entry = self._entries.get(url)
+        if entry and entry[0] > time.monotonic():
+            count('media_cache_hits')
+            return entry[1]
+
+        if url not in self._pending:
+            self._pending[url] = asyncio.create_task(self._resolve(session, url))
+        # a cancelled waiter must not cancel the upload shared with others
+        return await asyncio.shield(self._pending[url])
+
+    def invalidate(self, url: str):
+        self._entries.pop(url, None)
+
+
+MEDIA_CACHE = MediaCache()
@@ -0,0 +1,52 @@
+from collections import Counter
+from itertools import filterfalse
+from operator import itemgetter
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from oryxbot.parser import Loss, Row
+from oryxbot.snapshot import loss_row
+
+
+class LossTable:
+    """
+    Losses of several pages kept as the rows they were parsed or loaded as, grouped by country.
+    Rows are tuples of strings which cache their hashes, so the difference is one set lookup per row
+    and counts are taken straight from them. Loss objects are only created when rows are read back with losses()
+    """
+
+    def __init__(self):
+        self.pages: Dict[str, List[Row]] = dict()
+
+    def __len__(self):
+        return sum(map(len, self.pages.values()))
+
+    def append_rows(self, country: str, rows: Iterable[Row]):
+        self.pages.setdefault(country, list()).extend(rows)
+
+    @classmethod
+    def from_losses(cls, losses: Iterable[Tuple[str, Loss]]) -> 'LossTable':
+        table = cls()
+        for country, loss in losses:
+            table.append_rows(country, [loss_row(loss)])
+        return table
+
+    def difference(self, other: 'LossTable') -> 'LossTable':
+        """
+        Rows of this table which are not present in the other one, order is preserved
+        """
+        table = LossTable()
+        for country, rows in self.pages.items():
+            table.pages[country] = list(filterfalse(set(other.pages.get(country, ())).__contains__, rows))
+        return table
+
+    def counts(self) -> Dict[Tuple[str, str, str], int]:
+        """
+        Number of losses per (country, type, status) in order of first appearance
+        """
+        return {(country, type_, status): count for country, rows in self.pages.items()
+                for (type_, status), count in Counter(map(itemgetter(0, 1), rows)).items()}
+
+    def losses(self) -> Iterator[Tuple[str, Loss]]:
+        for country, rows in self.pages.items():
+            for row in rows:
+                yield country, Loss(*row)
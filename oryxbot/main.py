@@ -1,104 +1,364 @@
 import asyncio
+import cProfile
 import logging
 import os
 from argparse import ArgumentParser
-from dataclasses import asdict
-from datetime import date, datetime, timedelta
-from itertools import product
-from typing import List, Tuple
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
 
-from aiohttp import ClientSession
-
-from oryxbot.archive_util import save_url, url_snapshot
-from oryxbot.parser import parse_losses, Loss
+from oryxbot import executor_util
+from oryxbot.aggregation import Counts, Rollups, count_losses
+from oryxbot.archive_util import save_url, url_history_rows, url_rows
+from oryxbot.client_util import CLIENTS
+from oryxbot.delta_log import DeltaLog
+from oryxbot.history import HistoryStore, backfill
+from oryxbot.loss_table import LossTable
+from oryxbot.metrics import METRICS, count, span
+from oryxbot.outbox import Outbox
+from oryxbot.parser import Loss, Row
 from oryxbot.s3_util import s3_client
-from oryxbot.twitter_util import publish_date_diff, publish_losses
+from oryxbot.schedule import PollSchedule, SummaryScheduler
+from oryxbot.snapshot import PageSnapshot, decode_snapshots, snapshot_delta
+from oryxbot.source_util import SourceState, fetch_source
 
 URLS = {"https://www.oryxspioenkop.com/2022/02/attack-on-europe-documenting-ukrainian.html": "ukrainian",
         "https://www.oryxspioenkop.com/2022/02/attack-on-europe-documenting-equipment.html": "russian"}
 
 S3_PATH_LAST = os.getenv('S3_PATH_LAST', 'oryx/last.json')
-S3_PATH_DELTA = os.getenv('S3_PATH_DELTA', f'oryx/{datetime.utcnow().isoformat()}.json')
+S3_PATH_SOURCES = os.getenv('S3_PATH_SOURCES', 'oryx/sources.json')
+S3_PATH_LOG = os.getenv('S3_PATH_LOG', 'oryx/log/')
+S3_PATH_ROLLUPS = os.getenv('S3_PATH_ROLLUPS', 'oryx/rollups.json')
+
+
+async def enqueue_losses(losses: List[Tuple[str, Loss]], outbox: Outbox, run: str):
+    # Twitter and imaging libraries are only loaded once there is something to publish
+    from oryxbot import twitter_util
+
+    await outbox.add(twitter_util.publications(losses, run))
+
+
+async def publish_outbox(outbox: Outbox):
+    from oryxbot import twitter_util
+
+    await twitter_util.publish_outbox(outbox)
+
 
+async def publish_date_diff(counts: Counts, date_: date):
+    from oryxbot import twitter_util
 
-async def compare_with_last_and_publish() -> List[Tuple[str, Loss]]:
-    async with ClientSession() as session:
-        async def _get(url: str):
-            async with session.get(url) as r:
-                return await r.content.read()
+    await twitter_util.publish_date_diff(counts, date_)
 
-        bodies = await asyncio.gather(*[_get(url) for url in URLS.keys()])
 
+@dataclass
+class RunReport:
+    losses: List[Tuple[str, Loss]] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)
+    snapshots: Dict[str, PageSnapshot] = field(default_factory=dict)
+    fetched_at: datetime = field(default_factory=datetime.utcnow)
+    rollups: Optional[Rollups] = None
+
+
+@dataclass
+class BotState:
+    """
+    Everything a run reads from S3, the daemon keeps it between runs instead of reading it again
+    """
+    log: DeltaLog
+    sources: dict = field(default_factory=dict)
+    snapshots: Dict[str, PageSnapshot] = field(default_factory=dict)
+    rollups: Rollups = field(default_factory=Rollups)
+    outbox: Outbox = field(default_factory=Outbox)
+    loaded: bool = False
+
+
+async def check_sources(get, put, state: BotState) -> RunReport:
+    """
+    Fetches the pages, stores what changed and publishes new losses through the outbox,
+    publications left pending by a failed run are posted first
+    :param get: s3_client get
+    :param put: s3_client put
+    :param state: state of the previous run, loaded from S3 while the pages are parsed unless already loaded
+    :return: run report
+    """
+    report = RunReport()
+    log = state.log
+    if not state.loaded:
+        state.sources = await get(S3_PATH_SOURCES)
+    known = {country: set(state.snapshots.get(country, PageSnapshot()).items) for country in URLS.values()}
+
+    async def _previous() -> Dict[str, PageSnapshot]:
+        if await log.exists():
+            previous = await log.state_at()
+        else:
+            # the log is seeded from the snapshot written before it was introduced
+            previous = decode_snapshots(await get(S3_PATH_LAST, raw=True))
+        for country, snapshot in previous.items():
+            known.setdefault(country, set()).update(snapshot.items)
+        return previous
+
+    async def _load() -> Tuple[Dict[str, PageSnapshot], Rollups, Outbox]:
+        if state.loaded:
+            return state.snapshots, state.rollups, state.outbox
+        with span('load_state'):
+            previous, rollups, outbox = await asyncio.gather(_previous(), get(S3_PATH_ROLLUPS),
+                                                             Outbox(get, put).load())
+        return previous, Rollups.from_json(rollups), outbox
+
+    # pages are parsed while the previous state is loaded, items parsed after it arrived are skipped
+    with span('fetch'):
+        async with CLIENTS.session() as session:
+            (previous, rollups, outbox), *pages = await asyncio.gather(
+                _load(),
+                *[fetch_source(session, url, SourceState(**state.sources.get(url, {})), known[country])
+                  for url, country in URLS.items()])
+    snapshots = {country: PageSnapshot() for country in URLS.values()}
+    snapshots.update(previous)
+
+    report.snapshots = snapshots
+    report.skipped = [country for page, country in zip(pages, URLS.values()) if not page.changed]
+    logging.info(f"Skipped unchanged sources: {report.skipped}")
+    count('sources_skipped', len(report.skipped))
+
+    if len(report.skipped) < len(pages):
+        with span('diff'):
+            for page, country in zip(pages, URLS.values()):
+                if page.changed:
+                    snapshots[country], added = snapshots[country].update(page.items)
+                    report.losses.extend((country, item) for item in added)
+            delta = snapshot_delta(previous, snapshots)
+        count('losses_new', len(report.losses))
+        count('diff_items_added', sum(len(page.items) for page in delta.added.values()))
+        count('diff_items_removed', sum(map(len, delta.removed.values())))
+
+        # publications are stored before the snapshot, keyed by the sequence number of the delta.
+        # A run failing in between plans the same ones again under the same number
+        if report.losses:
+            await enqueue_losses(report.losses, outbox, str(await log.next_seq()))
+
+        if delta:
+            with span('log_append'):
+                await log.append(delta, snapshots, datetime.utcnow())
+
+    new_states = {page.url: asdict(page.state) for page in pages}
+    if new_states != state.sources:
+        await put(S3_PATH_SOURCES, new_states)
+
+    report.rollups = rollups
+    if rollups.add(report.fetched_at.date(), count_losses(report.losses)):
+        await put(S3_PATH_ROLLUPS, rollups.to_json())
+
+    state.sources, state.snapshots, state.rollups, state.outbox, state.loaded = \
+        new_states, snapshots, rollups, outbox, True
+
+    if outbox.pending():
+        with span('publish'):
+            await publish_outbox(outbox)
+
+    return report
+
+
+async def compare_with_last_and_publish() -> RunReport:
     async with s3_client() as (get, put):
-        last_data = await get(S3_PATH_LAST)
+        return await check_sources(get, put, BotState(DeltaLog(get, put, S3_PATH_LOG)))
+
 
-        diff_losses = list()
-        new_losses = list()
-        for body, country in zip(bodies, URLS.values()):
-            previous = set(map(lambda x: Loss(**x), last_data.get(country, [])))
-            new = list(parse_losses(body))
-            new_losses.append(list(map(asdict, new)))
+def _table(pages: Iterable[Tuple[str, Iterable[Row]]]) -> LossTable:
+    table = LossTable()
+    for country, rows in pages:
+        table.append_rows(country, rows)
+    return table
 
-            for item in new:
-                if item not in previous:
-                    diff_losses.append((country, item))
 
-        await put(S3_PATH_LAST, dict(zip(URLS.values(), new_losses)))
+def _differences(current: LossTable, current_dt: datetime,
+                 history: List[List[Tuple[List[Row], datetime]]]) -> List[Tuple[LossTable, datetime]]:
+    result = list()
+    for snapshots in zip(*history):
+        old = _table((country, rows) for country, (rows, _) in zip(URLS.values(), snapshots))
+        result.append((current.difference(old), min(current_dt, *map(lambda x: x[1], snapshots))))
+    return result
 
-        if diff_losses:
-            await publish_losses(diff_losses)
-            await put(S3_PATH_DELTA, list(map(lambda x: [x[0], asdict(x[1])], diff_losses)))
 
-    return diff_losses
+async def compare_against_dates(dates: List[date],
+                                report: Optional[RunReport] = None) -> List[Tuple[LossTable, datetime]]:
+    """
+    Compares current pages with Wayback snapshots of every date, snapshots are fetched concurrently
+    and parsed into rows, no Loss is created for them. Tables are diffed in a thread
+    :param dates: dates to compare against
+    :param report: run which already fetched current pages, they are fetched again if None
+    :return: table of new losses and the earliest snapshot time per date
+    """
+    async with CLIENTS.session(raise_for_status=True) as session:
+        history = asyncio.gather(*[url_history_rows(session, link, dates) for link in URLS.keys()])
+        if report is None:
+            pages = await asyncio.gather(*[url_rows(session, link, None) for link in URLS.keys()])
+            current = _table((country, rows) for (rows, _), country in zip(pages, URLS.values()))
+            current_dt = min(map(lambda x: x[1], pages))
+        else:
+            current = _table((country, report.snapshots[country].rows()) for country in URLS.values())
+            current_dt = report.fetched_at
+        history = await history
 
+    return await asyncio.to_thread(_differences, current, current_dt, history)
 
-async def compare_against_date(from_dt: date) -> Tuple[List[Tuple[str, Loss]], datetime]:
+
+async def compare_against_date(from_dt: date) -> Tuple[LossTable, datetime]:
     """
     Fetches both dates from cache and compare
     :param from_dt: date from
-    :return: list of losses
+    :return: table of new losses
+    """
+    return (await compare_against_dates([from_dt]))[0]
+
+
+async def summarize(dates: List[date], report: Optional[RunReport] = None,
+                    rollups: Optional[Rollups] = None) -> List[Tuple[Counts, datetime]]:
+    """
+    Counts of new losses since every date. Dates covered by rollups are summed from them,
+    the rest is compared against Wayback snapshots
+    :param dates: dates to summarize
+    :param report: run which already fetched current pages
+    :param rollups: stored daily rollups
+    :return: counts and the start of the summary per date
+    """
+    missing = [dt for dt in dates if rollups is None or not rollups.covers(dt)]
+    compared = dict(zip(missing, await compare_against_dates(missing, report))) if missing else dict()
+
+    result = list()
+    for dt in dates:
+        if dt in compared:
+            diff, start = compared[dt]
+            result.append((diff.counts(), start))
+        else:
+            result.append((rollups.since(dt), datetime.combine(dt, time())))
+    return result
+
+
+async def publish_summary(delta_days: int, rollups: Optional[Rollups]):
+    """
+    Publishes summary of losses going back N days and saves current pages to Wayback
     """
-    async with ClientSession(raise_for_status=True) as session:
-        jobs = list()
-        for link, date_time in product(URLS.keys(), [from_dt, None]):
-            jobs.append(url_snapshot(session, link, date_time))
+    try:
+        with span('summaries'):
+            for counts, dt in await summarize([datetime.utcnow().date() - timedelta(days=delta_days)],
+                                              rollups=rollups):
+                await publish_date_diff(counts, dt)
+    except Exception:
+        logging.exception(f"Failed to process diff")
+    await asyncio.to_thread(list, map(save_url, URLS.keys()))
 
-        bodies = await asyncio.gather(*jobs)
 
-    parts = [[bodies[i * 2][0], bodies[i * 2 + 1][0]] for i in range(len(bodies) // 2)]
-    diff_losses = list()
-    for country, data in zip(URLS.values(), parts):
-        old, new = list(map(parse_losses, data))
-        old = set(old)
-        diff_losses.extend([(country, item) for item in new if item not in old])
-    return diff_losses, min(map(lambda x: x[1], bodies))
+async def publish_report_summaries(report: RunReport):
+    today = datetime.utcnow().date()
+    with span('summaries'):
+        for counts, dt in await summarize([today - timedelta(days=1), today - timedelta(days=7), date(2023, 6, 5)],
+                                          report, report.rollups):
+            await publish_date_diff(counts, dt)
+
+
+async def run(delta_days: Optional[int] = None):
+    """
+    Single run of the bot, current pages are fetched and parsed once and shared by all summaries
+    :param delta_days: only publish summary of losses going back N days
+    """
+    try:
+        METRICS.reset()
+        if delta_days:
+            try:
+                async with s3_client() as (get, _):
+                    rollups = Rollups.from_json(await get(S3_PATH_ROLLUPS))
+            except Exception:
+                logging.exception(f"Unable to read rollups")
+                rollups = None
+            await publish_summary(delta_days, rollups)
+            return
+
+        with span('run'):
+            report = await compare_with_last_and_publish()
+            if report.losses:
+                await publish_report_summaries(report)
+    finally:
+        METRICS.write()
+        await CLIENTS.close()
+        executor_util.shutdown()
+
+
+async def daemon():
+    """
+    Keeps running with the S3 client, API clients and the previous state resident. Pages are polled more often
+    after a change and less often while they are quiet, daily and weekly summaries come from SummaryScheduler
+    """
+    polls = PollSchedule()
+    summaries = SummaryScheduler(datetime.utcnow())
+    try:
+        async with s3_client() as (get, put):
+            state = BotState(DeltaLog(get, put, S3_PATH_LOG))
+            while True:
+                changed = False
+                try:
+                    with span('run'):
+                        report = await check_sources(get, put, state)
+                        changed = len(report.skipped) < len(URLS)
+                        if report.losses:
+                            await publish_report_summaries(report)
+                except Exception:
+                    logging.exception(f"Failed to check sources")
+
+                for delta_days in summaries.due(datetime.utcnow()):
+                    await publish_summary(delta_days, state.rollups if state.loaded else None)
+                METRICS.write()
+
+                delay = min(polls.next(changed), summaries.until_next(datetime.utcnow()))
+                logging.info(f"Next poll in {delay:.0f} seconds")
+                await asyncio.sleep(delay)
+    finally:
+        await CLIENTS.close()
+        executor_util.shutdown()
+
+
+async def backfill_history(from_day: date, to_day: date):
+    """
+    Stores day by day history of the pages, see history.backfill
+    """
+    try:
+        await backfill(URLS, from_day, to_day, HistoryStore())
+    finally:
+        await CLIENTS.close()
 
 
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("--delta-days", help="Publish summary of losses going back N days", type=int)
+    parser.add_argument("--daemon", help="Keep running and poll the pages on an adaptive schedule",
+                        action="store_true")
+    parser.add_argument("--backfill", help="Store day by day history of the pages between two dates",
+                        nargs=2, metavar=("FROM", "TO"), type=date.fromisoformat)
+    parser.add_argument("--history-diff", help="Print losses between two days of the stored history",
+                        nargs=2, metavar=("FROM", "TO"), type=date.fromisoformat)
+    parser.add_argument("--profile", help="Write cProfile stats of the run to PATH", metavar="PATH")
     args = parser.parse_args()
 
     logging.basicConfig(format='%(asctime)s:%(levelname)s:%(name)s:%(message)s')
     logging.getLogger().setLevel(logging.INFO)
 
-    if args.delta_days:
-        try:
-            diff, date = asyncio.run(compare_against_date(datetime.utcnow().date() - timedelta(days=args.delta_days)))
-            publish_date_diff(diff, date)
-        except Exception:
-            logging.exception(f"Failed to process diff")
-        list(map(save_url, URLS.keys()))
-    else:
-        losses = asyncio.run(compare_with_last_and_publish())
-
-        if losses:
-            diff, dt = asyncio.run(compare_against_date(datetime.utcnow().date() - timedelta(days=1)))
-            publish_date_diff(diff, dt)
-
-            diff, dt = asyncio.run(compare_against_date(datetime.utcnow().date() - timedelta(days=7)))
-            publish_date_diff(diff, dt)
-
-            diff, dt = asyncio.run(compare_against_date(date(2023, 6, 5)))
-            publish_date_diff(diff, dt)
-
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    try:
+        if args.backfill:
+            asyncio.run(backfill_history(*args.backfill))
+        elif args.daemon:
+            asyncio.run(daemon())
+        elif args.history_diff:
+            try:
+                diff = HistoryStore().diff(*args.history_diff)
+            except ValueError as ex:
+                parser.error(str(ex))
+            for (country, vehicle, status), total in diff.counts().items():
+                print(f"{country} {vehicle} {status}: {total}")
+        else:
+            asyncio.run(run(args.delta_days))
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
@@ -0,0 +1,83 @@
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# report written after every run, *.prom files are Prometheus textfiles, anything else gets a JSON line appended
+METRICS_PATH = os.getenv('METRICS_PATH')
+PROMETHEUS_PREFIX = 'oryxbot'
+
+_NAME_RE = re.compile(r'[^a-zA-Z0-9_]')
+
+
+class Metrics:
+    """
+    Spans and counters of a single run. Spans measure wall time, concurrent spans of the same name
+    are recorded separately
+    """
+
+    def __init__(self):
+        self.spans: Dict[str, List[float]] = defaultdict(list)
+        self.counters: Counter = Counter()
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[name].append(time.perf_counter() - start)
+
+    def count(self, name: str, value: float = 1):
+        self.counters[name] += value
+
+    def reset(self):
+        self.spans.clear()
+        self.counters.clear()
+
+    def report(self) -> dict:
+        return {'at': datetime.utcnow().isoformat(timespec='seconds'),
+                'spans': {name: {'count': len(times), 'total': sum(times), 'max': max(times)}
+                          for name, times in self.spans.items()},
+                'counters': dict(self.counters)}
+
+    def prometheus(self) -> str:
+        lines = [f"# TYPE {PROMETHEUS_PREFIX}_span_seconds gauge"]
+        lines.extend(f'{PROMETHEUS_PREFIX}_span_seconds{{span="{name}"}} {sum(times)}'
+                     for name, times in sorted(self.spans.items()))
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_span_count gauge")
+        lines.extend(f'{PROMETHEUS_PREFIX}_span_count{{span="{name}"}} {len(times)}'
+                     for name, times in sorted(self.spans.items()))
+        for name, value in sorted(self.counters.items()):
+            metric = f"{PROMETHEUS_PREFIX}_{_NAME_RE.sub('_', name)}"
+            lines.extend([f"# TYPE {metric} gauge", f"{metric} {value}"])
+        lines.extend([f"# TYPE {PROMETHEUS_PREFIX}_last_run_timestamp_seconds gauge",
+                      f"{PROMETHEUS_PREFIX}_last_run_timestamp_seconds {time.time()}"])
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Optional[str] = METRICS_PATH):
+        """
+        Writes the report of the run and starts a new one
+        :param path: report file, the report is only logged if None
+        """
+        logging.info(f"Run report: {json.dumps(self.report())}")
+        if path:
+            if path.endswith('.prom'):
+                # textfile collectors may read at any time, the file is replaced atomically
+                with open(f"{path}.tmp", 'w') as f:
+                    f.write(self.prometheus())
+                os.replace(f"{path}.tmp", path)
+            else:
+                with open(path, 'a') as f:
+                    f.write(json.dumps(self.report()) + "\n")
+        self.reset()
+
+
+METRICS = Metrics()
+span = METRICS.span
+count = METRICS.count
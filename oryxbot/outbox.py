@@ -0,0 +1,156 @@
+import asyncio
+import json
+import logging
+import os
+from collections import Counter
+from dataclasses import astuple, dataclass, field
+from hashlib import blake2b
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+S3_PATH_OUTBOX = os.getenv('S3_PATH_OUTBOX', 'oryx/outbox/')
+# rejected attempts after which a publication is moved aside to <prefix>failed.json
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '3'))
+
+
+@dataclass(frozen=True)
+class Publication:
+    key: str
+    country: str
+    text: str
+    links: List[str] = field(default_factory=list)
+    # replies to the previous publication of the same country
+    reply: bool = False
+
+
+def plan(entries: Iterable[Tuple[str, str, List[str], bool]], run: str) -> List[Publication]:
+    """
+    Publications with keys derived from the run and their content, planning the same losses again
+    in the same run gives the same keys
+    :param entries: (country, text, links, reply) in publishing order
+    :param run: identifies the run, e.g. the sequence number of its delta
+    """
+    seen = Counter()
+    result = list()
+    for country, text, links, reply in entries:
+        content = json.dumps([country, text, links, reply])
+        seen[content] += 1
+        key = blake2b(f"{run}:{seen[content]}:{content}".encode(), digest_size=12).hexdigest()
+        result.append(Publication(key, country, text, list(links), reply))
+    return result
+
+
+class Outbox:
+    """
+    Publications waiting to be posted on top of s3_client get/put.
+
+    <prefix>items.json lists the planned publications in order, <prefix>progress.json maps every confirmed one
+    to its tweet id and counts rejected attempts. It is written after each tweet, so a restarted run carries on
+    after the last confirmed publication. Both are emptied once everything is posted. Publications rejected
+    OUTBOX_MAX_ATTEMPTS times are moved to <prefix>failed.json so they don't block the ones after them.
+    Without get/put the outbox only lives in memory
+    """
+
+    def __init__(self, get: Optional[Callable[..., Awaitable]] = None, put: Optional[Callable[..., Awaitable]] = None,
+                 prefix: str = S3_PATH_OUTBOX, max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self._get = get
+        self._put = put
+        self._prefix = prefix
+        self._max_attempts = max_attempts
+        self.items: List[Publication] = list()
+        self.posted: Dict[str, Optional[str]] = dict()
+        self.attempts: Counter = Counter()
+        self.failed: list = list()
+        self._previous: Dict[str, Optional[str]] = dict()
+        self._lock = asyncio.Lock()
+
+    def _index(self, publications: Iterable[Publication]):
+        last = {item.country: item.key for item in self.items if item.key in self._previous}
+        for item in publications:
+            self._previous[item.key] = last.get(item.country)
+            last[item.country] = item.key
+
+    async def load(self) -> 'Outbox':
+        if self._get is not None:
+            items, progress, failed = await asyncio.gather(self._get(f"{self._prefix}items.json"),
+                                                           self._get(f"{self._prefix}progress.json"),
+                                                           self._get(f"{self._prefix}failed.json"))
+            self.items = [Publication(*item) for item in items or []]
+            keys = {item.key for item in self.items}
+            # progress without items is left from emptying the outbox
+            self.posted = {key: tweet_id for key, tweet_id in progress.get('posted', {}).items() if key in keys}
+            self.attempts = Counter({key: n for key, n in progress.get('attempts', {}).items() if key in keys})
+            self.failed = failed or list()
+            self._previous.clear()
+            self._index(self.items)
+        return self
+
+    def pending(self) -> List[Publication]:
+        return [item for item in self.items if item.key not in self.posted]
+
+    def parent(self, publication: Publication) -> Optional[str]:
+        """
+        Tweet id of the closest publication posted before this one in the same country,
+        those moved aside or posted without an id are skipped
+        """
+        previous = self._previous.get(publication.key)
+        while previous and self.posted.get(previous) is None:
+            previous = self._previous.get(previous)
+        return self.posted[previous] if previous else None
+
+    async def _save(self):
+        if self._put is None:
+            return
+        if not self.pending():
+            # items go first, progress without items is ignored
+            await self._put(f"{self._prefix}items.json", [])
+            await self._put(f"{self._prefix}progress.json", {})
+        else:
+            await self._put(f"{self._prefix}progress.json", {'posted': dict(self.posted),
+                                                             'attempts': dict(self.attempts)})
+
+    def _empty(self):
+        if self.items and not self.pending():
+            self.items, self.posted, self.attempts = list(), dict(), Counter()
+            self._previous.clear()
+
+    async def add(self, publications: List[Publication]):
+        """
+        Stores new publications, those already in the outbox are skipped
+        """
+        known = {item.key for item in self.items}
+        new = [item for item in publications if item.key not in known]
+        if not new:
+            return
+        self._index(new)
+        self.items.extend(new)
+        if self._put is not None:
+            async with self._lock:
+                await self._put(f"{self._prefix}items.json", [astuple(item) for item in self.items])
+
+    async def confirm(self, publication: Publication, tweet_id: Optional[str]):
+        """
+        Checkpoints a posted publication, the outbox is emptied after the last one
+        """
+        self.posted[publication.key] = tweet_id
+        async with self._lock:
+            await self._save()
+            self._empty()
+
+    async def fail(self, publication: Publication, error: Exception) -> bool:
+        """
+        Records an attempt the publication was rejected at, it is moved aside after max_attempts of them.
+        Only meant for permanent rejections, transient errors should leave the publication pending
+        :return: whether it was moved aside and the ones after it can carry on
+        """
+        self.attempts[publication.key] += 1
+        moved = self.attempts[publication.key] >= self._max_attempts
+        async with self._lock:
+            if moved:
+                logging.error(f"Giving up on {publication} after {self.attempts[publication.key]} attempts: {error}")
+                self.failed.append([astuple(publication), str(error)])
+                self.posted[publication.key] = None
+                if self._put is not None:
+                    await self._put(f"{self._prefix}failed.json", self.failed)
+            await self._save()
+            self._empty()
+        return moved
@@ -1,10 +1,13 @@
+import hashlib
 import logging
 import re
 from dataclasses import dataclass
 from enum import Enum
-from typing import Iterator
+from functools import lru_cache
+from itertools import starmap
+from typing import AsyncIterable, AsyncIterator, Container, Iterator, List, Optional, Tuple
 
-from lxml.html import HtmlElement, etree, html_parser
+from lxml.html import HtmlElement, etree
 
 
 class Status(Enum):
@@ -24,40 +27,175 @@ class Loss:
     link: str
 
 
-def _extract_tails(root: HtmlElement) -> str:
-    if root is None:
-        return ''
-    res = root.tail or ''
-    for child in root.getchildren():
-        res += _extract_tails(child)
-    return res
+# loss fields in Loss order, pages which are only compared and counted are parsed into rows
+Row = Tuple[str, str, int, str]
 
+ITEM_TYPE_RE = re.compile(r'\d+\W+(.+)$')
+NUMBER_RE = re.compile(r'\d+')
 
-def parse_losses(body: bytes) -> Iterator[Loss]:
-    doc: HtmlElement = etree.fromstring(body, html_parser)
-    links = doc.findall(".//a")
-    link: HtmlElement
-    for link in links:
-        if not link.text or not link.text.startswith('(') or not link.text.endswith(')'):
+# statuses are matched in declaration order, first substring hit wins
+_STATUSES = tuple((status.value, status) for status in Status)
+
+
+@lru_cache(maxsize=4096)
+def _link_status(text: str) -> Optional[Status]:
+    return next((status for value, status in _STATUSES if value in text), None)
+
+
+def _item_type(item: HtmlElement) -> Optional[str]:
+    """
+    Extracts vehicle type from the text of a list item, e.g. "78 R-149MA1 command and staff vehicle:"
+    :param item: <li> element
+    :return: type name or None if the item doesn't describe losses
+    """
+    match = ITEM_TYPE_RE.match(''.join(el.tail or '' for el in item.iter()).strip())
+    return match.group(1).strip(':') if match else None
+
+
+def _link_rows(link: HtmlElement, item_type: str) -> Iterator[Row]:
+    text = link.text
+    status = _link_status(text)
+    href = link.get('href')
+    for item in NUMBER_RE.findall(text):
+        if status is None or href is None:
+            logging.error(f"Failed to parse {text}")
+            continue
+        yield item_type, status.value, int(item), 'http' + href.strip().split('http')[-1]
+
+
+def iter_tree_rows(root: HtmlElement) -> Iterator[Row]:
+    """
+    Walks the tree once in document order, every link is attributed to the closest enclosing <li>
+    whose type is extracted only once and only if it holds any loss links
+    :param root: document or sub-tree root
+    :return: rows of losses in document order
+    """
+    items = list()
+    for event, el in etree.iterwalk(root, events=('start', 'end'), tag=('li', 'a')):
+        if el.tag == 'li':
+            if event == 'start':
+                items.append([el, False, None])
+            else:
+                items.pop()
             continue
 
-        parent: HtmlElement = link
-        while parent is not None and parent.tag != 'li':
-            parent: HtmlElement = parent.getparent()
+        if event != 'start' or not items:
+            continue
 
-        txt = _extract_tails(parent).strip()
-        match = re.match(r'\d+\W+(.+)$', txt)
-        if not match:
+        text = el.text
+        if not text or not text.startswith('(') or not text.endswith(')'):
             continue
 
-        for item in re.findall(r'\d+', link.text):
-            try:
-                status = next(filter(lambda x: x[1].value in link.text, enumerate(Status)))[1]
-                yield Loss(
-                    type=match.group(1).strip(':'),
-                    status=status.value,
-                    number=int(item),
-                    link='http' + link.attrib['href'].strip().split('http')[-1]
-                )
-            except Exception:
-                logging.exception(f"Failed to parse {link.text}")
+        item = items[-1]
+        if not item[1]:
+            item[1], item[2] = True, _item_type(item[0])
+        if item[2] is not None:
+            yield from _link_rows(el, item[2])
+
+
+def iter_tree_losses(root: HtmlElement) -> Iterator[Loss]:
+    return starmap(Loss, iter_tree_rows(root))
+
+
+class LossFeed:
+    """
+    Incremental parser, feed it with chunks as they arrive and get losses as soon as each top level <li> is closed.
+    Processed items are dropped from the tree so the memory doesn't grow with the page
+    """
+
+    def __init__(self):
+        self._parser = etree.HTMLPullParser(events=('start', 'end'), tag='li')
+        self._depth = 0
+        self._done: Optional[HtmlElement] = None
+
+    def _process(self, item: HtmlElement) -> list:
+        return list(iter_tree_losses(item))
+
+    def _flush(self) -> list:
+        # <li> tail is included into the item text, it is only complete once the parser moved past it
+        item, self._done = self._done, None
+        if item is None:
+            return []
+        result = self._process(item)
+        item.clear()
+        parent = item.getparent()
+        if parent is not None:
+            while item.getprevious() is not None:
+                del parent[0]
+            parent.remove(item)
+        return result
+
+    def _read(self) -> list:
+        result = list()
+        for event, el in self._parser.read_events():
+            result.extend(self._flush())
+            if event == 'start':
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if not self._depth:
+                    self._done = el
+        return result
+
+    def feed(self, chunk: bytes) -> list:
+        self._parser.feed(chunk)
+        return self._read()
+
+    def close(self) -> list:
+        self._parser.close()
+        result = self._read()
+        result.extend(self._flush())
+        return result
+
+
+def item_fingerprint(item: HtmlElement) -> str:
+    """
+    Hash of the raw item markup including its tail, losses of an item only depend on it
+    """
+    return hashlib.blake2b(etree.tostring(item, with_tail=True), digest_size=8).hexdigest()
+
+
+class RowFeed(LossFeed):
+    """
+    Same as LossFeed, but produces rows instead of Loss objects
+    """
+
+    def _process(self, item: HtmlElement) -> list:
+        return list(iter_tree_rows(item))
+
+
+class ItemFeed(LossFeed):
+    """
+    Same as LossFeed, but produces (fingerprint, losses) per top level <li>.
+    Items with a known fingerprint are not parsed at all and get None instead of losses
+    """
+
+    def __init__(self, known: Container[str] = ()):
+        super().__init__()
+        self._known = known
+
+    def _process(self, item: HtmlElement) -> List[Tuple[str, Optional[List[Loss]]]]:
+        fingerprint = item_fingerprint(item)
+        if fingerprint in self._known:
+            return [(fingerprint, None)]
+        return [(fingerprint, list(iter_tree_losses(item)))]
+
+
+async def parse_losses_stream(chunks: AsyncIterable[bytes]) -> AsyncIterator[Loss]:
+    """
+    Parses losses while the page is still being downloaded
+    :param chunks: page content, e.g. ClientResponse.content.iter_chunked()
+    :return: losses in document order
+    """
+    feed = LossFeed()
+    async for chunk in chunks:
+        for loss in feed.feed(chunk):
+            yield loss
+    for loss in feed.close():
+        yield loss
+
+
+def parse_losses(body: bytes) -> Iterator[Loss]:
+    feed = LossFeed()
+    yield from feed.feed(body)
+    yield from feed.close()
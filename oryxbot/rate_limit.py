@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from oryxbot.metrics import count
+
+
+class TokenBucket:
+    """
+    Async token bucket: acquire() waits for a token without blocking the event loop.
+    pause_until() holds the bucket until the given wall clock time, e.g. the reset time reported by an API,
+    after which the window has reset and the bucket is full again
+    """
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._resume_at = 0.0
+        self._fill_at_resume = False
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                pause = self._resume_at - time.time()
+                if pause > 0:
+                    logging.info(f"Rate limited, waiting {pause:.0f}s")
+                    count('rate_limit_sleep_seconds', pause)
+                    await asyncio.sleep(pause)
+                    continue
+                if self._fill_at_resume:
+                    self._fill_at_resume = False
+                    self._tokens = float(self.capacity)
+                    self._updated = time.monotonic()
+
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+                count('rate_limit_sleep_seconds', wait)
+                await asyncio.sleep(wait)
+
+    def pause_until(self, timestamp: Optional[float], default: float = 60):
+        """
+        :param timestamp: unix time the API window resets at, now + default if None
+        :param default: seconds to wait when the reset time is unknown, the bucket is drained and refills slowly
+        """
+        if timestamp:
+            self._resume_at = max(self._resume_at, timestamp)
+            self._fill_at_resume = True
+        else:
+            self._resume_at = max(self._resume_at, time.time() + default)
+            self._fill_at_resume = False
+            self._refill()
+            self._tokens = 0
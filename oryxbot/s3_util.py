@@ -2,35 +2,50 @@ import json
 import os
 from contextlib import asynccontextmanager
 from io import BytesIO
+from typing import Union
 
-from aiobotocore.session import get_session
-from botocore.exceptions import ClientError
+from oryxbot.metrics import count, span
+
+
+def get_session():
+    # botocore takes a while to import, it is loaded on first use
+    from aiobotocore.session import get_session as _get_session
+
+    return _get_session()
 
 
 @asynccontextmanager
 async def s3_client():
+    from botocore.exceptions import ClientError
+
     async with get_session().create_client('s3',
                                            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
                                            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
                                            endpoint_url=os.environ['AWS_ENDPOINT'],
                                            use_ssl=True) as s3:
 
-        async def _get(path: str) -> dict:
+        async def _get(path: str, raw: bool = False) -> Union[dict, bytes]:
             try:
-                response = await s3.get_object(Bucket=os.environ['S3_BUCKET'], Key=path)
-                async with response['Body'] as stream:
-                    return json.loads(await stream.read())
+                with span('s3_get'):
+                    response = await s3.get_object(Bucket=os.environ['S3_BUCKET'], Key=path)
+                    async with response['Body'] as stream:
+                        body = await stream.read()
+                count('s3_get_bytes', len(body))
+                return body if raw else json.loads(body)
             except ClientError as ex:
                 if ex.response['Error']['Code'] == 'NoSuchKey':
-                    return {}
+                    return b'' if raw else {}
                 else:
                     raise
 
-        async def _put(path: str, data: dict):
-            await s3.put_object(
-                Bucket=os.environ['S3_BUCKET'],
-                Key=path,
-                Body=BytesIO(json.dumps(data).encode())
-            )
+        async def _put(path: str, data: Union[dict, list, bytes]):
+            body = data if isinstance(data, bytes) else json.dumps(data).encode()
+            count('s3_put_bytes', len(body))
+            with span('s3_put'):
+                await s3.put_object(
+                    Bucket=os.environ['S3_BUCKET'],
+                    Key=path,
+                    Body=BytesIO(body)
+                )
 
         yield _get, _put
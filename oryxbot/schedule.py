@@ -0,0 +1,61 @@
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+POLL_MIN_INTERVAL = float(os.getenv('POLL_MIN_INTERVAL', '60'))
+POLL_MAX_INTERVAL = float(os.getenv('POLL_MAX_INTERVAL', '1800'))
+POLL_BACKOFF = float(os.getenv('POLL_BACKOFF', '1.5'))
+
+SUMMARY_HOUR = int(os.getenv('SUMMARY_HOUR', '8'))
+# delta days -> weekday it is published on, None for every day
+SUMMARIES = {1: None, 7: 0}
+
+
+class PollSchedule:
+    """
+    Polling interval growing while the pages don't change and dropping to the minimum after a change
+    """
+
+    def __init__(self, min_interval: float = POLL_MIN_INTERVAL, max_interval: float = POLL_MAX_INTERVAL,
+                 backoff: float = POLL_BACKOFF):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+
+    def next(self, changed: bool) -> float:
+        """
+        :param changed: whether the last poll found a change
+        :return: seconds until the next poll
+        """
+        self.interval = self.min_interval if changed else min(self.interval * self.backoff, self.max_interval)
+        return self.interval
+
+
+class SummaryScheduler:
+    """
+    Daily and weekly summaries published once a day at SUMMARY_HOUR UTC.
+    Summaries due before the scheduler was created are not published, a restart doesn't repeat them
+    """
+
+    def __init__(self, now: datetime, hour: int = SUMMARY_HOUR, summaries: Dict[int, int] = None):
+        self.hour = hour
+        self.summaries = SUMMARIES if summaries is None else summaries
+        self._next = self._following(now)
+
+    def _following(self, now: datetime) -> datetime:
+        at = now.replace(hour=self.hour, minute=0, second=0, microsecond=0)
+        return at if at > now else at + timedelta(days=1)
+
+    def due(self, now: datetime) -> List[int]:
+        """
+        :return: delta days of summaries due now, each is returned once
+        """
+        if now < self._next:
+            return []
+        at, self._next = self._next, self._following(now)
+        return [delta_days for delta_days, weekday in self.summaries.items()
+                if weekday is None or weekday == at.weekday()]
+
+    def until_next(self, now: datetime) -> float:
+        return max((self._next - now).total_seconds(), 0)
@@ -0,0 +1,165 @@
+import json
+import zlib
+from dataclasses import dataclass, field
+from itertools import accumulate, chain
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from oryxbot.parser import Loss, Row
+
+# fingerprint of the single item legacy snapshots are loaded into, never matches a real one
+LEGACY_ITEM = ''
+
+MAGIC = b'ORYX'
+VERSION = 2
+
+
+def _row(data: dict) -> Row:
+    return data['type'], data['status'], data['number'], data['link']
+
+
+def loss_row(loss: Loss) -> Row:
+    return loss.type, loss.status, loss.number, loss.link
+
+
+@dataclass
+class PageSnapshot:
+    """
+    Losses of a page grouped by the fingerprint of the <li> they were parsed from.
+    Rows are kept as loaded, only items that changed are ever converted to Loss
+    """
+    items: Dict[str, List[Row]] = field(default_factory=dict)
+
+    @classmethod
+    def from_json(cls, data) -> 'PageSnapshot':
+        if isinstance(data, list):
+            # flat list of losses written before fingerprints were introduced
+            return cls({LEGACY_ITEM: list(map(_row, data))} if data else {})
+        return cls({fingerprint: list(map(_row, rows)) for fingerprint, rows in data.items()})
+
+    def update(self, items: List[Tuple[str, Optional[List[Loss]]]]) -> Tuple['PageSnapshot', List[Loss]]:
+        """
+        Builds the new snapshot from parsed items and finds new losses only looking at items that changed
+        :param items: (fingerprint, losses) in document order, losses may be None for known fingerprints
+        :return: new snapshot and losses which were not present in any of the removed items
+        """
+        new_items = dict()
+        added = list()
+        for fingerprint, losses in items:
+            if fingerprint in self.items:
+                new_items[fingerprint] = self.items[fingerprint]
+            else:
+                new_items[fingerprint] = list(map(loss_row, losses))
+                added.extend(losses)
+
+        removed = {row for fingerprint, rows in self.items.items() if fingerprint not in new_items for row in rows}
+        return PageSnapshot(new_items), [loss for loss in added if loss_row(loss) not in removed]
+
+    def rows(self) -> Iterator[Row]:
+        return chain.from_iterable(self.items.values())
+
+
+@dataclass
+class SnapshotDelta:
+    """
+    Item level difference between two snapshots: items with new fingerprints and fingerprints that are gone
+    """
+    added: Dict[str, PageSnapshot] = field(default_factory=dict)
+    removed: Dict[str, List[str]] = field(default_factory=dict)
+
+    def __bool__(self):
+        return bool(self.added or self.removed)
+
+
+def snapshot_delta(old: Dict[str, PageSnapshot], new: Dict[str, PageSnapshot]) -> SnapshotDelta:
+    delta = SnapshotDelta()
+    for country, snapshot in new.items():
+        previous = old.get(country, PageSnapshot()).items
+        added = {fingerprint: rows for fingerprint, rows in snapshot.items.items() if fingerprint not in previous}
+        removed = [fingerprint for fingerprint in previous if fingerprint not in snapshot.items]
+        if added:
+            delta.added[country] = PageSnapshot(added)
+        if removed:
+            delta.removed[country] = removed
+    return delta
+
+
+def apply_delta(pages: Dict[str, PageSnapshot], delta: SnapshotDelta) -> Dict[str, PageSnapshot]:
+    result = dict()
+    for country in dict.fromkeys([*pages, *delta.added]):
+        removed = set(delta.removed.get(country, []))
+        items = {fingerprint: rows for fingerprint, rows in pages.get(country, PageSnapshot()).items.items()
+                 if fingerprint not in removed}
+        items.update(delta.added.get(country, PageSnapshot()).items)
+        result[country] = PageSnapshot(items)
+    return result
+
+
+def _encode(pages: Dict[str, PageSnapshot], **extra) -> bytes:
+    types, statuses = dict(), dict()
+    columns = dict()
+    for country, snapshot in pages.items():
+        page = columns[country] = {'items': list(), 'counts': list(),
+                                   'type': list(), 'status': list(), 'number': list(), 'link': list()}
+        for fingerprint, rows in snapshot.items.items():
+            page['items'].append(fingerprint)
+            page['counts'].append(len(rows))
+            for type_, status, number, link in rows:
+                page['type'].append(types.setdefault(type_, len(types)))
+                page['status'].append(statuses.setdefault(status, len(statuses)))
+                page['number'].append(number)
+                page['link'].append(link)
+
+    data = json.dumps({'types': list(types), 'statuses': list(statuses), 'pages': columns, **extra},
+                      separators=(',', ':'))
+    return MAGIC + bytes([VERSION]) + zlib.compress(data.encode(), 9)
+
+
+def _decode(body: bytes) -> Tuple[Dict[str, PageSnapshot], dict]:
+    if body[len(MAGIC)] != VERSION:
+        raise ValueError(f"Unsupported snapshot version {body[len(MAGIC)]}")
+
+    data = json.loads(zlib.decompress(body[len(MAGIC) + 1:]))
+    types, statuses = data['types'], data['statuses']
+    pages = dict()
+    for country, page in data['pages'].items():
+        rows = list(zip([types[idx] for idx in page['type']], [statuses[idx] for idx in page['status']],
+                        page['number'], page['link']))
+        bounds = [0, *accumulate(page['counts'])]
+        pages[country] = PageSnapshot({fingerprint: rows[start:end]
+                                       for fingerprint, start, end in zip(page['items'], bounds, bounds[1:])})
+    return pages, data
+
+
+def encode_snapshots(pages: Dict[str, PageSnapshot]) -> bytes:
+    """
+    Compact snapshot format: types and statuses are interned, rows are stored column by column
+    and the whole document is zlib compressed behind a magic and version header
+    :param pages: snapshot per country
+    :return: encoded snapshot
+    """
+    return _encode(pages)
+
+
+def decode_snapshots(body: bytes) -> Dict[str, PageSnapshot]:
+    """
+    Reads both the compact format and legacy JSON snapshots, see encode_snapshots
+    :param body: stored object, empty if there is none
+    :return: snapshot per country
+    """
+    if not body:
+        return {}
+    if not body.startswith(MAGIC):
+        return {country: PageSnapshot.from_json(data) for country, data in json.loads(body).items()}
+    return _decode(body)[0]
+
+
+def encode_delta(delta: SnapshotDelta) -> bytes:
+    """
+    Deltas use the snapshot format for added items with removed fingerprints stored alongside
+    """
+    return _encode(delta.added, removed=delta.removed)
+
+
+def decode_delta(body: bytes) -> SnapshotDelta:
+    added, data = _decode(body)
+    return SnapshotDelta(added=added, removed=data['removed'])
@@ -0,0 +1,73 @@
+import hashlib
+from dataclasses import dataclass
+from functools import partial
+from typing import Container, List, Optional, Tuple
+
+from aiohttp import ClientSession
+
+from oryxbot.archive_util import CHUNK_SIZE
+from oryxbot.executor_util import parse_chunks
+from oryxbot.metrics import count, span
+from oryxbot.parser import ItemFeed, Loss
+
+
+@dataclass(frozen=True)
+class SourceState:
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    digest: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class SourcePage:
+    url: str
+    state: SourceState
+    items: Optional[List[Tuple[str, Optional[List[Loss]]]]] = None
+
+    @property
+    def changed(self) -> bool:
+        return self.items is not None
+
+
+async def fetch_source(session: ClientSession, url: str, state: SourceState, known: Container[str] = ()) -> SourcePage:
+    """
+    Conditionally fetches the page, items are only returned if the content differs from the previous state.
+    304 skips the download altogether, otherwise the page is parsed while downloading and the digest of the body
+    decides whether the result is used
+    :param session: http session
+    :param url: page url
+    :param state: validators and digest stored after the previous fetch
+    :param known: fingerprints of items in the previous snapshot, these are not parsed again.
+                  It may still be filled while the page is being parsed
+    :return: page with the new state, items are None when the page didn't change
+    """
+    headers = dict()
+    if state.etag:
+        headers['If-None-Match'] = state.etag
+    if state.last_modified:
+        headers['If-Modified-Since'] = state.last_modified
+
+    with span('fetch_source'):
+        async with session.get(url, headers=headers) as r:
+            if r.status == 304:
+                count('sources_not_modified')
+                return SourcePage(url=url, state=state)
+            r.raise_for_status()
+
+            digest = hashlib.sha256()
+
+            def _chunk(chunk: bytes):
+                digest.update(chunk)
+                count('source_bytes', len(chunk))
+
+            items = await parse_chunks(partial(ItemFeed, known), r.content.iter_chunked(CHUNK_SIZE), _chunk)
+
+            new_state = SourceState(etag=r.headers.get('ETag'),
+                                    last_modified=r.headers.get('Last-Modified'),
+                                    digest=digest.hexdigest())
+    count('items_parsed', sum(losses is not None for _, losses in items))
+    count('losses_parsed', sum(len(losses) for _, losses in items if losses is not None))
+
+    if new_state.digest == state.digest:
+        return SourcePage(url=url, state=new_state)
+    return SourcePage(url=url, state=new_state, items=items)
@@ -1,95 +1,301 @@
+import asyncio
 import logging
 import os
+import re
 import time
-from collections import defaultdict
+from collections import Counter, defaultdict
 from datetime import date, datetime
-from itertools import groupby, zip_longest
-from tempfile import NamedTemporaryFile
-from typing import List, Tuple
+from io import BytesIO
+from itertools import chain, zip_longest
+from typing import Dict, List, Optional, Tuple
 
-from aiohttp import ClientSession
-from tweepy import Client, API, OAuthHandler, TooManyRequests, BadRequest
+from tweepy import Client, TooManyRequests, BadRequest, Forbidden
 
-from oryxbot.image_resolver import resolve
+from oryxbot import image_resolver
+from oryxbot.aggregation import Counts, nest_counts
+from oryxbot.client_util import CLIENTS
+from oryxbot.metrics import count, span
+from oryxbot.outbox import Outbox, Publication, plan
 from oryxbot.parser import Loss
-from oryxbot.txt2image import text_to_image
+from oryxbot.rate_limit import TokenBucket
+from oryxbot.txt2image import text_renderer
 
+MEDIA_CONCURRENCY = int(os.getenv('MEDIA_CONCURRENCY', '4'))
+TWEETS_PER_WINDOW = int(os.getenv('TWEETS_PER_WINDOW', '200'))
+TWEETS_WINDOW = float(os.getenv('TWEETS_WINDOW', '900'))
+# diffs larger than this are published as threads of batched tweets
+BATCH_THRESHOLD = int(os.getenv('BATCH_THRESHOLD', '20'))
+MEDIA_PER_TWEET = 4
+# attempts after a 429 before giving up, waits start at RETRY_BACKOFF seconds and double every time
+TWEET_RETRIES = int(os.getenv('TWEET_RETRIES', '5'))
+RETRY_BACKOFF = float(os.getenv('RETRY_BACKOFF', '1'))
+TWEET_LENGTH = 280
+# links count as t.co urls of this length
+URL_LENGTH = 23
+URL_RE = re.compile(r'https?://\S+')
 
-def publish_date_diff(losses: List[Tuple[str, Loss]], date_: date):
-    if not losses:
-        return
+_limiter: Optional[Tuple[asyncio.AbstractEventLoop, TokenBucket]] = None
+
+
+def _tweet_id(response) -> Optional[str]:
+    return response.data['id'] if response else None
+
+
+def summary_items(counts: Counts, date_: date, now: Optional[datetime] = None) -> List[List[Optional[str]]]:
+    """
+    Rows of the summary image: title, total per country and a column per country with a cell per vehicle type
+    :param counts: number of losses per (country, type, status)
+    :param date_: start of the summary
+    :param now: end of the summary, current time if None
+    """
+    vehicles = nest_counts(counts)
 
     country_items = defaultdict(list)
-    for country, country_data in groupby(losses, lambda x: x[0]):
-        data = list(map(lambda x: x[1], country_data))
-        for vehicle, vehicle_data in groupby(data, lambda x: x.type):
-            vehicle_data = list(vehicle_data)
-            status_items = [f"{vehicle} total: {len(vehicle_data)}"]
-            for status, status_data in groupby(vehicle_data, lambda x: x.status):
-                status_items.append(f"{status}: {len(list(status_data))}")
+    for country, country_data in vehicles.items():
+        for vehicle, statuses in country_data.items():
+            status_items = [f"{vehicle} total: {sum(statuses.values())}"]
+            status_items.extend(f"{status}: {count}" for status, count in statuses.items())
             country_items[country].append(f", ".join(status_items))
 
-    now = datetime.utcnow()
+    now = now or datetime.utcnow()
     interval_str = f"{now - date_}".split(".")[0]
     items = [[f"Losses for {interval_str} between {date_.isoformat()} and {now.isoformat()}"],
-             [f"{country.capitalize()} losses: {len(list(filter(lambda x: x[0] == country, losses)))}"
+             [f"{country.capitalize()} losses: {sum(map(lambda x: sum(x.values()), vehicles[country].values()))}"
               for country in country_items.keys()]]
 
     sorted_by_name = {c: sorted(data) for c, data in country_items.items()}
 
     for vals in zip_longest(*sorted_by_name.values()):
         items.append(list(vals))
+    return items
+
+
+async def publish_date_diff(counts: Counts, date_: date):
+    """
+    Publishes a summary image of losses since date, tweets share the rate limiter with the losses
+    :param counts: number of losses per (country, type, status)
+    :param date_: start of the summary
+    """
+    if not counts:
+        return
+
+    items = summary_items(counts, date_)
+    renderer = text_renderer("fonts/arial.ttf", 18, (240, 230, 10), (50, 50, 50))
+    api, client = CLIENTS.media_api(), CLIENTS.tweet_client()
+    with span('render_summary'):
+        pages = await asyncio.to_thread(renderer.render_png, items, header=2)
+    with span('media_upload'):
+        media_ids = [(await asyncio.to_thread(api.media_upload, filename="summary.png", file=BytesIO(page)))
+                     .media_id_string for page in pages]
+
+    # tall summaries are split into pages, those not fitting into the first tweet follow as replies
+    parent = None
+    for idx in range(0, len(media_ids), MEDIA_PER_TWEET):
+        parent = await _create_tweet(client, tweet_limiter(), text=items[0][0],
+                                     media_ids=media_ids[idx:idx + MEDIA_PER_TWEET],
+                                     in_reply_to_tweet_id=_tweet_id(parent))
+
+
+def tweet_limiter() -> TokenBucket:
+    """
+    Rate limiter shared by every tweet posted on the running event loop
+    """
+    global _limiter
+    loop = asyncio.get_running_loop()
+    if _limiter is None or _limiter[0] is not loop:
+        _limiter = loop, TokenBucket(TWEETS_PER_WINDOW, TWEETS_WINDOW)
+    return _limiter[1]
+
+
+def _reset_time(ex: TooManyRequests) -> Optional[float]:
+    reset = getattr(ex.response, 'headers', {}).get('x-rate-limit-reset')
+    return float(reset) if reset else None
+
+
+async def _create_tweet(client: Client, limiter: TokenBucket, **kwargs):
+    for attempt in range(TWEET_RETRIES + 1):
+        with span('rate_limit_wait'):
+            await limiter.acquire()
+        try:
+            with span('create_tweet'):
+                response = await asyncio.to_thread(client.create_tweet, **kwargs)
+            count('tweets_posted')
+            return response
+        except TooManyRequests as ex:
+            if attempt == TWEET_RETRIES:
+                raise
+            count('tweet_retries')
+            # a reset time already passed still backs off, longer after every attempt
+            reset = _reset_time(ex)
+            limiter.pause_until(max(reset, time.time() + RETRY_BACKOFF * 2 ** attempt) if reset else None)
+
+
+def _tweet_length(text: str) -> int:
+    return len(URL_RE.sub('x' * URL_LENGTH, text))
+
+
+def _fit(text: str) -> str:
+    # only a single line longer than a tweet gets here, batches are sized to fit
+    while _tweet_length(text) > TWEET_LENGTH:
+        text = text[:TWEET_LENGTH - 1 - _tweet_length(text) + len(text)].rstrip() + "…"
+    return text
+
+
+def _link_line(same: List[Loss]) -> str:
+    statuses = Counter(loss.status for loss in same)
+    return f"{', '.join(status if n == 1 else f'{status} x{n}' for status, n in statuses.items())}: {same[0].link}"
+
+
+def _lines(type_: str, batch: List[List[Loss]]) -> str:
+    return "\n".join([f"{type_}:"] + [_link_line(same) for same in batch])
 
-    auth = OAuthHandler(consumer_key=os.environ['CONSUMER_KEY'], consumer_secret=os.environ['CONSUMER_SECRET'])
-    auth.set_access_token(key=os.environ['ACCESS_TOKEN'], secret=os.environ['ACCESS_TOKEN_SECRET'])
-    api = API(auth)
-
-    client = Client(
-        consumer_key=os.environ['CONSUMER_KEY'],
-        consumer_secret=os.environ['CONSUMER_SECRET'],
-        access_token=os.environ['ACCESS_TOKEN'],
-        access_token_secret=os.environ['ACCESS_TOKEN_SECRET'],
-    )
-
-    with NamedTemporaryFile(suffix='.png') as temp_file:
-        img = text_to_image(
-            items=items,
-            font_filepath="fonts/arial.ttf",
-            font_size=18,
-            color=(240, 230, 10),
-            background=(50, 50, 50)
-        )
-        img.save(temp_file.name)
-        ret = api.media_upload(filename=temp_file.name)
-    client.create_tweet(text=items[0][0], media_ids=[ret.media_id_string])
-
-
-async def publish_losses(losses: List[Tuple[str, Loss]]):
-    client = Client(
-        consumer_key=os.environ['CONSUMER_KEY'],
-        consumer_secret=os.environ['CONSUMER_SECRET'],
-        access_token=os.environ['ACCESS_TOKEN'],
-        access_token_secret=os.environ['ACCESS_TOKEN_SECRET'],
-    )
-    use_media = True
-    async with ClientSession() as session:
-        for country, loss in losses:
-            logging.info(f"{country=}, {loss=}")
-            while True:
+
+def _batch_text(type_: str, batch: List[List[Loss]]) -> str:
+    return _fit(_lines(type_, batch))
+
+
+def _batches(losses: List[Tuple[str, Loss]]) -> Dict[str, List[Tuple[str, List[List[Loss]]]]]:
+    """
+    Groups losses by country and equipment type, every batch refers to at most MEDIA_PER_TWEET links
+    and its text fits into a tweet
+    :param losses: (country, loss) to group
+    :return: country -> [(type, [losses sharing a link])] in order of first appearance
+    """
+    groups = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+    for country, loss in losses:
+        groups[country][loss.type][loss.link].append(loss)
+
+    result = defaultdict(list)
+    for country, types in groups.items():
+        for type_, links in types.items():
+            batch = list()
+            for same in links.values():
+                if batch and (len(batch) == MEDIA_PER_TWEET or
+                              _tweet_length(_lines(type_, batch + [same])) > TWEET_LENGTH):
+                    result[country].append((type_, batch))
+                    batch = list()
+                batch.append(same)
+            result[country].append((type_, batch))
+    return result
+
+
+async def _tweet(client: Client, limiter: TokenBucket, text: str, links: List[str],
+                 media: Dict[str, asyncio.Task], **kwargs):
+    media_ids = list(chain.from_iterable([await media[link] for link in links]))
+    try:
+        response = await _create_tweet(client, limiter, text=text, media_ids=media_ids[:MEDIA_PER_TWEET], **kwargs)
+    except BadRequest:
+        count('tweets_without_media')
+        logging.exception(f"Unable to post, trying without media")
+        for link in links:
+            image_resolver.MEDIA_CACHE.invalidate(link)
+        return await _create_tweet(client, limiter, text=text, media_ids=None, **kwargs)
+
+    # links resolving to several images may bring more than a tweet takes, the rest follows as replies
+    for idx in range(MEDIA_PER_TWEET, len(media_ids), MEDIA_PER_TWEET):
+        count('media_overflow_tweets')
+        response = await _create_tweet(client, limiter, media_ids=media_ids[idx:idx + MEDIA_PER_TWEET],
+                                       in_reply_to_tweet_id=_tweet_id(response))
+    return response
+
+
+def publications(losses: List[Tuple[str, Loss]], run: str) -> List[Publication]:
+    """
+    A tweet per loss in order, diffs larger than BATCH_THRESHOLD become a thread per country
+    with losses of the same type batched into tweets of up to MEDIA_PER_TWEET images
+    :param losses: (country, loss) to publish
+    :param run: identifies the run the losses were found by
+    """
+    entries = list()
+    if len(losses) > BATCH_THRESHOLD:
+        for country, batches in _batches(losses).items():
+            total = sum(len(same) for _, batch in batches for same in batch)
+            logging.info(f"{country=}, {total} losses in {len(batches)} tweets")
+            entries.append((country, f"{country} losses: {total}", [], False))
+            entries.extend((country, _batch_text(type_, batch), [same[0].link for same in batch], True)
+                           for type_, batch in batches)
+    else:
+        entries.extend((country, f"{country} {loss.type} {loss.status}: {loss.link}", [loss.link], False)
+                       for country, loss in losses)
+    return plan(entries, run)
+
+
+# responses rejecting the tweet itself, retrying it as it is won't help
+REJECTED = (BadRequest, Forbidden)
+
+
+def _duplicate(ex: Forbidden) -> bool:
+    return any('duplicate' in message.lower() for message in ex.api_messages)
+
+
+async def publish_outbox(outbox: Outbox):
+    """
+    Posts pending publications of the outbox, a worker per country posts them in order and confirms each one.
+    Countries are published concurrently, media of upcoming tweets is resolved by at most MEDIA_CONCURRENCY
+    workers while tweets go through the rate limiter. A failed country stops at the failed publication,
+    the others carry on before the error is raised. Publications Twitter rejects repeatedly are moved aside,
+    those rejected as duplicates were posted before and count as confirmed. Rate limits and network errors
+    leave the publication pending for the next run
+    :param outbox: publications to post
+    """
+    pending = outbox.pending()
+    if not pending:
+        return
+    logging.info(f"Publishing {len(pending)} tweets, {len(outbox.posted)} already posted")
+
+    client = CLIENTS.tweet_client()
+    limiter = tweet_limiter()
+    pool = asyncio.Semaphore(MEDIA_CONCURRENCY)
+
+    cache = image_resolver.MEDIA_CACHE
+
+    async with CLIENTS.session() as session:
+        async def _media(link: str) -> List[str]:
+            async with pool:
+                return await cache.resolve(session, link)
+
+        # several losses often share one photo, it is downloaded and uploaded once
+        media = dict()
+        for link in chain.from_iterable(publication.links for publication in pending):
+            if link not in media:
+                media[link] = asyncio.create_task(_media(link))
+
+        async def _worker(publications: List[Publication]):
+            for publication in publications:
+                logging.info(f"{publication.country=}, {publication.text}")
+                kwargs = {'in_reply_to_tweet_id': outbox.parent(publication)} if publication.reply else {}
                 try:
-                    client.create_tweet(
-                        text=f"{country} {loss.type} {loss.status}: {loss.link}",
-                        media_ids=await resolve(session, loss.link) if use_media else None
-                    )
-                    use_media = True
-                    break
-                except TooManyRequests:
-                    time.sleep(60)
-                except BadRequest:
-                    if not use_media:
+                    if publication.links:
+                        response = await _tweet(client, limiter, publication.text, publication.links, media,
+                                                **kwargs)
+                    else:
+                        response = await _create_tweet(client, limiter, text=publication.text, **kwargs)
+                except Exception as ex:
+                    if isinstance(ex, Forbidden) and _duplicate(ex):
+                        # posted by a run which stopped before confirming it
+                        count('tweets_duplicate')
+                        logging.warning(f"Already posted {publication}")
+                        response = None
+                    elif isinstance(ex, REJECTED) and await outbox.fail(publication, ex):
+                        continue
+                    else:
                         raise
-                    logging.exception(f"Unable to post, trying without media")
-                    use_media = False
-                except Exception:
-                    logging.exception(f"Failed to publish diff")
-                    raise
+                await outbox.confirm(publication, _tweet_id(response))
+
+        countries = defaultdict(list)
+        for publication in pending:
+            countries[publication.country].append(publication)
+
+        try:
+            errors = [result for result in await asyncio.gather(*map(_worker, countries.values()),
+                                                                 return_exceptions=True)
+                      if isinstance(result, BaseException)]
+            if errors:
+                raise errors[0]
+        except Exception:
+            logging.exception(f"Failed to publish diff")
+            raise
+        finally:
+            for task in media.values():
+                task.cancel()
+
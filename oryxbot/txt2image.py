@@ -1,7 +1,92 @@
-from typing import List, Tuple
+from functools import lru_cache
+from io import BytesIO
+from typing import List, Optional, Tuple, Union
 
 from PIL import Image, ImageDraw, ImageFont
 
+Font = Union[ImageFont.FreeTypeFont, ImageFont.ImageFont]
+
+# images taller than this are split into pages, Twitter rejects larger dimensions
+MAX_HEIGHT = 4096
+METRICS_CACHE_SIZE = 4096
+# text is drawn in two colors, antialiasing needs just a few shades in between
+PNG_COLORS = 32
+PNG_COMPRESS_LEVEL = 6
+
+MARGIN_LEFT = 10
+COLUMN_GAP = 20
+MARGIN_BOTTOM = 30
+
+
+class TextRenderer:
+    """
+    Renders rows of text as columns. The font is loaded once and widths of measured strings are cached,
+    so rendering similar summaries again is cheap
+    """
+
+    def __init__(self, font: Font, color: Tuple[int, int, int], background: Tuple[int, int, int], spacing: int = 4):
+        self.font = font
+        self.color = color
+        self.background = background
+        self.spacing = spacing
+        self.line_height = font.getbbox("A")[3] + spacing
+        self._width = lru_cache(maxsize=METRICS_CACHE_SIZE)(self._measure)
+
+    def _measure(self, text: str) -> int:
+        return self.font.getbbox(text)[2]
+
+    def render(self, items: List[List[Optional[str]]]) -> Image:
+        """
+        :param items: rows of cells, missing and None cells are left empty
+        :return: image with a column per cell index
+        """
+        offsets = list()
+        texts = list()
+        offset = MARGIN_LEFT
+        for idx in range(max(map(len, items))):
+            lines = [line[idx] or '' if len(line) > idx else '' for line in items]
+            offsets.append(offset)
+            texts.append("\n".join(lines))
+            offset += max(map(self._width, lines)) + COLUMN_GAP
+
+        img = Image.new("RGB", (offset, len(items) * self.line_height - self.spacing + MARGIN_BOTTOM),
+                        color=self.background)
+        draw = ImageDraw.Draw(img)
+        for offset, text in zip(offsets, texts):
+            draw.multiline_text((offset, 0), text, font=self.font, fill=self.color, align="left",
+                                spacing=self.spacing)
+        return img
+
+    def render_pages(self, items: List[List[Optional[str]]], header: int = 0,
+                     max_height: int = MAX_HEIGHT) -> List[Image]:
+        """
+        Splits rows into pages no taller than max_height
+        :param items: rows of cells
+        :param header: number of leading rows repeated on every page
+        :param max_height: page height limit
+        :return: image per page
+        """
+        rows = max(1, (max_height - MARGIN_BOTTOM + self.spacing) // self.line_height - header)
+        head, body = items[:header], items[header:]
+        return [self.render(head + body[idx:idx + rows]) for idx in range(0, max(len(body), 1), rows)]
+
+    def render_png(self, items: List[List[Optional[str]]], header: int = 0,
+                   max_height: int = MAX_HEIGHT) -> List[bytes]:
+        return list(map(encode_png, self.render_pages(items, header, max_height)))
+
+
+def encode_png(img: Image) -> bytes:
+    buffer = BytesIO()
+    img.convert("P", palette=Image.Palette.ADAPTIVE, colors=PNG_COLORS) \
+        .save(buffer, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=8)
+def text_renderer(font_filepath: str, font_size: int, color: Tuple[int, int, int],
+                  background: Tuple[int, int, int]) -> TextRenderer:
+    return TextRenderer(ImageFont.truetype(font_filepath, size=font_size), color, background)
+
 
 def text_to_image(
         items: List[List[str]],
@@ -10,31 +95,4 @@ def text_to_image(
         color: Tuple[int, int, int],
         background: Tuple[int, int, int],
 ) -> Image:
-    countries = max(map(len, items))
-    font = ImageFont.truetype(font_filepath, size=font_size)
-
-    max_y = 0
-    max_x = 0
-    offset = 10
-    offsets = list()
-    lines_to_draw = list()
-    for idx in range(countries):
-        lines = [line[idx] or '' if len(line) > idx else '' for line in items]
-
-        offsets.append(offset)
-        lines_to_draw.append(lines)
-
-        x, y = font.getsize_multiline("\n".join(lines))
-        offset += x
-        offset += 20
-        max_x = max(max_x, offset)
-        max_y = max(max_y, y)
-
-    img = Image.new("RGB", (max_x, max_y + 30), color=background)
-
-    draw = ImageDraw.Draw(img)
-    for offset, lines in zip(offsets, lines_to_draw):
-        draw_point = (offset, 0)
-        draw.multiline_text(draw_point, "\n".join(lines), font=font, fill=color, align="left")
-
-    return img
\ No newline at end of file
+    return text_renderer(font_filepath, font_size, color, background).render(items)
@@ -0,0 +1,92 @@
+"""
+End-to-end run of the bot against the local stand-ins of fake_services.py. Previous versions of the pages
+are seeded into S3 and Wayback, the Oryx host serves grown pages, new losses are published to the Twitter stub
+and the summaries are compared against Wayback. A second check with unchanged pages follows
+"""
+import os
+import time
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from oryxbot import archive_util, main
+from oryxbot.client_util import CLIENTS
+from oryxbot.metrics import METRICS
+from oryxbot.parser import ItemFeed
+from oryxbot.snapshot import PageSnapshot, encode_snapshots, loss_row
+from fake_services import TWITTER_HOSTS, FakeServices, RedirectAdapter, capture_key
+from oryx_page import generate_page
+
+# seed of the generated page per country
+COUNTRIES = {'ukrainian': 0, 'russian': 1}
+IMAGE_HOST = b"https://i.postimg.cc/"
+BUCKET = 'oryxbot'
+CREDENTIALS = {'CONSUMER_KEY': 'key', 'CONSUMER_SECRET': 'secret',
+               'ACCESS_TOKEN': 'token', 'ACCESS_TOKEN_SECRET': 'token-secret'}
+
+
+def _snapshot(body: bytes) -> PageSnapshot:
+    feed = ItemFeed()
+    items = feed.feed(body) + feed.close()
+    return PageSnapshot({fingerprint: list(map(loss_row, losses)) for fingerprint, losses in items})
+
+
+def seed(services: FakeServices, losses: int, new: int):
+    """
+    Serves pages with the given number of losses, the pages a day before lack the last `new` of them.
+    Those are captured by Wayback and stored in S3 as the state of the previous run
+    """
+    captured = datetime.utcnow() - timedelta(days=1)
+    snapshots = dict()
+    for country, page_seed in COUNTRIES.items():
+        previous = generate_page(max(losses - new, 0), page_seed).replace(IMAGE_HOST, services.image_url().encode())
+        services.pages[f"{country}.html"] = generate_page(losses, page_seed).replace(
+            IMAGE_HOST, services.image_url().encode())
+        services.captures[capture_key(services.page_url(f"{country}.html"))] = [(captured, previous)]
+        snapshots[country] = _snapshot(previous)
+    services.objects[(BUCKET, main.S3_PATH_LAST)] = encode_snapshots(snapshots)
+
+
+@contextmanager
+def pointed_at(services: FakeServices):
+    """
+    Points the bot at the stand-ins: page urls, Wayback endpoints, S3 endpoint and credentials,
+    Twitter clients get their requests redirected to the stub until the context exits
+    """
+    with ExitStack() as stack:
+        stack.enter_context(patch.dict(os.environ, dict(
+            CREDENTIALS, AWS_ENDPOINT=services.s3_url, AWS_ACCESS_KEY_ID='fake', AWS_SECRET_ACCESS_KEY='fake',
+            AWS_DEFAULT_REGION='us-east-1', S3_BUCKET=BUCKET)))
+        stack.enter_context(patch.dict(main.URLS, {services.page_url(f"{country}.html"): country
+                                                   for country in COUNTRIES}, clear=True))
+        stack.enter_context(patch.object(archive_util, 'WAYBACK_URL', f"{services.url}/wayback/available"))
+        stack.enter_context(patch.object(archive_util, 'CDX_URL', f"{services.url}/cdx/search/cdx"))
+        stack.enter_context(patch.object(archive_util, 'REPLAY_URL', f"{services.url}/web/{{timestamp}}id_/{{url}}"))
+
+        adapter = RedirectAdapter(services.url)
+        for session in (CLIENTS.tweet_client().session, CLIENTS.media_api().session):
+            # the clients are shared by the process, their own adapters are put back on exit
+            stack.callback(setattr, session, 'adapters', session.adapters.copy())
+            for host in TWITTER_HOSTS:
+                session.mount(host, adapter)
+        yield
+
+
+async def run(services: FakeServices, summaries: bool = True) -> dict:
+    """
+    Checks the sources, publishes new losses and summaries, then checks the unchanged sources again
+    :return: timings, what reached the stubs and the metrics of the run
+    """
+    METRICS.reset()
+    start = time.perf_counter()
+    report = await main.compare_with_last_and_publish()
+    checked = time.perf_counter()
+    if summaries and report.losses:
+        await main.publish_report_summaries(report)
+    summarized = time.perf_counter()
+    unchanged = await main.compare_with_last_and_publish()
+    return {'losses': len(report.losses), 'tweets': len(services.tweets), 'media': len(services.media),
+            'rate_limited': services.rate_limited, 'unchanged_skipped': len(unchanged.skipped),
+            'check_seconds': checked - start, 'summary_seconds': summarized - checked,
+            'recheck_seconds': time.perf_counter() - summarized, 'requests': services.requests,
+            'metrics': METRICS.report()}
@@ -0,0 +1,222 @@
+"""
+In-process stand-ins for the services a run talks to, served by aiohttp on localhost:
+Oryx pages and the images they link to, Wayback availability, CDX and replay endpoints,
+an S3 object store for s3_client (AWS_ENDPOINT) and the Twitter v1.1 media upload and v2 tweet endpoints
+with configurable latency and 429 responses. See e2e.py for a run driven against them
+"""
+import asyncio
+import hashlib
+import itertools
+import re
+import time
+from datetime import datetime
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+from requests.adapters import HTTPAdapter
+
+TWITTER_HOSTS = ("https://api.twitter.com", "https://upload.twitter.com")
+NO_SUCH_KEY = b'<?xml version="1.0" encoding="UTF-8"?>' \
+              b'<Error><Code>NoSuchKey</Code><Message>The specified key does not exist.</Message></Error>'
+
+_SCHEME_RE = re.compile(r'^https?:/+')
+
+
+def capture_key(url: str) -> str:
+    # proxies and routers may collapse the double slash of a url embedded in a path
+    return _SCHEME_RE.sub('', url)
+
+
+def _image(size: Tuple[int, int] = (640, 480)) -> bytes:
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new('RGB', size, (90, 110, 60)).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+async def _serve(app: web.Application) -> Tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+class RedirectAdapter(HTTPAdapter):
+    """
+    Sends requests for the Twitter hosts to the stub instead, tweepy has the hosts built in
+    """
+
+    def __init__(self, base_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    def send(self, request, **kwargs):
+        for host in TWITTER_HOSTS:
+            if request.url.startswith(host):
+                request.url = self.base_url + request.url[len(host):]
+        return super().send(request, **kwargs)
+
+
+class FakeServices:
+    """
+    Oryx host, Wayback, Twitter and S3 stand-ins. Pages, captures and objects are plain dicts
+    which can be changed between runs, everything published is recorded in tweets and media
+    """
+
+    def __init__(self, latency: float = 0.0, rate_limit_every: int = 0, reset_after: float = 1.0):
+        """
+        :param latency: seconds every Twitter request takes
+        :param rate_limit_every: every Nth tweet is answered with 429, never if 0
+        :param reset_after: seconds until the rate limit of a 429 resets
+        """
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.reset_after = reset_after
+
+        self.pages: Dict[str, bytes] = dict()
+        self.captures: Dict[str, List[Tuple[datetime, bytes]]] = dict()
+        self.objects: Dict[Tuple[str, str], bytes] = dict()
+        self.tweets: List[dict] = list()
+        self.media: List[int] = list()
+        self.rate_limited = 0
+        self.requests: Dict[str, int] = dict()
+
+        self.url: Optional[str] = None
+        self.s3_url: Optional[str] = None
+        self._image = _image()
+        self._ids = itertools.count(1)
+        self._tweet_requests = 0
+        self._runners: List[web.AppRunner] = list()
+
+    def page_url(self, name: str) -> str:
+        return f"{self.url}/oryx/{name}"
+
+    def image_url(self) -> str:
+        """
+        Prefix replacing the image host of generated pages
+        """
+        return f"{self.url}/img/"
+
+    async def start(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024, middlewares=[self._count])
+        app.router.add_get('/oryx/{name}', self._page)
+        app.router.add_get('/img/{path:.*}', self._image_file)
+        app.router.add_get('/wayback/available', self._available)
+        app.router.add_get('/cdx/search/cdx', self._cdx)
+        app.router.add_get(r'/web/{timestamp:\d+}id_/{url:.*}', self._replay)
+        app.router.add_post('/2/tweets', self._create_tweet)
+        app.router.add_post('/1.1/media/upload.json', self._media_upload)
+        runner, self.url = await _serve(app)
+        self._runners.append(runner)
+
+        # S3 has buckets at the root, it gets a server of its own
+        s3 = web.Application(client_max_size=256 * 1024 * 1024, middlewares=[self._count])
+        s3.router.add_get('/{bucket}/{key:.+}', self._get_object)
+        s3.router.add_put('/{bucket}/{key:.+}', self._put_object)
+        runner, self.s3_url = await _serve(s3)
+        self._runners.append(runner)
+
+    async def close(self):
+        for runner in self._runners:
+            await runner.cleanup()
+        self._runners.clear()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @web.middleware
+    async def _count(self, request: web.Request, handler):
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+        self.requests[route] = self.requests.get(route, 0) + 1
+        return await handler(request)
+
+    # Oryx
+
+    async def _page(self, request: web.Request) -> web.StreamResponse:
+        body = self.pages.get(request.match_info['name'])
+        if body is None:
+            raise web.HTTPNotFound()
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(body=body, content_type='text/html', headers={'ETag': etag})
+
+    async def _image_file(self, request: web.Request) -> web.StreamResponse:
+        return web.Response(body=self._image, content_type='image/jpeg')
+
+    # Wayback
+
+    def _closest(self, url: str, timestamp: str) -> Optional[Tuple[datetime, bytes]]:
+        captures = self.captures.get(capture_key(url))
+        if not captures:
+            return None
+        at = datetime.strptime(timestamp.ljust(14, '0')[:14], "%Y%m%d%H%M%S")
+        return min(captures, key=lambda capture: abs(capture[0] - at))
+
+    async def _available(self, request: web.Request) -> web.StreamResponse:
+        url = request.query['url']
+        closest = self._closest(url, request.query.get('timestamp', datetime.utcnow().strftime("%Y%m%d")))
+        if closest is None:
+            return web.json_response({'url': url, 'archived_snapshots': {}})
+        timestamp = closest[0].strftime("%Y%m%d%H%M%S")
+        return web.json_response({'url': url, 'archived_snapshots': {'closest': {
+            'status': "200", 'available': True, 'timestamp': timestamp,
+            'url': f"{self.url}/web/{timestamp}/{url}"}}})
+
+    async def _cdx(self, request: web.Request) -> web.StreamResponse:
+        url = request.query['url']
+        start, end = request.query.get('from', '0'), request.query.get('to', '9')
+        rows = [[at.strftime("%Y%m%d%H%M%S"), url] for at, _ in self.captures.get(capture_key(url), [])]
+        rows = [row for row in sorted(rows) if start <= row[0][:len(start)] and row[0][:len(end)] <= end]
+        return web.json_response([["timestamp", "original"]] + rows if rows else [])
+
+    async def _replay(self, request: web.Request) -> web.StreamResponse:
+        timestamp = request.match_info['timestamp']
+        for at, body in self.captures.get(capture_key(request.match_info['url']), []):
+            if at.strftime("%Y%m%d%H%M%S") == timestamp:
+                return web.Response(body=body, content_type='text/html')
+        raise web.HTTPNotFound()
+
+    # S3
+
+    async def _get_object(self, request: web.Request) -> web.StreamResponse:
+        body = self.objects.get((request.match_info['bucket'], request.match_info['key']))
+        if body is None:
+            return web.Response(status=404, body=NO_SUCH_KEY, content_type='application/xml')
+        return web.Response(body=body, content_type='binary/octet-stream',
+                            headers={'ETag': f'"{hashlib.md5(body).hexdigest()}"'})
+
+    async def _put_object(self, request: web.Request) -> web.StreamResponse:
+        body = await request.read()
+        self.objects[(request.match_info['bucket'], request.match_info['key'])] = body
+        return web.Response(headers={'ETag': f'"{hashlib.md5(body).hexdigest()}"'})
+
+    # Twitter
+
+    async def _create_tweet(self, request: web.Request) -> web.StreamResponse:
+        await asyncio.sleep(self.latency)
+        self._tweet_requests += 1
+        if self.rate_limit_every and self._tweet_requests % self.rate_limit_every == 0:
+            self.rate_limited += 1
+            return web.json_response({'title': "Too Many Requests", 'status': 429}, status=429,
+                                     headers={'x-rate-limit-reset': f"{time.time() + self.reset_after:.3f}"})
+
+        data = await request.json()
+        tweet_id = str(next(self._ids))
+        self.tweets.append(dict(data, id=tweet_id))
+        return web.json_response({'data': {'id': tweet_id, 'text': data.get('text', '')}}, status=201)
+
+    async def _media_upload(self, request: web.Request) -> web.StreamResponse:
+        await asyncio.sleep(self.latency)
+        await request.read()
+        media_id = next(self._ids)
+        self.media.append(media_id)
+        return web.json_response({'media_id': media_id, 'media_id_string': str(media_id), 'size': 0})
@@ -0,0 +1,86 @@
+"""
+Synthetic Oryx pages: categories of equipment types, one top level <li> per type with loss links,
+multi-number anchors, every Status value and occasional nested <li> variants
+    PYTHONPATH=. python test/oryx_page.py LOSSES [--seed N] > page.html
+"""
+import random
+import sys
+from argparse import ArgumentParser
+from typing import List
+
+from oryxbot.parser import Status
+
+CATEGORIES = ["Tanks", "Armoured Fighting Vehicles", "Infantry Fighting Vehicles", "Armoured Personnel Carriers",
+              "Self-Propelled Artillery", "Multiple Rocket Launchers", "Anti-Aircraft Guns", "Radars",
+              "Aircraft", "Helicopters", "Unmanned Aerial Vehicles", "Naval Ships", "Trucks, Vehicles and Jeeps"]
+MODELS = ["T-62M", "T-64BV", "T-72B", "T-72B3", "T-80BV", "T-90A", "BMP-1", "BMP-2", "BMP-3", "BTR-80", "BTR-82A",
+          "MT-LB", "2S1 Gvozdika", "2S3 Akatsiya", "2S19 Msta-S", "BM-21 Grad", "Tor-M1", "Buk-M1", "Ka-52",
+          "Su-25", "Orlan-10", "Ural-4320", "KamAZ 6x6", "GAZ Tigr"]
+VARIANTS = ["", " obr. 1989", " M", " with ERA", " command vehicle", " (unknown)"]
+STATUSES = [status.value for status in Status]
+
+# items per type and numbers per anchor are drawn from these
+LINKS_PER_ITEM = (1, 40)
+NUMBERS_PER_LINK = (1, 3)
+NESTED_EVERY = 25
+
+HEADER = b"<!DOCTYPE html><html><head><title>Attack On Europe</title></head><body><div class='post-body'>"
+FOOTER = b"</div></body></html>"
+
+
+def _anchor(rng: random.Random, numbers: List[int], link: int) -> str:
+    if len(numbers) == 1:
+        text = str(numbers[0])
+    else:
+        text = ", ".join(map(str, numbers[:-1])) + f" and {numbers[-1]}"
+    return f"<a href='https://i.postimg.cc/{link:08x}/{rng.getrandbits(32):08x}.jpg'>({text}, " \
+           f"{rng.choice(STATUSES)})</a>"
+
+
+def generate_page(losses: int, seed: int = 0) -> bytes:
+    """
+    Page with exactly the given number of losses. Pages with the same seed share their beginning,
+    a larger page looks like a later version of a smaller one
+    :param losses: number of losses
+    :param seed: random seed
+    :return: page content
+    """
+    rng = random.Random(seed)
+    types = [f"{model}{variant}" for model in MODELS for variant in VARIANTS]
+    chunks = [HEADER]
+    produced = 0
+    link = 0
+    item = 0
+    while produced < losses:
+        category = CATEGORIES[item % len(CATEGORIES)]
+        chunks.append(f"<h3>{category}</h3><ul>".encode())
+        for _ in range(rng.randint(5, 30)):
+            if produced >= losses:
+                break
+            anchors = list()
+            for _ in range(rng.randint(*LINKS_PER_ITEM)):
+                count = min(rng.randint(*NUMBERS_PER_LINK), losses - produced)
+                if not count:
+                    break
+                anchors.append(_anchor(rng, list(range(produced + 1, produced + count + 1)), link))
+                produced += count
+                link += 1
+            item_type = types[rng.randrange(len(types))]
+            body = " ".join(anchors)
+            if item % NESTED_EVERY == NESTED_EVERY - 1 and len(anchors) > 1:
+                # variants are sometimes listed as a nested list under the base type
+                body = f"{anchors[0]}<ul><li><img src='flag.png'/> {len(anchors) - 1} {item_type} variant: " \
+                       f"{' '.join(anchors[1:])}</li></ul>"
+            chunks.append(f"<li><img src='flag.png'/> {len(anchors)} {item_type}: {body}</li>".encode())
+            item += 1
+        chunks.append(b"</ul>")
+    chunks.append(FOOTER)
+    return b"".join(chunks)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("losses", help="Number of losses", type=int)
+    parser.add_argument("--seed", help="Random seed", type=int, default=0)
+    args = parser.parse_args()
+    sys.stdout.buffer.write(generate_page(args.losses, args.seed))
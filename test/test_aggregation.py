@@ -0,0 +1,35 @@
+from datetime import date
+
+from oryxbot.aggregation import Rollups, count_losses, merge_counts, nest_counts
+from oryxbot.parser import Loss
+
+LOSSES = [
+    ('russian', Loss(type='T-72B', status='destroyed', number=1, link='http://a')),
+    ('russian', Loss(type='BMP-2', status='captured', number=1, link='http://b')),
+    ('russian', Loss(type='T-72B', status='destroyed', number=2, link='http://c')),
+    ('ukrainian', Loss(type='T-64BV', status='damaged', number=4, link='http://d')),
+]
+
+
+def test_count_losses():
+    assert count_losses(LOSSES) == {('russian', 'T-72B', 'destroyed'): 2,
+                                    ('russian', 'BMP-2', 'captured'): 1,
+                                    ('ukrainian', 'T-64BV', 'damaged'): 1}
+    assert list(nest_counts(count_losses(LOSSES))['russian']) == ['T-72B', 'BMP-2']
+    assert merge_counts([count_losses(LOSSES[:2]), count_losses(LOSSES[2:])]) == count_losses(LOSSES)
+
+
+def test_rollups():
+    rollups = Rollups()
+    assert not rollups.covers(date(2023, 7, 1))
+
+    rollups.add(date(2023, 7, 1), count_losses(LOSSES[:2]))
+    rollups.add(date(2023, 7, 2), dict())
+    rollups.add(date(2023, 7, 3), count_losses(LOSSES[2:]))
+    rollups = Rollups.from_json(rollups.to_json())
+
+    assert not rollups.covers(date(2023, 7, 1))
+    assert rollups.covers(date(2023, 7, 2))
+    assert rollups.since(date(2023, 7, 2)) == count_losses(LOSSES[2:])
+    assert rollups.since(date(2023, 7, 1)) == count_losses(LOSSES)
+    assert list(rollups.to_json()['days']) == ['2023-07-01', '2023-07-03']
@@ -3,7 +3,8 @@ from datetime import date, datetime
 import pytest
 from mock import MagicMock
 
-from oryxbot.archive_util import url_snapshot
+from oryxbot.archive_util import resolve_snapshots, url_history_rows, url_rows, url_snapshot
+from oryxbot.cache_util import SnapshotCache
 
 
 @pytest.mark.asyncio
@@ -48,3 +49,100 @@ async def test_snapshot_without_date_success():
     session.get.side_effect = [second_call]
 
     assert (await url_snapshot(session, 'http://test', None))[0] == b'body'
+
+
+@pytest.mark.asyncio
+async def test_rows_with_date_success():
+    session = MagicMock()
+
+    first_call = MagicMock()
+    first_call.__aenter__.return_value.json.return_value = {
+        'archived_snapshots': {'closest': {'status': '200', 'timestamp': '20230506111213', 'url': 'http://closest'}}
+    }
+
+    async def chunks(_):
+        yield b"<html><body><ul><li><img/>1 T-72B: <a href='http://a'>(1, dest"
+        yield b"royed)</a></li></ul></body></html>"
+
+    second_call = MagicMock()
+    second_call.__aenter__.return_value.content.iter_chunked = chunks
+
+    session.get.side_effect = [first_call, second_call]
+
+    assert await url_rows(session, 'http://test', date(2023, 1, 1)) == (
+        [('T-72B', 'destroyed', 1, 'http://a')], datetime(2023, 5, 6, 11, 12, 13)
+    )
+    assert session.get.call_args.args == ('http://closest',)
+
+
+@pytest.mark.asyncio
+async def test_rows_from_cache(tmp_path):
+    session = MagicMock()
+
+    def lookup():
+        call = MagicMock()
+        call.__aenter__.return_value.json.return_value = {
+            'archived_snapshots': {'closest': {'status': '200', 'timestamp': '20230506111213', 'url': 'http://closest'}}
+        }
+        return call
+
+    async def chunks(_):
+        yield b"<html><body><ul><li><img/>1 T-72B: <a href='http://a'>(1, destroyed)</a></li></ul></body></html>"
+
+    download = MagicMock()
+    download.__aenter__.return_value.content.iter_chunked = chunks
+
+    session.get.side_effect = [lookup(), download, lookup(), lookup()]
+    cache = SnapshotCache(str(tmp_path))
+
+    expected = ([('T-72B', 'destroyed', 1, 'http://a')], datetime(2023, 5, 6, 11, 12, 13))
+    assert await url_rows(session, 'http://test', date(2023, 1, 1), cache) == expected
+    assert await url_rows(session, 'http://test', date(2023, 1, 1), cache) == expected
+    cache.parsed = False
+    assert await url_rows(session, 'http://test', date(2023, 1, 1), cache) == expected
+    assert session.get.call_count == 4
+
+
+def _cdx(rows):
+    call = MagicMock()
+    call.__aenter__.return_value.json.return_value = [['timestamp', 'original']] + rows
+    return call
+
+
+@pytest.mark.asyncio
+async def test_resolve_snapshots():
+    session = MagicMock()
+    fallback = MagicMock()
+    fallback.__aenter__.return_value.json.return_value = {
+        'archived_snapshots': {'closest': {'status': '200', 'timestamp': '20220101000000',
+                                           'url': 'http://web.archive.org/web/20220101000000/http://test'}}
+    }
+    session.get.side_effect = [_cdx([]), _cdx([['20230701090000', 'http://test'], ['20230704230000', 'https://test']]),
+                               fallback]
+
+    assert await resolve_snapshots(session, 'http://test', [date(2023, 7, 1), date(2023, 7, 5), date(2022, 1, 1)]) == {
+        date(2023, 7, 1): ('https://web.archive.org/web/20230701090000id_/http://test', datetime(2023, 7, 1, 9)),
+        date(2023, 7, 5): ('https://web.archive.org/web/20230704230000id_/https://test', datetime(2023, 7, 4, 23)),
+        date(2022, 1, 1): ('https://web.archive.org/web/20220101000000id_/http://test', datetime(2022, 1, 1)),
+    }
+    # far apart dates are queried separately
+    assert [(c.kwargs['params']['from'], c.kwargs['params']['to']) for c in session.get.call_args_list[:2]] == \
+           [('20211225', '20220108'), ('20230624', '20230712')]
+
+
+@pytest.mark.asyncio
+async def test_history_rows_single_download_per_snapshot():
+    session = MagicMock()
+
+    async def chunks(_):
+        yield b"<html><body><ul><li><img/>1 T-72B: <a href='http://a'>(1, destroyed)</a></li></ul></body></html>"
+
+    download = MagicMock()
+    download.__aenter__.return_value.content.iter_chunked = chunks
+    session.get.side_effect = [_cdx([['20230701090000', 'http://test']]), download]
+
+    rows = [('T-72B', 'destroyed', 1, 'http://a')]
+    assert await url_history_rows(session, 'http://test', [date(2023, 7, 1), date(2023, 7, 2)]) == [
+        (rows, datetime(2023, 7, 1, 9)), (rows, datetime(2023, 7, 1, 9))
+    ]
+    assert session.get.call_args.args == ('https://web.archive.org/web/20230701090000id_/http://test',)
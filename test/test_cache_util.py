@@ -0,0 +1,37 @@
+import os
+
+from oryxbot.cache_util import SnapshotCache
+ROW_1 = ('T-72B', 'destroyed', 1, 'http://a')
+ROW_2 = ('BMP-2', 'captured', 1, 'http://c')
+
+
+def test_cache_body_and_rows(tmp_path):
+    cache = SnapshotCache(str(tmp_path))
+    assert cache.get_body('http://web.archive.org/web/2023/test') is None
+    assert cache.get_rows('http://web.archive.org/web/2023/test') is None
+
+    cache.put_body('http://web.archive.org/web/2023/test', b'body')
+    cache.put_rows('http://web.archive.org/web/2023/test', [ROW_1, ROW_2])
+
+    assert cache.get_body('http://web.archive.org/web/2023/test') == b'body'
+    assert cache.get_rows('http://web.archive.org/web/2023/test') == [ROW_1, ROW_2]
+    assert cache.get_body('http://web.archive.org/web/2024/test') is None
+
+
+def test_cache_without_parsed_layer(tmp_path):
+    cache = SnapshotCache(str(tmp_path), parsed=False)
+    cache.put_rows('key', [ROW_1])
+    assert cache.get_rows('key') is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = SnapshotCache(str(tmp_path), max_bytes=25)
+    cache.put_body('first', b'1' * 10)
+    cache.put_body('second', b'2' * 10)
+    os.utime(cache._file('second', 'html'), (0, 0))
+    cache.put_body('third', b'3' * 10)
+
+    assert cache.get_body('first') == b'1' * 10
+    assert cache.get_body('second') is None
+    assert cache.get_body('third') == b'3' * 10
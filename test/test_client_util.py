@@ -0,0 +1,40 @@
+import pytest
+from mock import patch
+
+from oryxbot.client_util import ClientRegistry, API_POOL_SIZE, HTTP_LIMIT
+
+
+@patch('oryxbot.client_util.os.environ', {'CONSUMER_KEY': 'a', 'CONSUMER_SECRET': 'b',
+                                          'ACCESS_TOKEN': 'c', 'ACCESS_TOKEN_SECRET': 'd'})
+def test_clients_created_once():
+    clients = ClientRegistry()
+    api, client = clients.media_api(), clients.tweet_client()
+
+    assert clients.media_api() is api
+    assert clients.tweet_client() is client
+    assert api.session.get_adapter('https://upload.twitter.com')._pool_maxsize == API_POOL_SIZE
+    assert client.session.get_adapter('https://api.twitter.com')._pool_maxsize == API_POOL_SIZE
+
+
+@patch('tweety.bot.Twitter')
+def test_reader_created_once(twitter):
+    clients = ClientRegistry()
+    assert clients.reader() is clients.reader()
+    assert twitter.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_sessions_share_connector():
+    clients = ClientRegistry()
+    async with clients.session() as first, clients.session(raise_for_status=True) as second:
+        assert first.connector is second.connector
+        assert first.connector.limit == HTTP_LIMIT
+        connector = first.connector
+
+    assert not connector.closed
+    await clients.close()
+    assert connector.closed
+
+    async with clients.session() as third:
+        assert third.connector is not connector
+    await clients.close()
@@ -0,0 +1,68 @@
+from datetime import datetime
+
+import pytest
+
+from oryxbot.delta_log import DeltaLog
+from oryxbot.snapshot import PageSnapshot, snapshot_delta
+
+ROW_1 = ('T-72B', 'destroyed', 1, 'http://a')
+ROW_2 = ('T-72B', 'destroyed', 2, 'http://b')
+ROW_3 = ('BMP-2', 'captured', 1, 'http://c')
+
+
+class Store(dict):
+    async def read(self, path: str, raw: bool = False):
+        return super().get(path, b'' if raw else {})
+
+    async def write(self, path: str, data):
+        self[path] = data
+
+
+async def _append_states(log: DeltaLog, states):
+    previous = {}
+    for day, state in enumerate(states, start=1):
+        await log.append(snapshot_delta(previous, state), state, datetime(2023, 7, day))
+        previous = state
+
+
+STATES = [
+    {'russian': PageSnapshot({'a': [ROW_1]})},
+    {'russian': PageSnapshot({'a': [ROW_1], 'b': [ROW_2]})},
+    {'russian': PageSnapshot({'b': [ROW_2], 'c': [ROW_3]}), 'ukrainian': PageSnapshot({'d': [ROW_3]})},
+    {'russian': PageSnapshot({'c': [ROW_3]}), 'ukrainian': PageSnapshot({'d': [ROW_3]})},
+]
+
+
+@pytest.mark.asyncio
+async def test_empty_log():
+    log = DeltaLog(Store().read, Store().write, 'log/')
+    assert not await log.exists()
+    assert await log.next_seq() == 1
+    assert await log.state_at() == {}
+
+
+@pytest.mark.asyncio
+async def test_append_and_rebuild():
+    store = Store()
+    await _append_states(DeltaLog(store.read, store.write, 'log/', checkpoint_every=2), STATES)
+
+    assert sorted(store) == ['log/0000000001.checkpoint', 'log/0000000001.delta', 'log/0000000002.delta',
+                             'log/0000000003.checkpoint', 'log/0000000003.delta', 'log/0000000004.delta',
+                             'log/head.json']
+
+    log = DeltaLog(store.read, store.write, 'log/')
+    assert await log.exists()
+    assert await log.next_seq() == 5
+    assert await log.state_at() == STATES[-1]
+    for day, state in enumerate(STATES, start=1):
+        assert await log.state_at(datetime(2023, 7, day, 12)) == state
+    assert await log.state_at(datetime(2023, 6, 30)) == {}
+
+
+@pytest.mark.asyncio
+async def test_rebuild_from_checkpoint_and_tail():
+    store = Store()
+    await _append_states(DeltaLog(store.read, store.write, 'log/', checkpoint_every=2), STATES)
+    del store['log/0000000001.delta'], store['log/0000000002.delta'], store['log/0000000003.delta']
+
+    assert await DeltaLog(store.read, store.write, 'log/').state_at() == STATES[-1]
@@ -0,0 +1,62 @@
+from contextlib import AsyncExitStack
+
+import pytest
+from mock import patch
+from PIL import ImageFont
+
+from oryxbot import executor_util, image_resolver, main, twitter_util
+from oryxbot.client_util import ClientRegistry
+from oryxbot.txt2image import TextRenderer
+
+import e2e
+from fake_services import FakeServices, RedirectAdapter
+
+
+@pytest.mark.asyncio
+async def test_run_against_fake_services():
+    registry = ClientRegistry()
+    renderer = TextRenderer(ImageFont.load_default(), (240, 230, 10), (50, 50, 50))
+    async with AsyncExitStack() as stack:
+        for module in (main, twitter_util, image_resolver, e2e):
+            stack.enter_context(patch.object(module, 'CLIENTS', registry))
+        stack.enter_context(patch.object(twitter_util, 'text_renderer', return_value=renderer))
+        stack.enter_context(patch.object(twitter_util, 'TWEETS_PER_WINDOW', 10000))
+        stack.enter_context(patch.object(twitter_util, 'RETRY_BACKOFF', 0.01))
+        services = await stack.enter_async_context(FakeServices(rate_limit_every=5, reset_after=0.05))
+
+        e2e.seed(services, 400, 40)
+        try:
+            with e2e.pointed_at(services):
+                result = await e2e.run(services)
+        finally:
+            await registry.close()
+            executor_util.shutdown()
+
+    assert result['losses'] >= 80
+    assert result['rate_limited'] > 0
+    assert result['metrics']['counters']['tweet_retries'] == result['rate_limited']
+    assert result['media'] > 0
+    # a thread per country, replies follow the root tweet
+    roots = [tweet for tweet in services.tweets if 'losses:' in tweet['text'] and 'reply' not in tweet]
+    assert {tweet['text'].split()[0] for tweet in roots} >= {'ukrainian', 'russian'}
+    assert any('reply' in tweet for tweet in services.tweets)
+    # summaries were compared against Wayback captures
+    assert services.requests.get('/cdx/search/cdx')
+    assert any(tweet['text'].startswith("Losses for") for tweet in services.tweets)
+    assert result['unchanged_skipped'] == 2
+    assert (e2e.BUCKET, main.S3_PATH_LOG + 'head.json') in services.objects
+    # everything was confirmed, the outbox is empty again
+    assert services.objects[(e2e.BUCKET, 'oryx/outbox/items.json')] == b'[]'
+
+
+@pytest.mark.asyncio
+async def test_pointed_at_restores_clients():
+    registry = ClientRegistry()
+    with patch.object(e2e, 'CLIENTS', registry), patch.dict('os.environ', e2e.CREDENTIALS):
+        async with FakeServices() as services:
+            with e2e.pointed_at(services):
+                assert isinstance(registry.tweet_client().session.get_adapter('https://api.twitter.com/2/tweets'),
+                                  RedirectAdapter)
+        for session in (registry.tweet_client().session, registry.media_api().session):
+            assert not any(isinstance(adapter, RedirectAdapter) for adapter in session.adapters.values())
+    await registry.close()
@@ -0,0 +1,45 @@
+import os.path
+from functools import partial
+
+import pytest
+from mock import patch
+
+from oryxbot import executor_util
+from oryxbot.executor_util import parse_body, parse_chunks, run_cpu
+from oryxbot.parser import ItemFeed, LossFeed, parse_losses
+
+PATH = os.path.join(os.path.dirname(__file__), 'last.html')
+
+
+async def _chunks(body: bytes, size: int = 64 * 1024):
+    for idx in range(0, len(body), size):
+        yield body[idx:idx + size]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('mode', ['none', 'thread', 'process'])
+async def test_parse_chunks(mode):
+    body = open(PATH, 'rb').read()
+    received = list()
+    with patch('oryxbot.executor_util.PARSE_EXECUTOR', mode), patch('oryxbot.executor_util._executor', None):
+        try:
+            assert await parse_chunks(LossFeed, _chunks(body), received.append) == list(parse_losses(body))
+            items = await parse_chunks(partial(ItemFeed, {'unknown'}), _chunks(body))
+            assert (executor_util.parse_executor() is None) == (mode == 'none')
+        finally:
+            executor_util.shutdown()
+
+    assert b''.join(received) == body
+    assert items == parse_body(partial(ItemFeed, {'unknown'}), body)
+
+
+@pytest.mark.asyncio
+async def test_run_cpu():
+    with patch('oryxbot.executor_util._executor', None):
+        try:
+            with patch('oryxbot.executor_util.count') as count:
+                assert await run_cpu(sum, [1, 2, 3]) == 6
+            name, seconds = count.call_args.args
+            assert name == 'cpu_seconds' and 0 <= seconds < 1
+        finally:
+            executor_util.shutdown()
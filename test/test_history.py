@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+import pytest
+from mock import patch
+
+from oryxbot.history import HistoryStore, backfill, encode_page
+from oryxbot.parser import Loss
+from oryxbot.snapshot import decode_snapshots
+
+URLS = {'http://ua': 'ukrainian', 'http://ru': 'russian'}
+
+PAGE_1 = b"<html><body><ul><li><img/>1 T-72B: <a href='http://a'>(1, destroyed)</a></li></ul></body></html>"
+PAGE_2 = b"<html><body><ul><li><img/>1 T-72B: <a href='http://a'>(1, destroyed)</a></li>" \
+         b"<li><img/>1 BMP-2: <a href='http://b'>(1, captured)</a></li></ul></body></html>"
+PAGES = {'http://ua/1': PAGE_1, 'http://ua/2': PAGE_2, 'http://ru/1': PAGE_1}
+
+
+async def _resolve_snapshots(session, url, dates):
+    # ukrainian page was captured twice, russian once for all days
+    if url == 'http://ru':
+        return {dt: ('http://ru/1', datetime(2023, 7, 1)) for dt in dates}
+    return {dt: (f'http://ua/{1 if dt.day < 3 else 2}', datetime(2023, 7, 1 if dt.day < 3 else 3)) for dt in dates}
+
+
+async def _snapshot_body(session, snapshot_url, cache):
+    return PAGES[snapshot_url]
+
+
+def test_encode_page():
+    pages = decode_snapshots(encode_page('russian', PAGE_2))
+    assert [Loss(*row) for row in pages['russian'].rows()] == [
+        Loss(type='T-72B', status='destroyed', number=1, link='http://a'),
+        Loss(type='BMP-2', status='captured', number=1, link='http://b'),
+    ]
+    assert len(pages['russian'].items) == 2
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.history.snapshot_cache', return_value=None)
+@patch('oryxbot.history.snapshot_body', side_effect=_snapshot_body)
+@patch('oryxbot.history.resolve_snapshots', side_effect=_resolve_snapshots)
+async def test_backfill(resolve_snapshots, snapshot_body, cache, tmp_path):
+    store = HistoryStore(str(tmp_path))
+    with ThreadPoolExecutor() as executor:
+        await backfill(URLS, date(2023, 7, 1), date(2023, 7, 4), store, executor=executor)
+
+    assert sorted(call.args[1] for call in snapshot_body.call_args_list) == ['http://ru/1', 'http://ua/1',
+                                                                             'http://ua/2']
+    assert store.days() == [date(2023, 7, day) for day in range(1, 5)]
+
+    store = HistoryStore(str(tmp_path))
+    assert list(store.diff(date(2023, 7, 1), date(2023, 7, 4)).losses()) == [
+        ('ukrainian', Loss(type='BMP-2', status='captured', number=1, link='http://b'))
+    ]
+    assert not store.diff(date(2023, 7, 3), date(2023, 7, 4))
+
+    with ThreadPoolExecutor() as executor:
+        await backfill(URLS, date(2023, 7, 2), date(2023, 7, 5), store, executor=executor)
+    assert resolve_snapshots.call_args.args[2] == [date(2023, 7, 5)]
+    assert snapshot_body.call_count == 3
+    assert store.days()[-1] == date(2023, 7, 5)
+
+
+def test_stored_day(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    with pytest.raises(ValueError, match="nothing is stored"):
+        store.stored_day(date(2023, 7, 2))
+
+    store.put_days({date(2023, 7, 1): {}, date(2023, 7, 3): {}})
+    assert store.stored_day(date(2023, 7, 2)) == date(2023, 7, 1)
+    assert store.stored_day(date(2023, 7, 3)) == date(2023, 7, 3)
+    assert store.stored_day(date(2023, 8, 1)) == date(2023, 7, 3)
+    with pytest.raises(ValueError, match="before 2023-06-30, stored days are 2023-07-01 to 2023-07-03"):
+        store.get(date(2023, 6, 30))
@@ -1,16 +1,28 @@
+import asyncio
 from io import BytesIO
 
 import pytest
 from PIL import Image
 from mock import patch, AsyncMock, MagicMock
 
-from oryxbot.image_resolver import resolve
+from oryxbot.client_util import ClientRegistry
+from oryxbot.image_resolver import MediaCache, UPLOAD_MAX_DIMENSION, resolve, _draft_size, _prepare_image
+
+
+def _body(call: MagicMock, body: bytes, content_type: str = 'application/octet-stream', chunk: int = 16):
+    async def chunks(_):
+        for idx in range(0, len(body), chunk):
+            yield body[idx:idx + chunk]
+
+    call.__aenter__.return_value.content_length = None
+    call.__aenter__.return_value.content_type = content_type
+    call.__aenter__.return_value.content.iter_chunked = chunks
 
 
 @pytest.mark.asyncio
-@patch('oryxbot.image_resolver.os.environ')
-@patch('oryxbot.image_resolver.Twitter')
-async def test_resolve_twitter_link(twitter, env):
+@patch('oryxbot.image_resolver.CLIENTS', new_callable=ClientRegistry)
+@patch('tweety.bot.Twitter')
+async def test_resolve_twitter_link(twitter, clients):
     session = MagicMock()
     first_call = MagicMock()
 
@@ -23,10 +35,11 @@ async def test_resolve_twitter_link(twitter, env):
 
 
 @pytest.mark.asyncio
-@patch('oryxbot.image_resolver.os.environ')
-@patch('oryxbot.image_resolver.OAuthHandler')
-@patch('oryxbot.image_resolver.API')
-async def test_resolve_image_direct_link(api, oauth, env):
+@patch('oryxbot.image_resolver.CLIENTS', new_callable=ClientRegistry)
+@patch('oryxbot.client_util.os.environ')
+@patch('tweepy.OAuthHandler')
+@patch('tweepy.API')
+async def test_resolve_image_direct_link(api, oauth, env, clients):
     session = MagicMock()
     first_call = MagicMock()
     second_call = MagicMock()
@@ -39,7 +52,7 @@ async def test_resolve_image_direct_link(api, oauth, env):
     api.return_value.media_upload.return_value.media_id_string = 'key_2'
 
     first_call.__aenter__.return_value.real_url = MagicMock(host='hosting.com')
-    first_call.__aenter__.return_value.read = AsyncMock(return_value=buffer.read())
+    _body(first_call, buffer.read(), 'image/png')
     second_call.__aenter__.return_value.json.return_value = {'includes': {'media': [{'media_key': 'key_1'}]}}
 
     session.get.side_effect = [first_call, second_call]
@@ -47,10 +60,11 @@ async def test_resolve_image_direct_link(api, oauth, env):
 
 
 @pytest.mark.asyncio
-@patch('oryxbot.image_resolver.os.environ')
-@patch('oryxbot.image_resolver.OAuthHandler')
-@patch('oryxbot.image_resolver.API')
-async def test_resolve_image_hosting(api, oauth, env):
+@patch('oryxbot.image_resolver.CLIENTS', new_callable=ClientRegistry)
+@patch('oryxbot.client_util.os.environ')
+@patch('tweepy.OAuthHandler')
+@patch('tweepy.API')
+async def test_resolve_image_hosting(api, oauth, env, clients):
     session = MagicMock()
     first_call = MagicMock()
     second_call = MagicMock()
@@ -63,8 +77,8 @@ async def test_resolve_image_hosting(api, oauth, env):
     buffer.seek(0)
 
     first_call.__aenter__.return_value.real_url = MagicMock(host='hosting.com')
-    first_call.__aenter__.return_value.read = AsyncMock(return_value=html)
-    second_call.__aenter__.return_value.read = AsyncMock(return_value=buffer.read())
+    _body(first_call, html)
+    _body(second_call, buffer.read())
     api.return_value.media_upload.return_value.media_id_string = 'key_3'
 
     session.get.side_effect = [first_call, second_call]
@@ -72,8 +86,8 @@ async def test_resolve_image_hosting(api, oauth, env):
 
 
 @pytest.mark.asyncio
-@patch('oryxbot.image_resolver.os.environ')
-async def test_resolve_error(env):
+@patch('oryxbot.image_resolver.CLIENTS', new_callable=ClientRegistry)
+async def test_resolve_error(clients):
     session = MagicMock()
     first_call = MagicMock()
     second_call = MagicMock()
@@ -84,3 +98,96 @@ async def test_resolve_error(env):
 
     session.get.side_effect = [first_call, second_call]
     assert await resolve(session, 'https://twitter.com/UAWeapons/status/1667622822594617344') == []
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.image_resolver.resolve')
+async def test_media_cache_collapses_requests(resolve):
+    release = asyncio.Event()
+
+    async def _resolve(session, url):
+        await release.wait()
+        return ['key_1']
+
+    resolve.side_effect = _resolve
+    cache = MediaCache()
+
+    waiters = asyncio.gather(*[cache.resolve(MagicMock(), 'http://link') for _ in range(3)])
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await waiters == [['key_1']] * 3
+    assert await cache.resolve(MagicMock(), 'http://link') == ['key_1']
+    assert resolve.call_count == 1
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.image_resolver.resolve', new_callable=AsyncMock)
+async def test_media_cache_expiry(resolve):
+    resolve.side_effect = [[], ['key_1'], ['key_2'], ['key_3'], ['key_4']]
+    cache = MediaCache(ttl=0)
+
+    assert await cache.resolve(MagicMock(), 'http://link') == []
+    assert await cache.resolve(MagicMock(), 'http://link') == ['key_1']
+    assert await cache.resolve(MagicMock(), 'http://link') == ['key_2']
+
+    cache.ttl = 100
+    assert await cache.resolve(MagicMock(), 'http://link') == ['key_3']
+    assert await cache.resolve(MagicMock(), 'http://link') == ['key_3']
+    cache.invalidate('http://link')
+    assert await cache.resolve(MagicMock(), 'http://link') == ['key_4']
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.image_resolver.MAX_DOWNLOAD_BYTES', 32)
+@patch('tweepy.API')
+async def test_resolve_too_large(api):
+    session = MagicMock()
+    first_call = MagicMock()
+    first_call.__aenter__.return_value.real_url = MagicMock(host='hosting.com')
+    _body(first_call, b'0' * 64)
+
+    second_call = MagicMock()
+    second_call.__aenter__.return_value.real_url = MagicMock(host='hosting.com')
+    second_call.__aenter__.return_value.content_length = 64
+
+    session.get.side_effect = [first_call, second_call]
+    with patch('oryxbot.image_resolver.count') as count:
+        assert await resolve(session, 'http://hosting.com/1') == []
+        assert await resolve(session, 'http://hosting.com/2') == []
+    assert not api.called
+    # the download stopped after the chunk crossing the limit, the second one was never read
+    assert [c.args for c in count.call_args_list if c.args[0] == 'image_bytes'] == [('image_bytes', 48)]
+
+
+def test_prepare_image_untouched():
+    buffer = BytesIO()
+    Image.new('RGB', (10, 10)).save(buffer, format='png')
+    assert _prepare_image(buffer.getvalue()) == (buffer.getvalue(), 'png')
+
+
+def test_prepare_image_downscaled():
+    buffer = BytesIO()
+    Image.new('RGB', (UPLOAD_MAX_DIMENSION * 2, 100)).save(buffer, format='jpeg')
+
+    body, extension = _prepare_image(buffer.getvalue())
+
+    assert extension == 'jpg'
+    assert Image.open(BytesIO(body)).size[0] <= UPLOAD_MAX_DIMENSION
+
+    buffer = BytesIO()
+    Image.new('RGB', (10, 10)).save(buffer, format='bmp')
+    body, extension = _prepare_image(buffer.getvalue())
+    assert extension == 'jpg'
+    assert Image.open(BytesIO(body)).format == 'JPEG'
+
+
+def test_prepare_image_draft():
+    assert _draft_size((6000, 4000), 4096) == (2048, 1365)
+    assert _draft_size((3000, 2000), 4096) == (3000, 2000)
+
+    buffer = BytesIO()
+    Image.new('RGB', (6000, 4000)).save(buffer, format='jpeg')
+    body, extension = _prepare_image(buffer.getvalue())
+    # decoded at half the scale instead of full size and downscaled
+    assert Image.open(BytesIO(body)).size == (3000, 2000)
@@ -0,0 +1,41 @@
+from oryxbot.loss_table import LossTable
+from oryxbot.parser import Loss
+
+LOSS_1 = Loss(type='T-72B', status='destroyed', number=1, link='http://a')
+LOSS_2 = Loss(type='T-72B', status='destroyed', number=2, link='http://b')
+LOSS_3 = Loss(type='T-72B', status='captured', number=3, link='http://b')
+LOSS_4 = Loss(type='BMP-2', status='captured', number=1, link='http://c')
+
+
+def test_roundtrip():
+    losses = [('russian', LOSS_1), ('russian', LOSS_2), ('ukrainian', LOSS_4)]
+    table = LossTable.from_losses(losses)
+
+    assert len(table) == 3
+    assert list(table.losses()) == losses
+    # rows are grouped by country
+    assert list(LossTable.from_losses([losses[0], losses[2], losses[1]]).losses()) == losses
+
+
+def test_difference():
+    new = LossTable()
+    new.append_rows('russian', [('T-72B', 'destroyed', 1, 'http://a'), ('T-72B', 'destroyed', 2, 'http://b'),
+                                ('T-72B', 'captured', 3, 'http://b')])
+    new.append_rows('ukrainian', [('BMP-2', 'captured', 1, 'http://c')])
+    old = LossTable.from_losses([('russian', LOSS_2), ('ukrainian', LOSS_1)])
+
+    assert list(new.difference(old).losses()) == [('russian', LOSS_1), ('russian', LOSS_3), ('ukrainian', LOSS_4)]
+    assert len(old.difference(new)) == 1
+    assert not new.difference(new)
+
+
+def test_counts():
+    table = LossTable.from_losses([('russian', LOSS_1), ('russian', LOSS_4), ('russian', LOSS_3),
+                                   ('russian', LOSS_2), ('ukrainian', LOSS_4)])
+
+    assert list(table.counts().items()) == [
+        (('russian', 'T-72B', 'destroyed'), 2),
+        (('russian', 'BMP-2', 'captured'), 1),
+        (('russian', 'T-72B', 'captured'), 1),
+        (('ukrainian', 'BMP-2', 'captured'), 1),
+    ]
@@ -0,0 +1,126 @@
+from datetime import date, datetime
+
+import pytest
+from mock import patch
+
+from oryxbot.aggregation import Rollups, count_losses
+from oryxbot.delta_log import DeltaLog
+from oryxbot.main import BotState, RunReport, URLS, check_sources, compare_against_dates, summarize
+from oryxbot.parser import Loss
+from oryxbot.snapshot import PageSnapshot, loss_row
+from oryxbot.source_util import SourcePage, SourceState
+
+UA, RU = URLS.keys()
+
+LOSS_1 = Loss(type='T-72B', status='destroyed', number=1, link='http://a')
+LOSS_2 = Loss(type='T-72B', status='destroyed', number=2, link='http://b')
+LOSS_3 = Loss(type='BMP-2', status='captured', number=1, link='http://c')
+
+HISTORY = {
+    (UA, date(2023, 7, 1)): [LOSS_1],
+    (RU, date(2023, 7, 1)): [],
+    (UA, date(2023, 7, 5)): [LOSS_1, LOSS_2],
+    (RU, date(2023, 7, 5)): [LOSS_3],
+}
+CURRENT = {UA: [LOSS_1, LOSS_2], RU: [LOSS_3]}
+
+
+async def _url_rows(session, url, dt):
+    return list(map(loss_row, CURRENT[url])), datetime(2023, 7, 10)
+
+
+async def _url_history_rows(session, url, dates):
+    return [(list(map(loss_row, HISTORY[(url, dt)])), datetime.combine(dt, datetime.min.time())) for dt in dates]
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.main.url_history_rows', side_effect=_url_history_rows)
+@patch('oryxbot.main.url_rows', side_effect=_url_rows)
+async def test_compare_against_dates(url_rows, url_history_rows):
+    assert [(list(table.losses()), dt) for table, dt in
+            await compare_against_dates([date(2023, 7, 1), date(2023, 7, 5)])] == [
+        ([('ukrainian', LOSS_2), ('russian', LOSS_3)], datetime(2023, 7, 1)),
+        ([], datetime(2023, 7, 5)),
+    ]
+    assert url_rows.call_count == 2
+    assert url_history_rows.call_count == 2
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.main.url_history_rows', side_effect=_url_history_rows)
+@patch('oryxbot.main.url_rows', side_effect=_url_rows)
+async def test_compare_against_dates_shared_pages(url_rows, url_history_rows):
+    report = RunReport(snapshots={'ukrainian': PageSnapshot({'a': [loss_row(LOSS_1)], 'b': [loss_row(LOSS_2)]}),
+                                  'russian': PageSnapshot({'c': [loss_row(LOSS_3)]})},
+                       fetched_at=datetime(2023, 7, 10))
+
+    assert [(list(table.losses()), dt) for table, dt in
+            await compare_against_dates([date(2023, 7, 1), date(2023, 7, 5)], report)] == [
+        ([('ukrainian', LOSS_2), ('russian', LOSS_3)], datetime(2023, 7, 1)),
+        ([], datetime(2023, 7, 5)),
+    ]
+    assert not url_rows.called
+    assert [call.args[2] for call in url_history_rows.call_args_list] == [[date(2023, 7, 1), date(2023, 7, 5)]] * 2
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.main.url_history_rows', side_effect=_url_history_rows)
+@patch('oryxbot.main.url_rows', side_effect=_url_rows)
+async def test_summarize_from_rollups(url_rows, url_history_rows):
+    rollups = Rollups()
+    rollups.add(date(2023, 7, 3), count_losses([('russian', LOSS_3)]))
+    rollups.add(date(2023, 7, 6), count_losses([('ukrainian', LOSS_2)]))
+
+    assert await summarize([date(2023, 7, 1), date(2023, 7, 5)], rollups=rollups) == [
+        ({('ukrainian', 'T-72B', 'destroyed'): 1, ('russian', 'BMP-2', 'captured'): 1}, datetime(2023, 7, 1)),
+        ({('ukrainian', 'T-72B', 'destroyed'): 1}, datetime(2023, 7, 5)),
+    ]
+    assert [call.args[2] for call in url_history_rows.call_args_list] == [[date(2023, 7, 1)]] * 2
+
+
+class Store(dict):
+    async def read(self, path: str, raw: bool = False):
+        self.reads.append(path)
+        return super().get(path, b'' if raw else {})
+
+    async def write(self, path: str, data):
+        self[path] = data
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.main.publish_outbox')
+@patch('oryxbot.main.fetch_source')
+async def test_check_sources_resident_state(fetch_source, publish_outbox):
+    pages = iter([
+        {UA: [('a', [LOSS_1])], RU: [('c', [LOSS_3])]},
+        {UA: [('a', None), ('b', [LOSS_2])], RU: None},
+    ])
+
+    async def _fetch_source(session, url, state, known):
+        items = current[url]
+        return SourcePage(url=url, state=SourceState(digest=str(items)), items=items)
+
+    fetch_source.side_effect = _fetch_source
+    store = Store()
+    store.reads = []
+    state = BotState(DeltaLog(store.read, store.write, 'log/'))
+
+    current = next(pages)
+    report = await check_sources(store.read, store.write, state)
+    assert report.losses == [('ukrainian', LOSS_1), ('russian', LOSS_3)]
+    reads = len(store.reads)
+
+    current = next(pages)
+    report = await check_sources(store.read, store.write, state)
+    assert report.losses == [('ukrainian', LOSS_2)]
+    assert report.skipped == ['russian']
+    assert len(store.reads) == reads
+    assert fetch_source.call_args_list[-2].args[3] == {'a'}
+    assert store['log/head.json']['seq'] == 2
+    assert publish_outbox.call_count == 2
+    # nothing was posted, the publications of both runs are pending
+    assert [item.text for item in state.outbox.pending()] == [
+        f"ukrainian {LOSS_1.type} {LOSS_1.status}: {LOSS_1.link}",
+        f"russian {LOSS_3.type} {LOSS_3.status}: {LOSS_3.link}",
+        f"ukrainian {LOSS_2.type} {LOSS_2.status}: {LOSS_2.link}"]
+    assert len(store['oryx/outbox/items.json']) == 3
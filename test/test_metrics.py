@@ -0,0 +1,57 @@
+import json
+
+from oryxbot.metrics import Metrics
+
+
+def test_spans_and_counters():
+    metrics = Metrics()
+    with metrics.span('fetch'):
+        pass
+    with metrics.span('fetch'):
+        pass
+    metrics.count('bytes', 10)
+    metrics.count('bytes', 5)
+    metrics.count('tweets')
+
+    report = metrics.report()
+    assert report['spans']['fetch']['count'] == 2
+    assert report['spans']['fetch']['total'] >= report['spans']['fetch']['max'] >= 0
+    assert report['counters'] == {'bytes': 15, 'tweets': 1}
+
+
+def test_span_recorded_on_error():
+    metrics = Metrics()
+    try:
+        with metrics.span('s3_get'):
+            raise ValueError()
+    except ValueError:
+        pass
+    assert len(metrics.spans['s3_get']) == 1
+
+
+def test_write_json_lines(tmp_path):
+    path = str(tmp_path / "metrics.jsonl")
+    metrics = Metrics()
+    metrics.count('losses_new', 3)
+    metrics.write(path)
+    metrics.count('losses_new', 1)
+    metrics.write(path)
+
+    with open(path) as f:
+        reports = [json.loads(line) for line in f]
+    assert [r['counters'] for r in reports] == [{'losses_new': 3}, {'losses_new': 1}]
+
+
+def test_write_prometheus(tmp_path):
+    path = tmp_path / "oryxbot.prom"
+    metrics = Metrics()
+    with metrics.span('fetch'):
+        pass
+    metrics.count('wayback_bytes', 100)
+    metrics.write(str(path))
+
+    text = path.read_text()
+    assert 'oryxbot_span_count{span="fetch"} 1' in text
+    assert 'oryxbot_wayback_bytes 100' in text
+    assert not metrics.spans and not metrics.counters
+    assert not (tmp_path / "oryxbot.prom.tmp").exists()
@@ -0,0 +1,87 @@
+from dataclasses import astuple
+
+import pytest
+
+from oryxbot.outbox import Outbox, plan
+
+ENTRIES = [('ru', 'ru losses: 2', [], False),
+           ('ru', 'tank:\ndestroyed: http://t/0', ['http://t/0'], True),
+           ('ua', 'ua ifv captured: http://i', ['http://i'], False),
+           ('ru', 'tank:\ndestroyed: http://t/1', ['http://t/1'], True)]
+
+
+class Store(dict):
+    async def get(self, path: str, raw: bool = False):
+        return super().get(path, {})
+
+    async def put(self, path: str, data):
+        self[path] = data
+
+
+def test_plan_keys():
+    first, second = plan(ENTRIES, '1'), plan(ENTRIES, '1')
+    assert [item.key for item in first] == [item.key for item in second]
+    assert len({item.key for item in plan([ENTRIES[2]] * 3, '1')}) == 3
+    # the same losses found by another run are new publications
+    assert not {item.key for item in first} & {item.key for item in plan(ENTRIES, '2')}
+
+
+@pytest.mark.asyncio
+async def test_add_skips_known():
+    store = Store()
+    outbox = Outbox(store.get, store.put)
+    await outbox.add(plan(ENTRIES[:2], '1'))
+    await outbox.add(plan(ENTRIES, '1'))
+
+    assert [item.text for item in outbox.pending()] == [text for _, text, _, _ in ENTRIES]
+    assert len(store['oryx/outbox/items.json']) == 4
+
+
+@pytest.mark.asyncio
+async def test_resume():
+    store = Store()
+    outbox = Outbox(store.get, store.put)
+    items = plan(ENTRIES, '1')
+    await outbox.add(items)
+    await outbox.confirm(items[0], '100')
+    await outbox.confirm(items[1], '101')
+    assert store['oryx/outbox/progress.json']['posted'] == {items[0].key: '100', items[1].key: '101'}
+
+    resumed = await Outbox(store.get, store.put).load()
+    assert resumed.pending() == items[2:]
+    assert resumed.parent(items[3]) == '101'
+    assert resumed.parent(items[1]) == '100'
+    assert resumed.parent(items[2]) is None
+
+
+@pytest.mark.asyncio
+async def test_confirm_last_empties():
+    store = Store()
+    outbox = Outbox(store.get, store.put)
+    items = plan(ENTRIES[2:3], '1')
+    await outbox.add(items)
+    await outbox.confirm(items[0], '100')
+
+    assert store['oryx/outbox/items.json'] == [] and store['oryx/outbox/progress.json'] == {}
+    assert not outbox.items and not outbox.posted
+    assert not (await Outbox(store.get, store.put).load()).pending()
+
+
+@pytest.mark.asyncio
+async def test_fail_moves_aside():
+    store = Store()
+    outbox = Outbox(store.get, store.put, max_attempts=2)
+    items = plan(ENTRIES, '1')
+    await outbox.add(items)
+    await outbox.confirm(items[0], '100')
+
+    assert not await outbox.fail(items[1], Exception("fail"))
+    resumed = await Outbox(store.get, store.put, max_attempts=2).load()
+    assert resumed.attempts == {items[1].key: 1}
+    assert resumed.pending() == items[1:]
+
+    assert await resumed.fail(items[1], Exception("fail"))
+    assert store['oryx/outbox/failed.json'] == [[astuple(items[1]), 'fail']]
+    assert resumed.pending() == items[2:]
+    # the thread carries on from the last posted tweet
+    assert resumed.parent(items[3]) == '100'
@@ -1,6 +1,9 @@
+import hashlib
 import os.path
 
-from oryxbot.parser import parse_losses, Loss
+import pytest
+
+from oryxbot.parser import parse_losses, parse_losses_stream, ItemFeed, Loss, LossFeed, RowFeed
 
 
 def test_parser():
@@ -17,3 +20,72 @@ def test_parser():
 
     assert diffed == [Loss(type='T-64BV', status='damaged', number=4,
                            link='https://i.postimg.cc/L52GF2Ln/1001-unkn-tank-dam-23-02-23.jpg')]
+
+
+def test_parser_stream_unchanged():
+    # digest of the stream produced by the original per-link implementation, see bench/bench_parser.py
+    path = os.path.join(os.path.dirname(__file__), 'last.html')
+    losses = list(parse_losses(open(path, 'rb').read()))
+    assert len(losses) == 10566
+    assert hashlib.sha256('\n'.join(map(repr, losses)).encode()).hexdigest() == \
+           '582944236905ea2b84898f258b42c62e368a8c9218f3d3b4a522cd43274e4798'
+
+
+def test_parser_links_per_item():
+    body = b"<html><body><ul>" \
+           b"<li><img/>3 T-72B: <a href='http://a'>(1 and 2, destroyed)</a> <a href='x http://b'>(3, captured)</a></li>" \
+           b"<li><img/>1 BMP-2: <a href='http://c'>(1, damaged and captured)</a> <a href='http://d'>(2, lost)</a></li>" \
+           b"<li><img/>no losses <a href='http://e'>(1, destroyed)</a></li>" \
+           b"</ul><a href='http://f'>(1, destroyed)</a></body></html>"
+    assert list(parse_losses(body)) == [
+        Loss(type='T-72B', status='destroyed', number=1, link='http://a'),
+        Loss(type='T-72B', status='destroyed', number=2, link='http://a'),
+        Loss(type='T-72B', status='captured', number=3, link='http://b'),
+        Loss(type='BMP-2', status='captured', number=1, link='http://c'),
+    ]
+
+
+def test_feed_yields_closed_items():
+    feed = LossFeed()
+    assert feed.feed(b"<html><body><ul><li><img/>1 T-72B: <a href='http://a'>(1, destroyed)</a></li>") == []
+    assert feed.feed(b"<li><img/>2 BMP-2: <a href='http://b'>(1 and 2, damaged)</a>") == [
+        Loss(type='T-72B', status='destroyed', number=1, link='http://a')
+    ]
+    assert feed.close() == [
+        Loss(type='BMP-2', status='damaged', number=1, link='http://b'),
+        Loss(type='BMP-2', status='damaged', number=2, link='http://b'),
+    ]
+
+
+def test_row_feed():
+    path = os.path.join(os.path.dirname(__file__), 'last.html')
+    body = open(path, 'rb').read()
+    feed = RowFeed()
+    rows = feed.feed(body) + feed.close()
+
+    assert rows == [(loss.type, loss.status, loss.number, loss.link) for loss in parse_losses(body)]
+
+
+@pytest.mark.asyncio
+async def test_parser_stream_chunked():
+    path = os.path.join(os.path.dirname(__file__), 'last.html')
+    body = open(path, 'rb').read()
+
+    async def chunks():
+        for idx in range(0, len(body), 1000):
+            yield body[idx:idx + 1000]
+
+    assert [loss async for loss in parse_losses_stream(chunks())] == list(parse_losses(body))
+
+
+def test_item_feed_skips_known_items():
+    path = os.path.join(os.path.dirname(__file__), 'last.html')
+    body = open(path, 'rb').read()
+
+    feed = ItemFeed()
+    items = feed.feed(body) + feed.close()
+    assert [loss for _, losses in items for loss in losses] == list(parse_losses(body))
+
+    known = {fingerprint for fingerprint, _ in items[1:]}
+    feed = ItemFeed(known)
+    assert feed.feed(body) + feed.close() == [items[0]] + [(fingerprint, None) for fingerprint, _ in items[1:]]
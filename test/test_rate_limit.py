@@ -0,0 +1,53 @@
+import time
+
+import pytest
+from mock import patch, AsyncMock
+
+from oryxbot.rate_limit import TokenBucket
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.rate_limit.asyncio.sleep', new_callable=AsyncMock)
+async def test_bucket_burst_then_waits(sleep):
+    bucket = TokenBucket(2, 10)
+    await bucket.acquire()
+    await bucket.acquire()
+    assert not sleep.called
+
+    with patch('oryxbot.rate_limit.time.monotonic', side_effect=[bucket._updated, bucket._updated + 5]):
+        await bucket.acquire()
+    assert sleep.call_args.args[0] == pytest.approx(5, abs=0.01)
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.rate_limit.asyncio.sleep', new_callable=AsyncMock)
+async def test_bucket_pause_until_reset(sleep):
+    bucket = TokenBucket(100, 1)
+    bucket.pause_until(time.time() + 30)
+    bucket._tokens = 1
+
+    with patch('oryxbot.rate_limit.time.time', side_effect=[bucket._resume_at - 30, bucket._resume_at]):
+        await bucket.acquire()
+    assert sleep.call_args.args[0] == pytest.approx(30)
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.rate_limit.asyncio.sleep', new_callable=AsyncMock)
+async def test_bucket_full_after_reset(sleep):
+    bucket = TokenBucket(10, 100)
+    for _ in range(10):
+        await bucket.acquire()
+    bucket.pause_until(time.time() + 30)
+
+    with patch('oryxbot.rate_limit.time.time', side_effect=[bucket._resume_at - 30] + [bucket._resume_at] * 10):
+        for _ in range(10):
+            await bucket.acquire()
+    # a single wait for the reset, the window allows a full burst after it
+    assert sleep.call_count == 1
+
+
+def test_bucket_pause_without_reset():
+    bucket = TokenBucket(100, 1)
+    bucket.pause_until(None, default=60)
+    assert bucket._resume_at == pytest.approx(time.time() + 60, abs=1)
+    assert bucket._tokens == 0
@@ -16,6 +16,7 @@ async def test_s3_get(env, session):
 
     async with s3_client() as (get, put):
         assert await get('test') == {"test": 123}
+        assert await get('test', raw=True) == b'{"test": 123}'
 
 
 @pytest.mark.asyncio
@@ -31,6 +32,7 @@ async def test_s3_get_no_data(env, session):
 
     async with s3_client() as (get, put):
         assert await get('test') == {}
+        assert await get('test', raw=True) == b''
 
 
 @pytest.mark.asyncio
@@ -59,4 +61,17 @@ async def test_s3_put(env, session):
     async with s3_client() as (get, put):
         await put('test', {"test": 123})
 
-    assert client.return_value.put_object.called
\ No newline at end of file
+    assert client.return_value.put_object.called
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.s3_util.get_session')
+@patch('oryxbot.s3_util.os.environ')
+async def test_s3_put_raw(env, session):
+    client = AsyncMock()
+    session.return_value.create_client.return_value = AsyncMock(__aenter__=client)
+
+    async with s3_client() as (get, put):
+        await put('test', b'raw')
+
+    assert client.return_value.put_object.call_args.kwargs['Body'].read() == b'raw'
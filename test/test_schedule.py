@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from oryxbot.schedule import PollSchedule, SummaryScheduler
+
+
+def test_poll_schedule():
+    polls = PollSchedule(min_interval=60, max_interval=300, backoff=2)
+    assert [polls.next(False) for _ in range(4)] == [120, 240, 300, 300]
+    assert polls.next(True) == 60
+    assert polls.next(False) == 120
+
+
+def test_summary_scheduler():
+    # 2023-07-02 is a sunday
+    summaries = SummaryScheduler(datetime(2023, 7, 2, 9), hour=8, summaries={1: None, 7: 0})
+    assert summaries.due(datetime(2023, 7, 2, 23)) == []
+    assert summaries.until_next(datetime(2023, 7, 2, 23)) == 9 * 3600
+
+    assert summaries.due(datetime(2023, 7, 3, 8, 5)) == [1, 7]
+    assert summaries.due(datetime(2023, 7, 3, 9)) == []
+    assert summaries.due(datetime(2023, 7, 4, 8)) == [1]
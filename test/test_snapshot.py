@@ -0,0 +1,86 @@
+import json
+from dataclasses import asdict
+
+import pytest
+
+from oryxbot.parser import Loss
+from oryxbot.snapshot import PageSnapshot, LEGACY_ITEM, SnapshotDelta, apply_delta, decode_delta, decode_snapshots, \
+    encode_delta, encode_snapshots, snapshot_delta
+
+LOSS_1 = Loss(type='T-72B', status='destroyed', number=1, link='http://a')
+LOSS_2 = Loss(type='T-72B', status='destroyed', number=2, link='http://b')
+LOSS_3 = Loss(type='BMP-2', status='captured', number=1, link='http://c')
+
+ROW_1 = ('T-72B', 'destroyed', 1, 'http://a')
+ROW_2 = ('T-72B', 'destroyed', 2, 'http://b')
+ROW_3 = ('BMP-2', 'captured', 1, 'http://c')
+
+
+def test_legacy_snapshot():
+    snapshot = PageSnapshot.from_json([asdict(LOSS_1), asdict(LOSS_3)])
+    assert snapshot.items == {LEGACY_ITEM: [ROW_1, ROW_3]}
+
+    new, added = snapshot.update([('a', [LOSS_1, LOSS_2]), ('b', [LOSS_3])])
+
+    assert added == [LOSS_2]
+    assert new.items == {'a': [ROW_1, ROW_2], 'b': [ROW_3]}
+    assert PageSnapshot.from_json({}).items == PageSnapshot.from_json([]).items == {}
+
+
+def test_update_only_changed_items():
+    snapshot = PageSnapshot.from_json({'a': [asdict(LOSS_1)], 'b': [asdict(LOSS_3)]})
+
+    new, added = snapshot.update([('c', [LOSS_1, LOSS_2]), ('b', None)])
+
+    assert added == [LOSS_2]
+    assert new.items == {'c': [ROW_1, ROW_2], 'b': [ROW_3]}
+
+
+def test_update_unchanged():
+    snapshot = PageSnapshot.from_json({'a': [asdict(LOSS_1)]})
+
+    new, added = snapshot.update([('a', None)])
+
+    assert added == []
+    assert new == snapshot
+
+
+def test_update_known_items_parsed_anyway():
+    snapshot = PageSnapshot.from_json({'a': [asdict(LOSS_1)]})
+
+    new, added = snapshot.update([('a', [LOSS_1]), ('b', [LOSS_2])])
+
+    assert added == [LOSS_2]
+    assert new.items == {'a': [ROW_1], 'b': [ROW_2]}
+
+
+def test_encode_decode():
+    pages = {'russian': PageSnapshot({'a': [ROW_1, ROW_2], 'b': [], 'c': [ROW_3]}),
+             'ukrainian': PageSnapshot({'d': [ROW_3]})}
+
+    assert decode_snapshots(encode_snapshots(pages)) == pages
+
+
+def test_decode_legacy():
+    assert decode_snapshots(b'') == {}
+    assert decode_snapshots(json.dumps({'russian': [asdict(LOSS_1)]}).encode()) == \
+           {'russian': PageSnapshot({LEGACY_ITEM: [ROW_1]})}
+    assert decode_snapshots(json.dumps({'russian': {'a': [asdict(LOSS_1)]}}).encode()) == \
+           {'russian': PageSnapshot({'a': [ROW_1]})}
+
+
+def test_decode_unknown_version():
+    with pytest.raises(ValueError):
+        decode_snapshots(b'ORYX\x63')
+
+
+def test_delta():
+    old = {'russian': PageSnapshot({'a': [ROW_1], 'b': [ROW_2]}), 'ukrainian': PageSnapshot({'d': [ROW_3]})}
+    new = {'russian': PageSnapshot({'a': [ROW_1], 'c': [ROW_2, ROW_3]}), 'ukrainian': PageSnapshot({'d': [ROW_3]})}
+
+    delta = snapshot_delta(old, new)
+
+    assert delta == SnapshotDelta(added={'russian': PageSnapshot({'c': [ROW_2, ROW_3]})}, removed={'russian': ['b']})
+    assert decode_delta(encode_delta(delta)) == delta
+    assert apply_delta(old, delta) == new
+    assert not snapshot_delta(new, new)
@@ -0,0 +1,73 @@
+import hashlib
+
+import pytest
+from mock import MagicMock
+
+from oryxbot.parser import Loss
+from oryxbot.source_util import SourceState, fetch_source
+
+BODY = b"<html><body><ul><li><img/>1 T-72B: <a href='http://a'>(1, destroyed)</a></li></ul></body></html>"
+
+
+def _response(status: int, body: bytes = b'', headers: dict = None):
+    call = MagicMock()
+
+    async def chunks(_):
+        yield body
+
+    call.__aenter__.return_value.status = status
+    call.__aenter__.return_value.raise_for_status = MagicMock()
+    call.__aenter__.return_value.headers = headers or {}
+    call.__aenter__.return_value.content.iter_chunked = chunks
+    return call
+
+
+@pytest.mark.asyncio
+async def test_fetch_not_modified():
+    session = MagicMock()
+    session.get.side_effect = [_response(304)]
+    state = SourceState(etag='"1"', last_modified='Sat, 01 Jul 2023 00:00:00 GMT', digest='abc')
+
+    page = await fetch_source(session, 'http://test', state)
+
+    assert not page.changed
+    assert page.state == state
+    assert session.get.call_args.kwargs['headers'] == {'If-None-Match': '"1"',
+                                                       'If-Modified-Since': 'Sat, 01 Jul 2023 00:00:00 GMT'}
+
+
+@pytest.mark.asyncio
+async def test_fetch_same_digest():
+    session = MagicMock()
+    session.get.side_effect = [_response(200, BODY, {'ETag': '"2"'})]
+
+    page = await fetch_source(session, 'http://test', SourceState(digest=hashlib.sha256(BODY).hexdigest()))
+
+    assert not page.changed
+    assert page.state.etag == '"2"'
+    assert session.get.call_args.kwargs['headers'] == {}
+
+
+@pytest.mark.asyncio
+async def test_fetch_changed():
+    session = MagicMock()
+    session.get.side_effect = [_response(200, BODY)]
+
+    page = await fetch_source(session, 'http://test', SourceState(digest='abc'))
+
+    assert page.changed
+    assert [losses for _, losses in page.items] == [[Loss(type='T-72B', status='destroyed', number=1, link='http://a')]]
+    assert page.state == SourceState(digest=hashlib.sha256(BODY).hexdigest())
+
+
+@pytest.mark.asyncio
+async def test_fetch_known_items():
+    session = MagicMock()
+    session.get.side_effect = [_response(200, BODY), _response(200, BODY)]
+
+    page = await fetch_source(session, 'http://test', SourceState())
+    known = {fingerprint for fingerprint, _ in page.items}
+    page = await fetch_source(session, 'http://test', SourceState(), known)
+
+    assert page.changed
+    assert [losses for _, losses in page.items] == [None]
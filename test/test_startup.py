@@ -0,0 +1,13 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_publishing_libraries_not_loaded_at_startup():
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    out = subprocess.run([sys.executable, '-c', 'import sys, oryxbot.main; print("\\n".join(sys.modules))'],
+                         env=env, capture_output=True, text=True, check=True).stdout
+    loaded = {name.split('.')[0] for name in out.split()}
+    assert not loaded & {'tweepy', 'tweety', 'PIL', 'waybackpy', 'aiobotocore', 'botocore'}
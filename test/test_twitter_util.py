@@ -1,19 +1,307 @@
-from mock import patch
+from datetime import datetime
+
+from mock import patch, AsyncMock, MagicMock
 import pytest
+from tweepy import BadRequest, Forbidden, TooManyRequests
+
+from oryxbot.aggregation import count_losses
+from oryxbot.client_util import ClientRegistry
+from oryxbot.image_resolver import MediaCache
+from oryxbot.outbox import Outbox
+from oryxbot.rate_limit import TokenBucket
+from oryxbot.twitter_util import publish_date_diff, publish_outbox, publications, Loss, _batch_text, _batches, \
+    _create_tweet, _tweet_length
+
+
+async def _publish(losses, outbox: Outbox = None) -> Outbox:
+    outbox = Outbox() if outbox is None else outbox
+    await outbox.add(publications(losses, '1'))
+    await publish_outbox(outbox)
+    return outbox
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.twitter_util.CLIENTS', new_callable=ClientRegistry)
+@patch('tweepy.Client')
+async def test_publish_losses(client, clients):
+    with patch('oryxbot.client_util.os.environ'):
+        outbox = await _publish([('ru', Loss(type='test', status='ok', number=1, link='http://foo'))])
+
+    assert client.return_value.create_tweet.call_count == 1
+    assert not outbox.pending()
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.twitter_util.image_resolver.MEDIA_CACHE', new_callable=MediaCache)
+@patch('oryxbot.image_resolver.resolve', new_callable=AsyncMock)
+@patch('oryxbot.twitter_util.CLIENTS', new_callable=ClientRegistry)
+@patch('tweepy.Client')
+async def test_publish_losses_exception(client, clients, resolve, cache):
+    resolve.return_value = []
+    client.return_value.create_tweet.side_effect = BadRequest(MagicMock(status_code=400), response_json={})
+    losses = [('ru', Loss(type='test', status='fail', number=1, link='http://foo'))]
+
+    outbox = Outbox(max_attempts=2)
+    with patch('oryxbot.client_util.os.environ'), pytest.raises(BadRequest):
+        await _publish(losses, outbox)
+    assert outbox.attempts == {outbox.items[0].key: 1}
+
+    # moved aside on the second failure
+    with patch('oryxbot.client_util.os.environ'):
+        await publish_outbox(outbox)
+    assert [text for (_, _, text, _, _), error in outbox.failed] == ['ru test fail: http://foo']
+    assert not outbox.pending()
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.twitter_util.TWEET_RETRIES', 0)
+@patch('oryxbot.twitter_util.image_resolver.MEDIA_CACHE', new_callable=MediaCache)
+@patch('oryxbot.image_resolver.resolve', new_callable=AsyncMock)
+@patch('oryxbot.twitter_util.CLIENTS', new_callable=ClientRegistry)
+@patch('tweepy.Client')
+async def test_publish_losses_rate_limited_runs(client, clients, resolve, cache):
+    resolve.return_value = []
+    client.return_value.create_tweet.side_effect = TooManyRequests(MagicMock(status_code=429, headers={}),
+                                                                   response_json={})
+    outbox = Outbox(max_attempts=2)
+    await outbox.add(publications([('ru', Loss(type='test', status='ok', number=1, link='http://foo'))], '1'))
+
+    for _ in range(3):
+        with patch('oryxbot.client_util.os.environ'), pytest.raises(TooManyRequests):
+            await publish_outbox(outbox)
+
+    # rate limits aren't held against the publication, it is posted once the limit is lifted
+    assert outbox.pending() == outbox.items
+    assert not outbox.attempts and not outbox.failed
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.twitter_util.image_resolver.MEDIA_CACHE', new_callable=MediaCache)
+@patch('oryxbot.image_resolver.resolve', new_callable=AsyncMock)
+@patch('oryxbot.twitter_util.CLIENTS', new_callable=ClientRegistry)
+@patch('tweepy.Client')
+async def test_publish_losses_duplicate(client, clients, resolve, cache):
+    resolve.return_value = []
+    duplicate = Forbidden(MagicMock(status_code=403),
+                          response_json={'detail': 'You are not allowed to create a Tweet with duplicate content.'})
+    client.return_value.create_tweet.side_effect = [duplicate, MagicMock(data={'id': '1'})]
+    losses = [('ru', Loss(type='test', status='ok', number=idx, link=f'http://foo/{idx}')) for idx in range(2)]
+
+    with patch('oryxbot.client_util.os.environ'):
+        outbox = await _publish(losses)
+
+    assert client.return_value.create_tweet.call_count == 2
+    assert not outbox.pending() and not outbox.failed
+
+
+@pytest.mark.asyncio
+@patch('tweepy.API')
+@patch('tweepy.OAuthHandler')
+@patch('oryxbot.twitter_util.CLIENTS', new_callable=ClientRegistry)
+@patch('tweepy.Client')
+@patch('oryxbot.twitter_util.text_renderer')
+async def test_publish_date_diff(text_renderer, client, clients, oauth, api):
+    losses = count_losses([
+        ('russian', Loss(type='T-72B', status='destroyed', number=1, link='http://a')),
+        ('russian', Loss(type='BMP-2', status='captured', number=1, link='http://b')),
+        ('russian', Loss(type='T-72B', status='captured', number=2, link='http://c')),
+        ('ukrainian', Loss(type='T-64BV', status='damaged', number=4, link='http://d')),
+    ])
+    text_renderer.return_value.render_png.return_value = [b'1', b'2', b'3', b'4', b'5']
+    api.return_value.media_upload.side_effect = lambda filename, file: MagicMock(media_id_string=file.read())
+    with patch('oryxbot.client_util.os.environ'):
+        await publish_date_diff(losses, datetime(2023, 7, 1))
+
+    items = text_renderer.return_value.render_png.call_args.args[0]
+    assert items[1:] == [['Russian losses: 3', 'Ukrainian losses: 1'],
+                         ['BMP-2 total: 1, captured: 1', 'T-64BV total: 1, damaged: 1'],
+                         ['T-72B total: 2, destroyed: 1, captured: 1', None]]
+    first, second = client.return_value.create_tweet.call_args_list
+    assert first.kwargs['media_ids'] == [b'1', b'2', b'3', b'4']
+    assert second.kwargs['media_ids'] == [b'5']
+    assert second.kwargs['in_reply_to_tweet_id'] == client.return_value.create_tweet.return_value.data['id']
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.twitter_util.image_resolver.MEDIA_CACHE', new_callable=MediaCache)
+@patch('oryxbot.image_resolver.resolve', new_callable=AsyncMock)
+@patch('oryxbot.twitter_util.CLIENTS', new_callable=ClientRegistry)
+@patch('tweepy.Client')
+async def test_publish_losses_rate_limited(client, clients, resolve, cache):
+    clock = Clock()
+    resolve.side_effect = lambda session, link: [link]
+    limited = TooManyRequests(MagicMock(status_code=429, headers={'x-rate-limit-reset': '1120'}), response_json={})
+    client.return_value.create_tweet.side_effect = [None, limited, None]
+    losses = [('ru', Loss(type='test', status='ok', number=idx, link=f'http://foo/{idx}')) for idx in range(2)]
+
+    with patch('oryxbot.client_util.os.environ'), patch('oryxbot.rate_limit.time', clock), \
+            patch('oryxbot.twitter_util.time', clock), patch('oryxbot.rate_limit.asyncio.sleep', clock.sleep):
+        await _publish(losses)
+
+    assert [c.kwargs['media_ids'] for c in client.return_value.create_tweet.call_args_list] == \
+           [['http://foo/0'], ['http://foo/1'], ['http://foo/1']]
+    assert clock.now == 1120
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.twitter_util.TWEET_RETRIES', 2)
+async def test_create_tweet_backoff():
+    clock = Clock()
+    client = MagicMock()
+    # the reset time has already passed
+    client.create_tweet.side_effect = TooManyRequests(MagicMock(status_code=429, headers={'x-rate-limit-reset': '900'}),
+                                                      response_json={})
+
+    with patch('oryxbot.rate_limit.time', clock), patch('oryxbot.twitter_util.time', clock), \
+            patch('oryxbot.rate_limit.asyncio.sleep', clock.sleep), pytest.raises(TooManyRequests):
+        await _create_tweet(client, TokenBucket(10, 10), text='test')
+
+    assert client.create_tweet.call_count == 3
+    assert clock.now >= 1003
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.twitter_util.image_resolver.MEDIA_CACHE', new_callable=MediaCache)
+@patch('oryxbot.image_resolver.resolve', new_callable=AsyncMock)
+@patch('oryxbot.twitter_util.CLIENTS', new_callable=ClientRegistry)
+@patch('tweepy.Client')
+async def test_publish_losses_without_media(client, clients, resolve, cache):
+    resolve.return_value = ['media']
+    client.return_value.create_tweet.side_effect = [BadRequest(MagicMock(status_code=400), response_json={}), None]
+
+    with patch('oryxbot.client_util.os.environ'):
+        await _publish([('ru', Loss(type='test', status='ok', number=1, link='http://foo'))])
+
+    assert [c.kwargs['media_ids'] for c in client.return_value.create_tweet.call_args_list] == [['media'], None]
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.twitter_util.image_resolver.MEDIA_CACHE', new_callable=MediaCache)
+@patch('oryxbot.image_resolver.resolve', new_callable=AsyncMock)
+@patch('oryxbot.twitter_util.CLIENTS', new_callable=ClientRegistry)
+@patch('tweepy.Client')
+async def test_publish_losses_shared_link(client, clients, resolve, cache):
+    resolve.return_value = ['media']
+    losses = [('ru', Loss(type='test', status='ok', number=idx, link='http://foo')) for idx in range(3)]
+
+    with patch('oryxbot.client_util.os.environ'):
+        await _publish(losses)
 
-from oryxbot.twitter_util import publish_losses, Loss
+    assert resolve.call_count == 1
+    assert client.return_value.create_tweet.call_count == 3
+
+
+def test_batches():
+    losses = [('ru', Loss(type='tank', status='destroyed', number=idx, link=f'http://t/{idx // 2}')) for idx in range(10)]
+    losses.append(('ua', Loss(type='ifv', status='captured', number=1, link='http://i')))
+    losses.append(('ru', Loss(type='ifv', status='damaged', number=1, link='http://i')))
+
+    batches = _batches(losses)
+    assert list(batches) == ['ru', 'ua']
+    assert [(type_, [len(same) for same in batch]) for type_, batch in batches['ru']] == \
+           [('tank', [2, 2, 2, 2]), ('tank', [2]), ('ifv', [1])]
+    assert batches['ua'][0][1] == [[losses[10][1]]]
+    assert _batch_text('tank', batches['ru'][0][1]).splitlines()[1] == 'destroyed x2: http://t/0'
+
+
+def test_batches_fit_tweet():
+    link = 'https://i.postimg.cc/' + 'x' * 100
+    losses = [('ru', Loss(type='T' * 140, status=status, number=idx, link=f'{link}/{idx}'))
+              for idx, status in enumerate(['destroyed', 'abandoned and captured', 'damaged and abandoned'] * 2)]
+
+    batches = _batches(losses)['ru']
+    assert [len(batch) for _, batch in batches] == [3, 3]
+    assert all(len(_batch_text(type_, batch)) > 280 and _tweet_length(_batch_text(type_, batch)) <= 280
+               for type_, batch in batches)
+    assert _tweet_length(_batch_text('T' * 300, batches[0][1])) == 280
 
 
 @pytest.mark.asyncio
-@patch('oryxbot.twitter_util.Client')
-async def test_publish_losses(client):
-    with patch('oryxbot.twitter_util.os.environ'):
-        await publish_losses([('ru', Loss(type='test', status='ok', number=1, link='http://foo'))])
+@patch('oryxbot.twitter_util.BATCH_THRESHOLD', 5)
+@patch('oryxbot.twitter_util.image_resolver.MEDIA_CACHE', new_callable=MediaCache)
+@patch('oryxbot.image_resolver.resolve', new_callable=AsyncMock)
+@patch('oryxbot.twitter_util.CLIENTS', new_callable=ClientRegistry)
+@patch('tweepy.Client')
+async def test_publish_losses_batched(client, clients, resolve, cache):
+    resolve.side_effect = lambda session, link: [link, link]
+    client.return_value.create_tweet.side_effect = [MagicMock(data={'id': str(idx)}) for idx in range(4)]
+    losses = [('ru', Loss(type='tank', status='destroyed', number=idx, link=f'http://t/{idx}')) for idx in range(6)]
+
+    with patch('oryxbot.client_util.os.environ'):
+        await _publish(losses)
+
+    calls = client.return_value.create_tweet.call_args_list
+    assert len(calls) == 4
+    assert calls[0].kwargs == {'text': 'ru losses: 6'}
+    assert calls[1].kwargs['media_ids'] == ['http://t/0', 'http://t/0', 'http://t/1', 'http://t/1']
+    assert calls[1].kwargs['text'].splitlines() == ['tank:'] + [f'destroyed: http://t/{idx}' for idx in range(4)]
+    # media not fitting into the tweet follows in a reply
+    assert calls[2].kwargs == {'media_ids': ['http://t/2', 'http://t/2', 'http://t/3', 'http://t/3'],
+                               'in_reply_to_tweet_id': '1'}
+    assert [c.kwargs['in_reply_to_tweet_id'] for c in calls[1:]] == ['0', '1', '2']
+    assert resolve.call_count == 6
 
 
 @pytest.mark.asyncio
-@patch('oryxbot.twitter_util.Client')
-async def test_publish_losses_exception(client):
-    client.create_tweet.side_effect = [Exception("fail")]
-    with patch('oryxbot.twitter_util.os.environ'):
-        await publish_losses([('ru', Loss(type='test', status='fail', number=1, link='http://foo'))])
+@patch('oryxbot.twitter_util.BATCH_THRESHOLD', 5)
+@patch('oryxbot.twitter_util.image_resolver.MEDIA_CACHE', new_callable=MediaCache)
+@patch('oryxbot.image_resolver.resolve', new_callable=AsyncMock)
+@patch('oryxbot.twitter_util.CLIENTS', new_callable=ClientRegistry)
+@patch('tweepy.Client')
+async def test_publish_outbox_resumes(client, clients, resolve, cache):
+    resolve.side_effect = lambda session, link: [link]
+    client.return_value.create_tweet.side_effect = [MagicMock(data={'id': '2'})]
+    losses = [('ru', Loss(type='tank', status='destroyed', number=idx, link=f'http://t/{idx}')) for idx in range(6)]
+    outbox = Outbox()
+    items = publications(losses, '1')
+    await outbox.add(items)
+    await outbox.confirm(items[0], '0')
+    await outbox.confirm(items[1], '1')
+
+    with patch('oryxbot.client_util.os.environ'):
+        await publish_outbox(outbox)
+
+    calls = client.return_value.create_tweet.call_args_list
+    assert len(calls) == 1
+    assert calls[0].kwargs['in_reply_to_tweet_id'] == '1'
+    assert calls[0].kwargs['media_ids'] == ['http://t/4', 'http://t/5']
+    assert resolve.call_count == 2
+    assert not outbox.pending()
+
+
+@pytest.mark.asyncio
+@patch('oryxbot.twitter_util.image_resolver.MEDIA_CACHE', new_callable=MediaCache)
+@patch('oryxbot.image_resolver.resolve', new_callable=AsyncMock)
+@patch('oryxbot.twitter_util.CLIENTS', new_callable=ClientRegistry)
+@patch('tweepy.Client')
+async def test_publish_outbox_failed_country(client, clients, resolve, cache):
+    resolve.return_value = []
+
+    def create_tweet(text, **kwargs):
+        if text.startswith('ru'):
+            raise Exception("fail")
+
+    client.return_value.create_tweet.side_effect = create_tweet
+    outbox = Outbox()
+    await outbox.add(publications([('ru', Loss(type='tank', status='ok', number=1, link='http://r/1')),
+                                   ('ua', Loss(type='ifv', status='ok', number=1, link='http://u/1')),
+                                   ('ru', Loss(type='tank', status='ok', number=2, link='http://r/2'))], '1'))
+
+    with patch('oryxbot.client_util.os.environ'), pytest.raises(Exception, match="fail"):
+        await publish_outbox(outbox)
+
+    assert [item.text for item in outbox.pending()] == ['ru tank ok: http://r/1', 'ru tank ok: http://r/2']
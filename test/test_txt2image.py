@@ -1,9 +1,33 @@
 import os
+from io import BytesIO
 
-from oryxbot.txt2image import text_to_image
+from PIL import Image, ImageFont
+
+from oryxbot.txt2image import TextRenderer, text_to_image
 
 
 def test_text_to_image():
     path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'fonts', 'arial.ttf')
     img = text_to_image([["test"]], path, 10, (200, 200, 200), (0, 0, 0))
     assert img.size == (46, 41)
+
+
+def test_render_pages():
+    renderer = TextRenderer(ImageFont.load_default(), (200, 200, 200), (0, 0, 0))
+    items = [["title"], ["left", "right"]] + [[f"row {idx}", None] for idx in range(10)]
+
+    single = renderer.render(items)
+    assert single.size[1] == len(items) * renderer.line_height - renderer.spacing + 30
+
+    pages = renderer.render_pages(items, header=2, max_height=30 + 6 * renderer.line_height)
+    assert [page.size[1] for page in pages] == [renderer.render(items[:6]).size[1]] * 2 + \
+           [renderer.render(items[:4]).size[1]]
+    assert all(page.size[1] <= 30 + 6 * renderer.line_height for page in pages)
+
+
+def test_render_png():
+    renderer = TextRenderer(ImageFont.load_default(), (200, 200, 200), (0, 0, 0))
+    png, = renderer.render_png([["test"]])
+    img = Image.open(BytesIO(png))
+    assert img.format == 'PNG'
+    assert img.size == renderer.render([["test"]]).size